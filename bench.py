@@ -0,0 +1,323 @@
+from argparse import ArgumentParser
+
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database
+import server
+
+
+"""
+Schema of example_dbs/reg.sqlite, used for generated benchmark databases.
+"""
+SCHEMA = [
+    "CREATE TABLE classes (classid INTEGER DEFAULT NULL, courseid INTEGER DEFAULT NULL, days TEXT DEFAULT NULL, starttime TEXT DEFAULT NULL, endtime TEXT DEFAULT NULL, bldg TEXT DEFAULT NULL, roomnum TEXT DEFAULT NULL)",
+    "CREATE INDEX classes_courseid_index ON classes (courseid)",
+    "CREATE TABLE courses (courseid INTEGER DEFAULT NULL, area TEXT DEFAULT NULL, title TEXT DEFAULT NULL, descrip TEXT DEFAULT NULL, prereqs TEXT DEFAULT NULL)",
+    "CREATE INDEX courses_courseid_index ON courses (courseid)",
+    "CREATE TABLE coursesprofs (courseid INTEGER DEFAULT NULL, profid INTEGER DEFAULT NULL)",
+    "CREATE INDEX coursesprofs_courseid_index ON coursesprofs (courseid)",
+    "CREATE INDEX coursesprofs_profid_index ON coursesprofs (profid)",
+    "CREATE TABLE crosslistings (courseid INTEGER DEFAULT NULL, dept TEXT DEFAULT NULL, coursenum TEXT DEFAULT NULL)",
+    "CREATE INDEX crosslistings_courseid_index ON crosslistings (courseid)",
+    "CREATE TABLE profs (profid INTEGER DEFAULT NULL, profname TEXT DEFAULT NULL)",
+    "CREATE INDEX profs_profid_index ON profs (profid)",
+]
+
+JOIN_SPEC = ("courses", ["crosslistings", "coursesprofs", "profs"],
+             [[("courses", "courseid", "crosslistings", "courseid")],
+              [("courses", "courseid", "coursesprofs", "courseid")],
+              [("coursesprofs", "profid", "profs", "profid")]])
+
+DAYS = ["M", "T", "W", "Th", "F", "MW", "TTh", "MWF"]
+TIMES = [("08:30 AM", "09:20 AM"), ("10:00 AM", "10:50 AM"), ("11:00 AM", "12:20 PM"),
+         ("01:30 PM", "04:20 PM"), ("07:30 PM", "10:20 PM")]
+BLDGS = ["CHANC", "MARXH", "STANH", "ARCHB", "MCCOH", "FRIEN", "EQUAD", "JADWH"]
+AREAS = ["LA", "SA", "HA", "EM", "EC", "QR", "STL", "STN", "CD", ""]
+DEPTS = ["AAS", "COS", "ECO", "ENG", "HIS", "MAT", "MUS", "PHY", "POL", "REL"]
+WORDS = ["music", "history", "theory", "modern", "systems", "data", "culture", "politics",
+         "introduction", "advanced", "seminar", "analysis", "design", "american", "global"]
+
+INSERT_BATCH = 10000
+
+
+"""
+Yields rows from make_row(i) for i in range(count), in lists of INSERT_BATCH.
+"""
+def _batches(count, make_row):
+    for start in range(0, count, INSERT_BATCH):
+        yield [make_row(i) for i in range(start, min(start + INSERT_BATCH, count))]
+
+
+"""
+Copies the database at source to destination with SQLite's backup API, which
+gives a consistent copy even while other connections write to source.
+"""
+def copy_database(source, destination):
+    with contextlib.closing(sqlite3.connect(source)) as source_conn:
+        with contextlib.closing(sqlite3.connect(destination)) as destination_conn:
+            source_conn.backup(destination_conn)
+
+
+"""
+Writes a database with the schema of reg.sqlite to path, with rows rows in
+classes and the other tables sized in the same proportions as reg.sqlite.
+The contents depend only on rows and seed.
+"""
+def generate(path, rows, seed=0):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    num_courses = max(1, rows * 1158 // 1494)
+    num_profs = max(1, rows * 863 // 1494)
+
+    def title(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+    def make_class(i):
+        start, end = rng.choice(TIMES)
+        return (i, rng.randrange(num_courses), rng.choice(DAYS), start, end,
+                rng.choice(BLDGS), str(rng.randrange(1, 400)))
+
+    def make_course(i):
+        return (i, rng.choice(AREAS), title(rng.randrange(2, 6)), title(rng.randrange(20, 60)), "")
+
+    with contextlib.closing(sqlite3.connect(path)) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for batch in _batches(rows, make_class):
+            conn.executemany("INSERT INTO classes VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+        for batch in _batches(num_courses, make_course):
+            conn.executemany("INSERT INTO courses VALUES (?, ?, ?, ?, ?)", batch)
+        for batch in _batches(num_courses * 1491 // 1158,
+                              lambda i: (rng.randrange(num_courses), rng.choice(DEPTS), str(rng.randrange(100, 600)))):
+            conn.executemany("INSERT INTO crosslistings VALUES (?, ?, ?)", batch)
+        for batch in _batches(num_courses * 1241 // 1158,
+                              lambda i: (rng.randrange(num_courses), rng.randrange(num_profs))):
+            conn.executemany("INSERT INTO coursesprofs VALUES (?, ?)", batch)
+        for batch in _batches(num_profs, lambda i: (i, f"Professor {title(2)} {i}")):
+            conn.executemany("INSERT INTO profs VALUES (?, ?)", batch)
+        conn.commit()
+
+
+"""
+Returns the peak resident set size of this process in kilobytes.
+"""
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+"""
+Returns the pct percentile of a sorted list using the nearest-rank method.
+"""
+def percentile(values, pct):
+    index = max(0, min(len(values) - 1, -(-len(values) * pct // 100) - 1))
+    return values[int(index)]
+
+
+"""
+Times fn over repeat runs. fn returns the number of rows it processed.
+setup, if given, runs untimed before every run.
+:return: A dictionary of latency percentiles in milliseconds, throughput in
+         rows per second and the growth of peak RSS during the runs.
+"""
+def measure(fn, repeat, setup=None):
+    timings = []
+    total_rows = 0
+    rss_before = peak_rss_kb()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        total_rows += fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    total_time = sum(timings)
+    return {
+        "runs": repeat,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(total_time / repeat * 1000, 3),
+        "rows_per_sec": round(total_rows / total_time, 1) if total_time > 0 else None,
+        "peak_rss_growth_kb": peak_rss_kb() - rss_before
+    }
+
+
+"""
+Runs every benchmark against the database at db_file.
+Tables larger than max_materialize rows are not loaded whole by get_all.
+:return: A dictionary mapping benchmark names to the results of measure.
+"""
+def run_benchmarks(db_file, repeat, mutations, max_materialize):
+    results = {}
+    with contextlib.closing(sqlite3.connect(db_file)) as conn:
+        num_rows = conn.execute("SELECT COUNT(*) FROM classes").fetchone()[0]
+
+    if num_rows <= max_materialize:
+        results["get_all"] = measure(lambda: len(database.get_all(db_file, "classes")), repeat)
+    results["iter_all"] = measure(lambda: sum(1 for _ in database.iter_all(db_file, "classes")), repeat)
+    results["get_page"] = measure(lambda: len(database.get_page(db_file, "classes", 200)[0]), repeat)
+    results["join"] = measure(lambda: len(database.join(db_file, *JOIN_SPEC)), repeat,
+                              setup=database.clear_join_cache)
+    results["join_cached"] = measure(lambda: len(database.join(db_file, *JOIN_SPEC)), repeat)
+
+    rows = [{"classid": -i, "courseid": -i, "days": "M", "starttime": "08:30 AM", "endtime": "09:20 AM",
+             "bldg": "BENCH", "roomnum": str(i)} for i in range(1, mutations + 1)]
+
+    def insert():
+        for row in rows:
+            database.insert(db_file, "classes", row)
+        return len(rows)
+
+    def update():
+        for row in rows:
+            database.update(db_file, "classes", {"roomnum": "0"}, {"courseid": row["courseid"], "bldg": "BENCH"})
+        return len(rows)
+
+    def delete():
+        for row in rows:
+            database.delete(db_file, "classes", {"courseid": row["courseid"], "bldg": "BENCH"})
+        return len(rows)
+
+    results["insert"] = measure(insert, 1)
+    results["update"] = measure(update, 1)
+    results["delete"] = measure(delete, 1)
+    results["bulk_insert"] = measure(lambda: database.bulk_insert(db_file, "classes", rows), 1)
+    results["bulk_delete"] = measure(lambda: database.bulk_delete(db_file, "classes", rows), 1)
+
+    server.DB_URL = db_file
+    client = server.app.test_client()
+    join_body = {"prim_table": JOIN_SPEC[0], "tables": JOIN_SPEC[1], "identifiers": JOIN_SPEC[2]}
+
+    def request(method, url, **kwargs):
+        response = getattr(client, method)(url, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        return response
+
+    results["http_get_tables"] = measure(lambda: len(request("get", "/api/get_tables").json), repeat)
+    results["http_get_page"] = measure(
+        lambda: len(request("get", "/api/get_page/classes?format=columnar").json["rows"]), repeat)
+    if num_rows <= max_materialize:
+        results["http_get_all"] = measure(
+            lambda: len(request("get", "/api/get_all/classes?format=columnar").json["rows"]), repeat)
+        results["http_join"] = measure(
+            lambda: len(request("post", "/api/join?format=columnar", json=join_body).json["rows"]), repeat,
+            setup=database.clear_join_cache)
+    results["http_get_all_ndjson"] = measure(
+        lambda: request("get", "/api/get_all/classes?format=ndjson").data.count(b"\n") - 1, repeat)
+    return results
+
+
+"""
+Compares results against a baseline report. A benchmark regresses when its
+p50 latency grows, or its throughput drops, by more than threshold (a fraction).
+Benchmarks whose p50 moved by less than min_delta_ms are treated as noise.
+:return: A list of {"benchmark", "metric", "baseline", "current"} entries.
+"""
+def compare(results, baseline, threshold, min_delta_ms=1.0):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or current["p50_ms"] - previous["p50_ms"] < min_delta_ms:
+            continue
+        if current["p50_ms"] > previous["p50_ms"] * (1 + threshold):
+            regressions.append({"benchmark": name, "metric": "p50_ms",
+                                "baseline": previous["p50_ms"], "current": current["p50_ms"]})
+        if previous.get("rows_per_sec") and current.get("rows_per_sec") is not None \
+                and current["rows_per_sec"] * (1 + threshold) < previous["rows_per_sec"]:
+            regressions.append({"benchmark": name, "metric": "rows_per_sec",
+                                "baseline": previous["rows_per_sec"], "current": current["rows_per_sec"]})
+    return regressions
+
+
+def handle_args():
+    """
+    Handle and return arguments using ArgumentParser.
+    """
+    parser = ArgumentParser(prog=sys.argv[0],
+                            description="SQLite3 Web Browser benchmarks",
+                            allow_abbrev=False)
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="the number of rows in the generated classes table")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="the seed for the generated data")
+    parser.add_argument("--db", type=str,
+                        help="benchmark a copy of this database (with the reg.sqlite schema) instead of a generated one")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="the number of timed runs per benchmark")
+    parser.add_argument("--mutations", type=int, default=200,
+                        help="the number of rows inserted, updated and deleted")
+    parser.add_argument("--max-materialize", type=int, default=1000000,
+                        help="skip whole-table benchmarks above this many rows")
+    parser.add_argument("--output", type=str,
+                        help="write the JSON report to this file")
+    parser.add_argument("--baseline", type=str,
+                        help="compare against this JSON report and exit with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="the fraction by which a benchmark may get slower before it is flagged")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore p50 changes smaller than this many milliseconds")
+    return parser.parse_args()
+
+
+def main():
+    args = handle_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        generate_seconds = None
+        if args.db is None:
+            start = time.perf_counter()
+            generate(db_file, args.rows, args.seed)
+            generate_seconds = round(time.perf_counter() - start, 3)
+        else:
+            # The write benchmarks modify the database, so they run on a copy.
+            copy_database(args.db, db_file)
+
+        results = run_benchmarks(db_file, args.repeat, args.mutations, args.max_materialize)
+        database.close_connections()
+
+    report = {
+        "meta": {
+            "rows": args.rows if args.db is None else None,
+            "db": args.db,
+            "seed": args.seed,
+            "generate_seconds": generate_seconds,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "peak_rss_kb": peak_rss_kb()
+        },
+        "results": results
+    }
+
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        report["regressions"] = compare(results, baseline["results"], args.threshold, args.min_delta_ms)
+        if report["regressions"]:
+            exit_code = 1
+
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
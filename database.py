@@ -1,6 +1,23 @@
+import collections
 import contextlib
+import itertools
+import json
+import logging
+import math
+import concurrent.futures
 import os
+import queue
+import random
+import re
 import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
 
 
 """
@@ -38,28 +55,256 @@ class InvalidDB(DatabaseError):
         return f"InvalidDB: {self.error}"
 
 
+class QueryTimeout(DatabaseError):
+    def __init__(self, string):
+        self.error = string
+
+    def __str__(self):
+        return f"QueryTimeout: {self.error}"
+
+
+class TooManyRows(DatabaseError):
+    def __init__(self, string):
+        self.error = string
+
+    def __str__(self):
+        return f"TooManyRows: {self.error}"
+
+
+class DatabaseBusy(DatabaseError):
+    def __init__(self, string):
+        self.error = string
+
+    def __str__(self):
+        return f"DatabaseBusy: {self.error}"
+
+
+"""
+Pragma profiles applied to every new pooled connection.
+"default" leaves the journal mode alone since WAL mode is persistent and
+rewrites the database header; "wal" additionally enables WAL.
+"""
+PRAGMA_PROFILES = {
+    "default": {
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+}
+PRAGMA_PROFILES["wal"] = dict(PRAGMA_PROFILES["default"], journal_mode="WAL")
+_pragmas = dict(PRAGMA_PROFILES["default"])
+
+
+"""
+Shared connection pool, keyed by database file. At most POOL_SIZE
+connections are open per file; idle ones are reused across requests.
+"""
+POOL_SIZE = 16
+POOL_TIMEOUT = 30
+_pools = {}
+_pool_epoch = 0
+_pool_lock = threading.Lock()
+_pool_available = threading.Condition(_pool_lock)
+
+
+"""
+Limits on the work done for a single request. None disables a limit.
+QUERY_TIME_LIMIT is the number of seconds a statement may spend inside SQLite
+(executing and fetching, not waiting for the caller), checked every
+PROGRESS_INSTRUCTIONS virtual machine instructions. It applies to connections
+opened after it is set. MAX_RESULT_ROWS caps the rows of a materialized result.
+"""
+QUERY_TIME_LIMIT = None
+PROGRESS_INSTRUCTIONS = 10000
+MAX_RESULT_ROWS = None
+
+
+"""
+Write contention handling. Each connection waits up to BUSY_TIMEOUT seconds
+for a lock; a write transaction that still finds the database busy is retried
+up to WRITE_RETRIES times, backing off exponentially from WRITE_BACKOFF seconds.
+"""
+BUSY_TIMEOUT = 5.0
+WRITE_RETRIES = 3
+WRITE_BACKOFF = 0.05
+
+
+"""
+Group commit. When GROUP_COMMIT_WINDOW is set (in seconds), mutations are not
+committed by the thread making them but handed to one writer thread per
+database file. It waits up to the window for more mutations to arrive, then
+applies up to GROUP_COMMIT_MAX_BATCH of them in a single transaction, each in
+a savepoint of its own so that one failing mutation does not undo the others.
+"""
+GROUP_COMMIT_WINDOW = None
+GROUP_COMMIT_MAX_BATCH = 256
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+"""
+Snapshot mode. When SNAPSHOT_INTERVAL is set (in seconds), rows are read from
+an in-memory copy of each database file instead of the file. Writes go to the
+file, after which the copy is replaced with a fresh one; a background thread
+also replaces it when it finds, every SNAPSHOT_INTERVAL seconds, that another
+process has committed to the file.
+"""
+SNAPSHOT_INTERVAL = None
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+_snapshot_refresh_lock = threading.Lock()
+_snapshot_serial = itertools.count()
+_snapshot_poller = None
+
+
+"""
+Key under which rows returned to clients carry their rowid, so later updates
+and deletes can target the row with a single index seek.
+"""
+ROWID_KEY = "_rowid_"
+
+
+"""
+Number of rows read from a cursor at a time when iterating over results.
+"""
+FETCH_BATCH_SIZE = 1000
+
+"""
+Number of rows imported per transaction by import_rows. Only one batch is
+held in memory at a time.
+"""
+IMPORT_BATCH_SIZE = 5000
+
+
+"""
+Table recording the rowid of every row inserted, updated or deleted in a
+tracked table, in commit order. Its version column is the change version
+handed to clients. Only the latest CHANGE_LOG_SIZE entries are kept.
+"""
+CHANGE_LOG_TABLE = "_browser_changes"
+CHANGE_LOG_SIZE = 100000
+
+"""
+Prefix of the FTS5 tables indexing the text columns of searched tables (see
+search), and of their triggers. FTS5 keeps its data in shadow tables named
+after the index, which share the prefix.
+"""
+SEARCH_INDEX_PREFIX = "_browser_fts_"
+
+
+"""
+Connections used only to read PRAGMA data_version, keyed by database file.
+Each is numbered, since a new connection restarts the count.
+"""
+_watchers = {}
+_watcher_lock = threading.Lock()
+_watcher_serial = itertools.count()
+
+
+"""
+Cache of join results, keyed by the normalized join spec. Entries are evicted
+least recently used first once they take up more than JOIN_CACHE_BYTES, and
+are discarded when the database's data_version moves.
+"""
+JOIN_CACHE_BYTES = 64 * 1024 * 1024
+_join_cache = collections.OrderedDict()
+_join_cache_bytes = 0
+_join_cache_lock = threading.Lock()
+
+
+"""
+The first bytes of every SQLite database file, and the number of problems
+reported by the quick check of check_db.
+"""
+SQLITE_HEADER = b"SQLite format 3\x00"
+QUICK_CHECK_ERRORS = 10
+
+
+"""
+At most this many bytes of tables are read by warm_up, smallest tables first.
+"""
+WARM_UP_BYTES = 64 * 1024 * 1024
+
+"""
+PRAGMA optimize examines at most this many rows of each index it analyzes,
+and is run with the OPTIMIZE_ON_OPEN mask by optimize (see there).
+"""
+OPTIMIZE_ANALYSIS_LIMIT = 1000
+OPTIMIZE_ON_OPEN = 0x10002
+
+
+"""
+Process-wide cache of schema metadata, keyed by database file.
+Each entry records the file identity and PRAGMA schema_version it was
+read under, so it is only rebuilt when the schema actually changes.
+"""
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+
+"""
+Cache of the statistics gathered by get_stats, keyed by database file. Each
+entry holds the data_version it was gathered at and is dropped once that
+moves; row counts are filled in per table as they are needed.
+"""
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+
+"""
+Column profiles (see profile_table) are computed from a sample of at most
+PROFILE_SAMPLE_ROWS rows, read in runs of PROFILE_BLOCK_ROWS consecutive
+rowids starting at random points, and list the PROFILE_TOP_VALUES most
+common values. Join suggestions probe at most PROFILE_PROBE_VALUES sampled
+values. Profiles are cached per table until the data version moves.
+"""
+PROFILE_SAMPLE_ROWS = 10000
+PROFILE_BLOCK_ROWS = 100
+PROFILE_TOP_VALUES = 5
+PROFILE_PROBE_VALUES = 200
+_profile_cache = {}
+_profile_lock = threading.Lock()
+
+
 """
-Checks that a database at db_file exists.
+Checks that a database at db_file exists and starts with the SQLite header.
+An empty file is accepted, since SQLite treats it as an empty database.
+With quick_check, also runs PRAGMA quick_check, which reads the whole file.
+:raise InvalidDB: If the file is missing, not a SQLite database or corrupt.
 """
-def check_db(db_file):
+def check_db(db_file, quick_check=False):
     if not os.path.exists(db_file):
         raise InvalidDB(f"Database at {db_file} does not exist.")
+    with open(db_file, "rb") as file:
+        header = file.read(len(SQLITE_HEADER))
+    if header and header != SQLITE_HEADER:
+        raise InvalidDB(f"{db_file} is not a SQLite database.")
+    if quick_check:
+        conn = _open(db_file)
+        try:
+            problems = [row[0] for row in conn.execute(f"PRAGMA quick_check({QUICK_CHECK_ERRORS})")]
+        except sqlite3.DatabaseError as ex:
+            raise InvalidDB(f"{db_file} is corrupt: {ex}")
+        finally:
+            conn.close()
+        if problems != ["ok"]:
+            raise InvalidDB(f"{db_file} is corrupt: " + "; ".join(problems))
 
 
 """
-Checks that a table exists within db_file.
+Checks that a table exists within the schema returned by get_schema.
 """
-def check_table(db_file, table):
-    tables = get_table_names(db_file)
-    if table not in tables:
+def _check_table(schema, db_file, table):
+    if table not in schema:
         raise InvalidTable(f"Table {table} does not exist in {db_file}")
 
 
 """
-Checks that a row has all of the keys matching all of the columns of a table.
+Checks a row against the columns of a table in the schema returned by get_schema.
 """
-def check_columns(db_file, table, row, include_all=True):
-    columns = get_columns(db_file, table)
+def _check_columns(schema, table, row, include_all=True):
+    columns = schema[table]["types"]
     keys = row.keys()
     if include_all and len(keys) != len(columns):
         raise BadFields(f"Row {row} does not have keys matching the columns of {table}")
@@ -69,197 +314,2330 @@ def check_columns(db_file, table, row, include_all=True):
 
 
 """
-Returns a connection to a database in db_file.
+Checks that a table exists within db_file.
 """
-def get_connection(db_file):
-    check_db(db_file)
-    conn = sqlite3.connect(db_file)
+def check_table(db_file, table):
+    _check_table(get_schema(db_file), db_file, table)
+
+
+"""
+Checks that a row has all of the keys matching all of the columns of a table.
+"""
+def check_columns(db_file, table, row, include_all=True):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    _check_columns(schema, table, row, include_all)
+
+
+"""
+Returns the identity (device, inode) of the database file at db_file, which
+changes when the file is deleted and replaced.
+"""
+def _file_identity(db_file):
+    try:
+        stat = os.stat(db_file)
+    except FileNotFoundError:
+        raise InvalidDB(f"Database at {db_file} does not exist.")
+    return (stat.st_dev, stat.st_ino)
+
+
+"""
+Switches the pragma profile applied to new connections. Profile is either the
+name of an entry in PRAGMA_PROFILES or a dictionary of pragma names to values.
+Pooled connections are closed so that the new settings take effect.
+"""
+def set_pragma_profile(profile):
+    global _pragmas
+    if isinstance(profile, str):
+        if profile not in PRAGMA_PROFILES:
+            raise DatabaseError(f"Unknown pragma profile {profile}")
+        profile = PRAGMA_PROFILES[profile]
+    _pragmas = dict(profile)
+    close_connections()
+
+
+"""
+Cursor that reports executed statements, their duration (including the time
+spent fetching rows) and the rows fetched to the metrics module.
+"""
+class _InstrumentedCursor(sqlite3.Cursor):
+    _statement = None
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._statement is not None:
+            metrics.record_query(self._statement, self._elapsed)
+            self._statement = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        conn = self.connection
+        if QUERY_TIME_LIMIT is not None:
+            conn._deadline = start + QUERY_TIME_LIMIT - self._elapsed
+        try:
+            return method(*args)
+        except sqlite3.OperationalError as ex:
+            if conn._deadline is not None and time.perf_counter() > conn._deadline:
+                raise QueryTimeout(f"Query exceeded the time limit of {QUERY_TIME_LIMIT} seconds") from ex
+            raise
+        finally:
+            conn._deadline = None
+            self._elapsed += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._statement = sql
+        self._elapsed = 0.0
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        self._statement = sql
+        self._elapsed = 0.0
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            metrics.increment("rows_fetched")
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        metrics.increment("rows_fetched", len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        metrics.increment("rows_fetched", len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+"""
+Connection whose cursors, including those made by execute, are instrumented.
+"""
+class _InstrumentedConnection(sqlite3.Connection):
+    _deadline = None
+
+    def _check_deadline(self):
+        # A true value interrupts the running statement.
+        return self._deadline is not None and time.perf_counter() > self._deadline
+
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+"""
+Opens an instrumented connection to db_file, which is a URI if uri is set.
+"""
+def _open(db_file, uri=False):
+    metrics.increment("connections_opened")
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=False, uri=uri,
+                           factory=_InstrumentedConnection)
+    if QUERY_TIME_LIMIT is not None:
+        conn.set_progress_handler(conn._check_deadline, PROGRESS_INSTRUCTIONS)
     return conn
 
 
 """
-Returns the names of all tables in db_file.
+Opens a new connection to db_file and applies the current pragma profile.
 """
-def get_table_names(db_file):
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = "SELECT name FROM sqlite_master WHERE type='table'"
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
-            tables = [row[0] for row in rows]
-            return tables
-        
+def _connect(db_file):
+    conn = _open(db_file)
+    for pragma, value in _pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}").fetchall()
+    return conn
+
 
 """
-Returns the names of all columns in table belonging to db_file.
+Opens a new connection to db_file outside of the pool, configured like pooled
+connections, for work that needs a connection of its own (for instance to
+interrupt it from another thread). The caller must close it.
+In snapshot mode the connection reads the current snapshot and cannot write.
 """
-def get_columns(db_file, table):
-    check_table(db_file, table)
-    
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"SELECT * FROM {table}" 
-            cursor.execute(sql_query)
-            columns = [col[0] for col in cursor.description]
-            return columns
-        
+def connect(db_file):
+    _file_identity(db_file)
+    if SNAPSHOT_INTERVAL is not None:
+        return _snapshot_connection(db_file, _Snapshot.open)[1]
+    return _connect(db_file)
+
+
 """
-Returns the data types of each column in the specified table.
+Takes an idle connection to db_file from the pool, or opens a new one if the
+pool is below POOL_SIZE. Waits up to POOL_TIMEOUT seconds otherwise.
+"""
+def _checkout(db_file):
+    identity = _file_identity(db_file)
+    with _pool_lock:
+        pool = _pools.setdefault(db_file, {"idle": [], "open": 0})
+        stale = [conn for conn_identity, conn in pool["idle"] if conn_identity != identity]
+        if stale:
+            # The file was replaced, connections to the old file are unusable.
+            for conn in stale:
+                conn.close()
+            pool["open"] -= len(stale)
+            pool["idle"] = [entry for entry in pool["idle"] if entry[0] == identity]
+        if not _pool_available.wait_for(lambda: pool["idle"] or pool["open"] < POOL_SIZE,
+                                        timeout=POOL_TIMEOUT):
+            raise DatabaseError(f"Timed out waiting for a connection to {db_file}")
+        epoch = _pool_epoch
+        if pool["idle"]:
+            return pool["idle"].pop()[1], identity, epoch
+        pool["open"] += 1
+
+    try:
+        return _connect(db_file), identity, epoch
+    except Exception:
+        with _pool_lock:
+            pool["open"] -= 1
+            _pool_available.notify()
+        raise
+
 
-:param db_file: The database file.
-:param table: The table name.
-:return: A dictionary where keys are column names and values are data types.
 """
-def get_column_data_types(db_file, table):
-    check_table(db_file, table)
+Returns a connection taken by _checkout to the pool. Connections opened under
+an older pool epoch or for a replaced file are closed instead.
+"""
+def _checkin(db_file, conn, identity, epoch):
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if epoch == _pool_epoch:
+            _pools[db_file]["idle"].append((identity, conn))
+        else:
+            conn.close()
+        _pool_available.notify()
 
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            cursor.execute(f"PRAGMA table_info({table})")
-            columns_info = cursor.fetchall()
-            data_types = {column_info[1]: column_info[2] for column_info in columns_info}
-            return data_types
+
+"""
+Closes every idle pooled connection. Connections currently in use are closed
+when they are returned. With optimize, PRAGMA optimize is run on each
+connection first, as SQLite recommends before closing a connection, so
+tables its queries would have benefited from are analyzed.
+"""
+def close_connections(optimize=False):
+    global _pool_epoch
+    with _pool_lock:
+        _pool_epoch += 1
+        for pool in _pools.values():
+            for _, conn in pool["idle"]:
+                if optimize:
+                    _optimize(conn)
+                conn.close()
+        _pools.clear()
+        _pool_available.notify_all()
+    with _watcher_lock:
+        for watcher in _watchers.values():
+            watcher[1].close()
+        _watchers.clear()
+    with _snapshot_lock:
+        snapshots = list(_snapshots.values())
+        _snapshots.clear()
+    for snapshot in snapshots:
+        snapshot.retire()
 
 
 """
-Returns all rows and all columns of table in db_file.
+Yields a pooled connection to a database in db_file. The transaction is
+committed when the block exits normally and rolled back on an exception.
 """
-def get_all(db_file, table):
-    check_table(db_file, table)
+@contextlib.contextmanager
+def get_connection(db_file):
+    conn, identity, epoch = _checkout(db_file)
+    try:
+        with conn:
+            yield conn
+    finally:
+        _checkin(db_file, conn, identity, epoch)
+
+
+"""
+An in-memory copy of a database file, made with the backup API. Connections
+to it are pooled until the snapshot is retired, and the copy is freed once
+the last of them is closed.
+"""
+class _Snapshot:
+    def __init__(self, version):
+        self.uri = f"file:browser_snapshot_{next(_snapshot_serial)}?mode=memory&cache=shared"
+        self.version = version
+        # Keeps the in-memory database alive, and receives the copy.
+        self.anchor = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        self.idle = []
+        self.retired = False
+        self.lock = threading.Lock()
 
-    columns = get_columns(db_file, table)
+    """
+    Opens a new connection to the snapshot, or returns None once it is retired:
+    its in-memory database is gone with its last connection, and opening the
+    URI again would silently create an empty one.
+    """
+    def open(self):
+        with self.lock:
+            if self.retired:
+                return None
+            conn = _open(self.uri, uri=True)
+        conn.execute("PRAGMA query_only = 1")
+        return conn
 
-    data = []
+    """
+    Takes an idle connection to the snapshot, or opens a new one. Returns None
+    once the snapshot is retired.
+    """
+    def checkout(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.open()
 
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"SELECT * FROM {table}"
-            cursor.execute(sql_query)
-            for row in cursor.fetchall():
-                entry = {}
-                for i, column in enumerate(columns):
-                    entry[column] = row[i]
-                data.append(entry)
-            return data
+    def checkin(self, conn):
+        with self.lock:
+            if not self.retired:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+        self.anchor.close()
 
 
 """
-Updates a row in table from db_file.
-Values is a dict with keys representing columns and values 
-representing values to update.
-Identifiers is a dict with keys representing columns and 
-values representing which rows to select.
+Copies db_file into a new snapshot unless the current one is up to date, and
+makes it the current snapshot.
+:return: The current snapshot.
 """
-def update(db_file, table, values, identifiers):
-    check_table(db_file, table)
-    check_columns(db_file, table, values, include_all=False)
-    check_columns(db_file, table, identifiers, include_all=False)
+def _refresh_snapshot(db_file):
+    with _snapshot_refresh_lock:
+        version = _file_data_version(db_file)
+        with _snapshot_lock:
+            current = _snapshots.get(db_file)
+        if current is not None and current.version == version:
+            return current
 
-    set_clause = ", ".join([f"{key} = ?" for key in values.keys()])
-    where_clause = " AND ".join([f"{key} LIKE ?" for key in identifiers.keys()])
-    parameters = list(values.values()) + list(identifiers.values())
+        start = time.perf_counter()
+        snapshot = _Snapshot(version)
+        with get_connection(db_file) as conn:
+            conn.backup(snapshot.anchor)
+        with _snapshot_lock:
+            _snapshots[db_file] = snapshot
+        if current is not None:
+            current.retire()
+        metrics.increment("snapshot_refreshes")
+        logger.info("snapshot of %s refreshed in %.3f seconds", db_file, time.perf_counter() - start)
+        return snapshot
 
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
-            print(sql_query)
-            print(parameters)
-            cursor.execute(sql_query, parameters)
-            conn.commit()
-    
 
 """
-Inserts a row into table in db_file.
-Values is a dict with keys representing columns and values
-representing values to insert.
+Checks every SNAPSHOT_INTERVAL seconds for commits to the files with a
+snapshot, made by other processes, and refreshes their snapshots.
 """
-def insert(db_file, table, values):
-    check_table(db_file, table)
-    check_columns(db_file, table, values)    
+def _poll_snapshots():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL or 1)
+        with _snapshot_lock:
+            db_files = list(_snapshots)
+        for db_file in db_files:
+            try:
+                _refresh_snapshot(db_file)
+            except Exception:
+                logger.exception("failed to refresh the snapshot of %s", db_file)
 
-    columns = ', '.join(values.keys())
-    placeholders = ', '.join(['?'] * len(values))
-    parameters = list(values.values())
 
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-            cursor.execute(sql_query, parameters)
-            conn.commit()
+"""
+Returns the current snapshot of db_file, making the first one (and starting
+the thread refreshing it) if needed.
+"""
+def _current_snapshot(db_file):
+    global _snapshot_poller
+    with _snapshot_lock:
+        snapshot = _snapshots.get(db_file)
+        # Threads do not survive a fork, so a child starts its own.
+        if _snapshot_poller is None or not _snapshot_poller.is_alive():
+            _snapshot_poller = threading.Thread(target=_poll_snapshots, name="snapshot-poller", daemon=True)
+            _snapshot_poller.start()
+    if snapshot is None:
+        snapshot = _refresh_snapshot(db_file)
+    return snapshot
+
 
-    
 """
-Deletes a row or rows in table.
-Identifiers is a dict with keys representing columns and
-values representing which rows to delete.
+Takes a connection to the current snapshot of db_file with take (_Snapshot.open
+or _Snapshot.checkout), trying the next snapshot if the current one was
+retired in the meantime.
+:return: A tuple (snapshot, connection).
 """
-def delete(db_file, table, identifiers):
-    check_table(db_file, table)
-    check_columns(db_file, table, identifiers, include_all=False)
+def _snapshot_connection(db_file, take):
+    while True:
+        snapshot = _current_snapshot(db_file)
+        conn = take(snapshot)
+        if conn is not None:
+            return snapshot, conn
 
-    where_clause = " AND ".join([f"{key} LIKE ?" for key in identifiers.keys()])
-    parameters = list(identifiers.values())
 
-    with get_connection(db_file) as conn:
-        with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"DELETE FROM {table} WHERE {where_clause}"
-            cursor.execute(sql_query, parameters)
-            conn.commit()
+"""
+Yields a connection for reading rows of db_file: a connection to its snapshot
+in snapshot mode, a pooled connection to the file otherwise.
+"""
+@contextlib.contextmanager
+def _read_connection(db_file):
+    if SNAPSHOT_INTERVAL is None:
+        with get_connection(db_file) as conn:
+            yield conn
+        return
+    snapshot, conn = _snapshot_connection(db_file, _Snapshot.checkout)
+    try:
+        yield conn
+    finally:
+        snapshot.checkin(conn)
+
 
 """
-Performs an inner join on two tables based on a common column.
-:param db_file: The database file.
-:param table1: The primary table.
-:param table2: A list of tables to join.
-:param join_column: A list of list of tuples. Each tuple is (table1, col1, table2, col2).
-:return: A list of dictionaries representing the joined table.
+Reads the table names, columns and declared types of every table in db_file.
+:return: A dictionary mapping each table name to a dictionary with keys
+         "columns" (a list of column names), "types" (column name -> type),
+         "pk" (the declared primary key columns, in key order),
+         "rowid" (False for WITHOUT ROWID tables) and
+         "indexes" (index name -> list of indexed columns, in index order).
 """
-def join(db_file, prim_table, tables, identifiers):
-    check_table(db_file, prim_table)
-    for table in tables:
-        check_table(db_file, table)
-    for join_identifiers in identifiers:
-        if len(join_identifiers) < 1:
-            raise DatabaseError("Must have atleast one column to join on.")
-        for identifier in join_identifiers:
-            table1, col1, table2, col2 = identifier
-            check_table(db_file, table1)
-            check_table(db_file, table2)
-            check_columns(db_file, table1, {col1: ""}, include_all=False)
-            check_columns(db_file, table2, {col2: ""}, include_all=False)
-    if len(tables) != len(identifiers):
-        raise DatabaseError("Number of tables to join must match number of identifiers.")
-    
-    columns = get_columns(db_file, prim_table)
-    lookupTable = [prim_table] * len(columns)
-    for table in tables:
-        secColumns = get_columns(db_file, table)
-        columns += secColumns
-        lookupTable += [table] * len(secColumns)
+def _load_schema(cursor):
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table'")
+    tables = cursor.fetchall()
+
+    schema = {}
+    for table, sql in tables:
+        escaped = table.replace('"', '""')
+        cursor.execute(f'PRAGMA table_info("{escaped}")')
+        columns_info = cursor.fetchall()
+        pk_info = sorted((column_info[5], column_info[1]) for column_info in columns_info if column_info[5])
+        cursor.execute(f'PRAGMA index_list("{escaped}")')
+        indexes = {}
+        for index_info in cursor.fetchall():
+            escaped_index = index_info[1].replace('"', '""')
+            cursor.execute(f'PRAGMA index_info("{escaped_index}")')
+            indexes[index_info[1]] = [column_info[2] for column_info in sorted(cursor.fetchall())]
+        schema[table] = {
+            "columns": [column_info[1] for column_info in columns_info],
+            "types": {column_info[1]: column_info[2] for column_info in columns_info},
+            "pk": [column for _, column in pk_info],
+            "rowid": not re.search(r"WITHOUT\s+ROWID\s*$", sql or "", re.IGNORECASE),
+            "indexes": indexes
+        }
+    return schema
+
+
+"""
+Returns a value that changes whenever any connection, in this process or
+another, commits a change to db_file. It is read with PRAGMA data_version on
+a dedicated connection that never writes, so commits made through the pool
+are seen as well.
+"""
+def _file_data_version(db_file):
+    identity = _file_identity(db_file)
+    with _watcher_lock:
+        watcher = _watchers.get(db_file)
+        if watcher is None or watcher[0] != identity:
+            if watcher is not None:
+                watcher[1].close()
+            watcher = (identity, _open(db_file), next(_watcher_serial))
+            _watchers[db_file] = watcher
+        version = watcher[1].execute("PRAGMA data_version").fetchone()[0]
+    return (identity, watcher[2], version)
+
+
+"""
+Returns a value that changes whenever the rows read from db_file may have
+changed: the version of the file (see _file_data_version) or, in snapshot
+mode, the version the current snapshot was copied at.
+"""
+def data_version(db_file):
+    if SNAPSHOT_INTERVAL is not None:
+        return _current_snapshot(db_file).version
+    return _file_data_version(db_file)
+
+
+"""
+Returns a value that changes whenever the schema of db_file changes, read
+from PRAGMA schema_version.
+"""
+def schema_version(db_file):
+    identity = _file_identity(db_file)
+    with get_connection(db_file) as conn:
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    return (identity, version)
 
 
+"""
+Returns the cached schema of db_file (see _load_schema), reloading it only
+when the file is replaced or PRAGMA schema_version changes.
+The returned structure is shared and must not be modified.
+"""
+def get_schema(db_file):
+    identity = _file_identity(db_file)
+
     with get_connection(db_file) as conn:
         with contextlib.closing(conn.cursor()) as cursor:
-            sql_query = f"SELECT * FROM {prim_table}"
-            for table, join_identifiers in zip(tables, identifiers):
-                join_query = f" JOIN {table} ON "
-                select_query = " AND ".join([f"{table1}.{col1} = {table2}.{col2}" for table1, col1, table2, col2 in join_identifiers])
-                sql_query += join_query + select_query
-            print(sql_query)
-            cursor.execute(sql_query)
-            
-            data = []
-            for row in cursor.fetchall():
-                entry = {}
-                for i, col in enumerate(row):
-                    if columns[i] in entry and entry[columns[i]] != col:
-                        entry[f"{lookupTable[i]}.{columns[i]}"] = col
-                    else:
-                        entry[columns[i]] = col
-                data.append(entry)
-            return data
+            cursor.execute("PRAGMA schema_version")
+            version = cursor.fetchone()[0]
+
+            with _schema_lock:
+                entry = _schema_cache.get(db_file)
+            if entry is not None and entry["key"] == (identity, version):
+                return entry["tables"]
+
+            tables = _load_schema(cursor)
+            with _schema_lock:
+                _schema_cache[db_file] = {"key": (identity, version), "tables": tables}
+            return tables
+
+
+"""
+Returns whether table is used internally, by SQLite or by this application,
+rather than holding user data.
+"""
+def is_internal_table(table):
+    return table.startswith(("sqlite_", SEARCH_INDEX_PREFIX)) or table == CHANGE_LOG_TABLE
+
+
+"""
+Returns the names of all tables in db_file, excluding internal tables.
+"""
+def get_table_names(db_file):
+    return [table for table in get_schema(db_file) if not is_internal_table(table)]
+        
+
+"""
+Returns the names of all columns in table belonging to db_file.
+"""
+def get_columns(db_file, table):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    return list(schema[table]["columns"])
+
+        
+"""
+Returns the data types of each column in the specified table.
+
+:param db_file: The database file.
+:param table: The table name.
+:return: A dictionary where keys are column names and values are data types.
+"""
+def get_column_data_types(db_file, table):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    return dict(schema[table]["types"])
+
+
+"""
+Executes sql_query against db_file and yields the result rows as tuples,
+reading them from the cursor in batches of batch_size with fetchmany.
+The connection is held until the generator is exhausted or closed.
+"""
+def _iter_query(db_file, sql_query, parameters=(), batch_size=FETCH_BATCH_SIZE):
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            cursor.execute(sql_query, parameters)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+
+
+"""
+Returns rows as a list, raising TooManyRows if there are more than
+MAX_RESULT_ROWS of them.
+"""
+def _materialize(rows):
+    if MAX_RESULT_ROWS is None:
+        return list(rows)
+    result = list(itertools.islice(rows, MAX_RESULT_ROWS + 1))
+    if len(result) > MAX_RESULT_ROWS:
+        if hasattr(rows, "close"):
+            rows.close()
+        raise TooManyRows(f"The result has more than {MAX_RESULT_ROWS} rows")
+    return result
+
+
+"""
+Operators accepted in a filter spec (see _compile_filters) besides the
+comparisons in FILTER_COMPARISONS.
+"""
+FILTER_COMPARISONS = ("=", "!=", "<", "<=", ">", ">=")
+FILTER_OPERATORS = FILTER_COMPARISONS + ("between", "in", "prefix", "null", "not_null")
+
+
+"""
+Checks that value can be bound as an SQL parameter in a filter.
+"""
+def _check_filter_value(value):
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise BadFields(f"Invalid filter value {value!r}")
+    return value
+
+
+"""
+Compiles a filter spec into a parameterized WHERE condition.
+A filter spec is a list of {"column", "op", "value"} dictionaries, all of
+which must hold: op is a comparison in FILTER_COMPARISONS, "between" (value
+is [low, high], inclusive), "in" (value is a list), "prefix" (value is a
+string the column starts with), "null" or "not_null" (no value).
+Prefixes are matched as a range, so an index on the column can be used.
+:param resolve: Maps a column name from the spec to its SQL expression,
+                raising BadFields for unknown columns.
+:return: A tuple (condition, parameters); condition is "" for no filters.
+"""
+def _compile_filters(filters, resolve):
+    terms = []
+    parameters = []
+    for spec in filters or ():
+        try:
+            column = resolve(spec["column"])
+            op = spec["op"]
+            value = spec.get("value")
+        except (KeyError, TypeError, AttributeError):
+            raise BadFields(f"Invalid filter {spec}")
+
+        if op in FILTER_COMPARISONS:
+            terms.append(f"{column} {op} ?")
+            parameters.append(_check_filter_value(value))
+        elif op == "between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise BadFields(f"Filter {spec} needs a [low, high] value")
+            terms.append(f"{column} BETWEEN ? AND ?")
+            parameters += [_check_filter_value(bound) for bound in value]
+        elif op == "in":
+            if not isinstance(value, list) or not value:
+                raise BadFields(f"Filter {spec} needs a non-empty list value")
+            terms.append(f"{column} IN ({', '.join(['?'] * len(value))})")
+            parameters += [_check_filter_value(item) for item in value]
+        elif op == "prefix":
+            if not isinstance(value, str):
+                raise BadFields(f"Filter {spec} needs a string value")
+            if not value:
+                continue
+            terms.append(f"{column} >= ?")
+            parameters.append(value)
+            if ord(value[-1]) < sys.maxunicode:
+                terms.append(f"{column} < ?")
+                parameters.append(value[:-1] + chr(ord(value[-1]) + 1))
+        elif op == "null":
+            terms.append(f"{column} IS NULL")
+        elif op == "not_null":
+            terms.append(f"{column} IS NOT NULL")
+        else:
+            raise BadFields(f"Unknown filter operator {op!r}, expected one of {', '.join(FILTER_OPERATORS)}")
+    return " AND ".join(terms), parameters
+
+
+"""
+Compiles a sort spec, a list of {"column", "desc"} dictionaries (desc being
+optional), into an ORDER BY list. See _compile_filters for resolve.
+:return: The ORDER BY list, or "" for no sort.
+"""
+def _compile_sort(sort, resolve):
+    terms = []
+    for spec in sort or ():
+        try:
+            column = resolve(spec["column"])
+            direction = "DESC" if spec.get("desc") else "ASC"
+        except (KeyError, TypeError, AttributeError):
+            raise BadFields(f"Invalid sort {spec}")
+        terms.append(f"{column} {direction}")
+    return ", ".join(terms)
+
+
+"""
+Returns a resolver (see _compile_filters) for the columns of table, including
+ROWID_KEY for tables with a rowid.
+"""
+def _table_resolver(schema, table):
+    def resolve(column):
+        if column == ROWID_KEY and schema[table]["rowid"]:
+            return "rowid"
+        if column not in schema[table]["types"]:
+            raise BadFields(f"Column {column} does not exist in {table}")
+        return column
+    return resolve
+
+
+"""
+Builds a SELECT of the columns returned by _result_columns from table,
+filtered and sorted as given (see _compile_filters and _compile_sort).
+:return: A tuple (sql_query, parameters).
+"""
+def _table_query(schema, table, include_rowid, filters=None, sort=None):
+    resolve = _table_resolver(schema, table)
+    condition, parameters = _compile_filters(filters, resolve)
+    order = _compile_sort(sort, resolve)
+    sql_query = f"SELECT {_select_clause(_result_columns(schema, table, include_rowid))} FROM {table}"
+    if condition:
+        sql_query += f" WHERE {condition}"
+    if order:
+        sql_query += f" ORDER BY {order}"
+    return sql_query, parameters
+
+
+"""
+Returns a generator over all rows of table in db_file as dictionaries.
+The table is checked immediately; rows are fetched lazily in batches.
+If include_rowid is set, each row also holds its rowid under ROWID_KEY.
+"""
+def iter_all(db_file, table, batch_size=FETCH_BATCH_SIZE, include_rowid=False, filters=None, sort=None):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    columns = _result_columns(schema, table, include_rowid)
+    sql_query, parameters = _table_query(schema, table, include_rowid, filters, sort)
+    return _rows_to_dicts(_iter_query(db_file, sql_query, parameters, batch_size=batch_size), columns)
+
+
+"""
+Like iter_all, but for exporting: rows are left as tuples.
+:return: A tuple (columns, rows) where rows is a generator over tuples holding
+         the values of columns.
+"""
+def iter_rows(db_file, table, batch_size=FETCH_BATCH_SIZE, include_rowid=False, filters=None, sort=None):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    columns = _result_columns(schema, table, include_rowid)
+    sql_query, parameters = _table_query(schema, table, include_rowid, filters, sort)
+    return columns, _iter_query(db_file, sql_query, parameters, batch_size=batch_size)
+
+
+"""
+Inserts rows into table in db_file, IMPORT_BATCH_SIZE rows per transaction.
+rows may be any iterable, such as a CSV reader, and is consumed one batch at
+a time, so memory use does not grow with the number of rows. Every batch is
+committed on its own: when a row fails, the batches before it stay imported.
+Values are stored as given, relying on SQLite's type affinity to convert
+numeric text, except that empty strings become NULL in columns without text
+affinity.
+:param columns: The columns the values of each row are for. Columns left out
+                get their default value.
+:return: The number of rows imported.
+"""
+def import_rows(db_file, table, columns, rows, batch_size=IMPORT_BATCH_SIZE):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    if is_internal_table(table):
+        raise InvalidTable(f"Table {table} is internal to {db_file}")
+    if not columns or len(set(columns)) != len(columns):
+        raise BadFields(f"Invalid columns {columns} for {table}")
+    _check_columns(schema, table, dict.fromkeys(columns), include_all=False)
+
+    nullable = [i for i, column in enumerate(columns) if _affinity(schema[table]["types"][column]) != "TEXT"]
+    sql_query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = [list(row) for row in itertools.islice(rows, batch_size)]
+        if not batch:
+            return count
+        for line, row in enumerate(batch, count + 1):
+            if len(row) != len(columns):
+                raise BadFields(f"Row {line} has {len(row)} values, expected {len(columns)}; "
+                                f"{count} rows were imported")
+            for i in nullable:
+                if row[i] == "":
+                    row[i] = None
+        try:
+            _write(db_file, lambda cursor: cursor.executemany(sql_query, batch))
+        except sqlite3.IntegrityError as ex:
+            raise BadFields(f"{ex} in rows {count + 1} to {count + len(batch)}; {count} rows were imported")
+        count += len(batch)
+
+
+"""
+Returns the columns of table as selected when include_rowid is set:
+ROWID_KEY first for tables that have a rowid, then every table column.
+"""
+def _result_columns(schema, table, include_rowid):
+    if include_rowid and schema[table]["rowid"]:
+        return [ROWID_KEY] + schema[table]["columns"]
+    return list(schema[table]["columns"])
+
+
+"""
+Returns the select list producing the columns returned by _result_columns.
+"""
+def _select_clause(columns):
+    if columns and columns[0] == ROWID_KEY:
+        return "rowid, *"
+    return "*"
+
+
+"""
+Returns the header of a columnar result of table (see get_all_columnar).
+"""
+def _columnar_header(schema, table, include_rowid):
+    columns = _result_columns(schema, table, include_rowid)
+    types = schema[table]["types"]
+    return {
+        "columns": [f"{table}.{column}" for column in columns],
+        "types": ["INTEGER" if column == ROWID_KEY else types[column] for column in columns]
+    }
+
+
+"""
+Returns the header of a columnar result of table in db_file, a dictionary
+with "columns" (fully qualified names) and "types" (their declared types).
+"""
+def columnar_header(db_file, table, include_rowid=False):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    return _columnar_header(schema, table, include_rowid)
+
+
+"""
+Returns all rows of table in db_file in columnar form: a dictionary with
+"columns" (fully qualified "table.column" names), "types" (their declared
+types) and "rows" (a list of tuples in the same column order). No per-row
+dictionaries are built. If include_rowid is set, the first column is the
+rowid, named "table._rowid_".
+"""
+def get_all_columnar(db_file, table, include_rowid=False, filters=None, sort=None):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    result = _columnar_header(schema, table, include_rowid)
+    sql_query, parameters = _table_query(schema, table, include_rowid, filters, sort)
+    result["rows"] = _materialize(_iter_query(db_file, sql_query, parameters))
+    return result
+
+
+"""
+Converts tuples to dictionaries keyed by columns.
+"""
+def _rows_to_dicts(rows, columns):
+    for row in rows:
+        entry = {}
+        for i, column in enumerate(columns):
+            entry[column] = row[i]
+        yield entry
+
+
+"""
+Returns all rows and all columns of table in db_file.
+If include_rowid is set, each row also holds its rowid under ROWID_KEY.
+"""
+def get_all(db_file, table, include_rowid=False, filters=None, sort=None):
+    return _materialize(iter_all(db_file, table, include_rowid=include_rowid, filters=filters, sort=sort))
+
+
+"""
+Returns the columns that uniquely identify and order the rows of a table:
+rowid for ordinary tables, the primary key for WITHOUT ROWID tables.
+"""
+def _row_key(schema, table):
+    if schema[table]["rowid"]:
+        return ["rowid"]
+    return list(schema[table]["pk"])
+
+
+"""
+Builds the keyset conditions selecting the rows that sort after values,
+given rows ordered by columns (all ascending, or all descending). Only the
+first column may hold NULLs, and only if nullable is set: the others are the
+row key, a rowid or the primary key of a WITHOUT ROWID table.
+Each condition compares row values, which SQLite answers with a seek on an
+index over columns rather than a scan from its start. Since NULLs sort
+first, as in SQLite, the rows after values can fall into two ranges (for
+instance the non-NULL rows after a descending page of them, then the NULLs),
+which are returned in order as separate conditions.
+:return: A list of (clause, parameters) tuples.
+"""
+def _keyset_clauses(columns, values, descending, nullable):
+    operator = "<" if descending else ">"
+
+    def after(columns, values):
+        placeholders = ", ".join(["?"] * len(values))
+        return f"({', '.join(columns)}) {operator} ({placeholders})", list(values)
+
+    first, rest = columns[0], columns[1:]
+    if values[0] is not None:
+        clauses = [after(columns, values)]
+        if descending and nullable:
+            clauses.append((f"{first} IS NULL", []))
+        return clauses
+    # A NULL in the first column: the rest of the NULLs, then (ascending) the others.
+    clause, parameters = after(rest, values[1:]) if rest else ("1", [])
+    clauses = [(f"{first} IS NULL AND {clause}", parameters)]
+    if not descending:
+        clauses.append((f"{first} IS NOT NULL", []))
+    return clauses
+
+
+"""
+Builds the queries reading the page of table after the cursor after (see
+get_page), each taking the number of rows to read as its last parameter.
+They are run in order until the page is full.
+:return: A list of (sql_query, parameters) tuples.
+"""
+def _page_queries(schema, table, columns, sort_columns, after, descending, nullable, filters):
+    direction = "DESC" if descending else "ASC"
+    condition, parameters = _compile_filters(filters, _table_resolver(schema, table))
+    conditions = [f"({condition})"] if condition else []
+    keysets = [(None, [])]
+    if after is not None:
+        if not isinstance(after, (list, tuple)) or len(after) != len(sort_columns):
+            raise DatabaseError(f"Invalid page cursor {after}")
+        keysets = _keyset_clauses(sort_columns, after, descending, nullable)
+    order_clause = ", ".join([f"{column} {direction}" for column in sort_columns])
+    select_clause = ", ".join(sort_columns + [_select_clause(columns)])
+
+    queries = []
+    for keyset, keyset_parameters in keysets:
+        query_conditions = conditions + ([f"({keyset})"] if keyset is not None else [])
+        where_clause = f" WHERE {' AND '.join(query_conditions)}" if query_conditions else ""
+        queries.append((f"SELECT {select_clause} FROM {table}{where_clause} ORDER BY {order_clause} LIMIT ?",
+                        parameters + keyset_parameters))
+    return queries
+
+
+"""
+Returns one page of rows of table in db_file using keyset pagination.
+:param limit: The maximum number of rows to return.
+:param after: The cursor returned with the previous page, or None for the first page.
+:param order_by: An optional column to sort by. Rows are always ordered by
+                 their rowid (or primary key) after it, so the order is total.
+:param descending: Whether to sort in descending order.
+:param include_rowid: Whether each row should also hold its rowid under ROWID_KEY.
+:param columnar: Whether to return rows as tuples ordered as in columnar_header.
+:param filters: A filter spec (see _compile_filters) rows must match.
+:return: A tuple (rows, cursor) where rows is a list of dictionaries and cursor
+         is the value to pass as after to get the next page, or None if this
+         was the last page.
+"""
+def get_page(db_file, table, limit, after=None, order_by=None, descending=False, include_rowid=False,
+             columnar=False, filters=None):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    if order_by is not None:
+        _check_columns(schema, table, {order_by: ""}, include_all=False)
+    if limit < 1:
+        raise DatabaseError("Page size must be at least 1.")
+
+    columns = _result_columns(schema, table, include_rowid)
+    sort_columns = _row_key(schema, table)
+    if order_by is not None and order_by not in sort_columns:
+        sort_columns = [order_by] + sort_columns
+
+    rows = []
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            for sql_query, parameters in _page_queries(schema, table, columns, sort_columns, after, descending,
+                                                       order_by is not None and sort_columns[0] == order_by,
+                                                       filters):
+                cursor.execute(sql_query, parameters + [limit + 1 - len(rows)])
+                rows += cursor.fetchall()
+                if len(rows) > limit:
+                    break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = list(rows[-1][:len(sort_columns)])
+
+    offset = len(sort_columns)
+    data = [row[offset:] for row in rows]
+    if not columnar:
+        data = list(_rows_to_dicts(data, columns))
+    return data, next_cursor
+
+
+"""
+Returns the identifier columns of a row excluding ROWID_KEY.
+"""
+def _without_rowid(row):
+    return {key: value for key, value in row.items() if key != ROWID_KEY}
+
+
+"""
+Chooses how to target the row described by identifiers:
+by rowid if the client sent ROWID_KEY, by the declared primary key if all of
+its columns are present, and otherwise by every identifier column.
+:return: A tuple (clause, keys) where clause is the WHERE clause and keys are
+         the identifier keys supplying its parameters, in order.
+"""
+def _row_target(schema, table, identifiers):
+    if ROWID_KEY in identifiers and schema[table]["rowid"]:
+        return "rowid = ?", (ROWID_KEY,)
+    pk = schema[table]["pk"]
+    if pk and all(column in identifiers for column in pk):
+        return " AND ".join([f"{column} = ?" for column in pk]), tuple(pk)
+    keys = tuple(_without_rowid(identifiers).keys())
+    if not keys:
+        raise BadFields(f"Row {identifiers} does not identify a row of {table}")
+    # IS rather than = so NULL values match exactly too.
+    return " AND ".join([f"{key} IS ?" for key in keys]), keys
+
+
+"""
+Splits rows into consecutive runs sharing the same shape (as returned by
+shape_of), so each run can be applied with a single executemany while the
+overall order of mutations is preserved.
+"""
+def _runs(rows, shape_of):
+    return itertools.groupby(rows, key=shape_of)
+
+
+"""
+Inserts rows into table using cursor. Each row is a dict with keys matching
+all of the columns of table. Columns are validated once per run of rows.
+:return: The number of rows inserted.
+"""
+def _insert_rows(cursor, schema, table, rows):
+    count = 0
+    for keys, run in _runs(rows, lambda row: tuple(row.keys())):
+        run = list(run)
+        _check_columns(schema, table, _without_rowid(run[0]))
+        columns = ', '.join(["rowid" if key == ROWID_KEY else key for key in keys])
+        placeholders = ', '.join(['?'] * len(keys))
+        sql_query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+        cursor.executemany(sql_query, [list(row.values()) for row in run])
+        count += cursor.rowcount
+    return count
+
+
+"""
+Updates rows in table using cursor. Each update is a tuple (values, identifiers)
+as taken by update. Columns are validated once per run of updates.
+:return: The number of rows updated.
+"""
+def _update_rows(cursor, schema, table, updates):
+    count = 0
+    shape_of = lambda entry: (tuple(entry[0].keys()), _row_target(schema, table, entry[1]))
+    for (value_keys, (where_clause, identifier_keys)), run in _runs(updates, shape_of):
+        run = list(run)
+        _check_columns(schema, table, run[0][0], include_all=False)
+        _check_columns(schema, table, _without_rowid(run[0][1]), include_all=False)
+        set_clause = ", ".join([f"{key} = ?" for key in value_keys])
+        sql_query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+        logger.debug("sql=%s", sql_query)
+        parameters = [list(values.values()) + [identifiers[key] for key in identifier_keys]
+                      for values, identifiers in run]
+        cursor.executemany(sql_query, parameters)
+        count += cursor.rowcount
+    return count
+
+
+"""
+Deletes rows from table using cursor. Each entry of identifiers_list is a dict
+as taken by delete. Columns are validated once per run of identifiers.
+:return: The number of rows deleted.
+"""
+def _delete_rows(cursor, schema, table, identifiers_list):
+    count = 0
+    shape_of = lambda identifiers: _row_target(schema, table, identifiers)
+    for (where_clause, keys), run in _runs(identifiers_list, shape_of):
+        run = list(run)
+        _check_columns(schema, table, _without_rowid(run[0]), include_all=False)
+        sql_query = f"DELETE FROM {table} WHERE {where_clause}"
+        cursor.executemany(sql_query, [[identifiers[key] for key in keys] for identifiers in run])
+        count += cursor.rowcount
+    return count
+
+
+"""
+Updates a row in table from db_file.
+Values is a dict with keys representing columns and values 
+representing values to update.
+Identifiers is a dict with keys representing columns and 
+values representing which rows to select.
+"""
+def update(db_file, table, values, identifiers):
+    bulk_update(db_file, table, [(values, identifiers)])
+    
+
+"""
+Inserts a row into table in db_file.
+Values is a dict with keys representing columns and values
+representing values to insert.
+"""
+def insert(db_file, table, values):
+    bulk_insert(db_file, table, [values])
+
+    
+"""
+Deletes a row or rows in table.
+Identifiers is a dict with keys representing columns and
+values representing which rows to delete.
+"""
+def delete(db_file, table, identifiers):
+    bulk_delete(db_file, table, [identifiers])
+
+
+"""
+Applies deletes, then updates, then inserts to table in db_file within a
+single transaction. Either every mutation is applied or none are.
+:param deletes: A list of identifier dicts, as taken by delete.
+:param updates: A list of (values, identifiers) tuples, as taken by update.
+:param inserts: A list of row dicts, as taken by insert.
+:return: A dictionary with the number of rows deleted, updated and inserted.
+"""
+def bulk_apply(db_file, table, deletes=(), updates=(), inserts=()):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+
+    def apply(cursor):
+        return {
+            "deleted": _delete_rows(cursor, schema, table, deletes),
+            "updated": _update_rows(cursor, schema, table, updates),
+            "inserted": _insert_rows(cursor, schema, table, inserts)
+        }
+    return _write(db_file, apply)
+
+
+"""
+Returns whether ex was raised because another connection holds the lock.
+"""
+def _is_busy(ex):
+    code = getattr(ex, "sqlite_errorcode", None)
+    if code is not None:
+        return code in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "database is locked" in str(ex)
+
+
+"""
+Runs apply(cursor) in a write transaction on db_file and commits it.
+The write lock is taken up front with BEGIN IMMEDIATE, so a busy database is
+detected before any work is done; the transaction is then retried with
+exponential backoff (see WRITE_RETRIES), as apply may be called again.
+:return: The result of apply.
+"""
+def _write(db_file, apply):
+    if GROUP_COMMIT_WINDOW is not None:
+        result = _group_writer(db_file).submit(apply)
+    else:
+        result = _write_transaction(db_file, apply)
+    if SNAPSHOT_INTERVAL is not None:
+        # So the writer reads its own writes.
+        _refresh_snapshot(db_file)
+    return result
+
+
+"""
+Runs apply(cursor) in its own write transaction (see _write).
+"""
+def _write_transaction(db_file, apply):
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            with get_connection(db_file) as conn:
+                with contextlib.closing(conn.cursor()) as cursor:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    result = apply(cursor)
+                    conn.commit()
+                    return result
+        except sqlite3.OperationalError as ex:
+            if not _is_busy(ex):
+                raise
+            if attempt == WRITE_RETRIES:
+                raise DatabaseBusy(f"{db_file} is locked by another writer") from ex
+            delay = WRITE_BACKOFF * 2 ** attempt
+            logger.info("database busy, retrying write in %.3f seconds", delay)
+            time.sleep(delay * (0.5 + random.random()))
+
+
+"""
+Thread applying the mutations queued for one database file in batches
+(see GROUP_COMMIT_WINDOW).
+"""
+class _GroupWriter(threading.Thread):
+    def __init__(self, db_file):
+        super().__init__(name=f"group-writer {db_file}", daemon=True)
+        self.db_file = db_file
+        self.queue = queue.Queue()
+
+    """
+    Queues apply (as taken by _write) and waits for its batch to commit.
+    :return: The result of apply, or raises the exception it raised.
+    """
+    def submit(self, apply):
+        future = concurrent.futures.Future()
+        self.queue.put((apply, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+            while len(batch) < GROUP_COMMIT_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with metrics.route("group_writer"):
+                self._commit(batch)
+
+    def _commit(self, batch):
+        def apply_batch(cursor):
+            outcomes = []
+            for apply, _ in batch:
+                cursor.execute("SAVEPOINT mutation")
+                try:
+                    outcomes.append((apply(cursor), None))
+                except Exception as ex:
+                    if isinstance(ex, sqlite3.OperationalError) and _is_busy(ex):
+                        raise
+                    cursor.execute("ROLLBACK TO mutation")
+                    outcomes.append((None, ex))
+                cursor.execute("RELEASE mutation")
+            return outcomes
+
+        metrics.increment("write_batches")
+        metrics.increment("writes_batched", len(batch))
+        try:
+            outcomes = _write_transaction(self.db_file, apply_batch)
+        except Exception as ex:
+            # Nothing was committed, so every mutation failed.
+            for _, future in batch:
+                future.set_exception(ex)
+            return
+        for (_, future), (result, ex) in zip(batch, outcomes):
+            if ex is None:
+                future.set_result(result)
+            else:
+                future.set_exception(ex)
+
+
+"""
+Returns the writer thread for db_file, starting it if needed.
+"""
+def _group_writer(db_file):
+    with _writers_lock:
+        writer = _writers.get(db_file)
+        # Threads do not survive a fork, so a child starts its own.
+        if writer is None or not writer.is_alive():
+            writer = _writers[db_file] = _GroupWriter(db_file)
+            writer.start()
+        return writer
+
+
+"""
+Inserts a list of rows into table in db_file in a single transaction.
+:return: The number of rows inserted.
+"""
+def bulk_insert(db_file, table, rows):
+    return bulk_apply(db_file, table, inserts=rows)["inserted"]
+
+
+"""
+Applies a list of (values, identifiers) updates to table in db_file in a
+single transaction.
+:return: The number of rows updated.
+"""
+def bulk_update(db_file, table, updates):
+    return bulk_apply(db_file, table, updates=updates)["updated"]
+
+
+"""
+Deletes the rows matching each of a list of identifier dicts from table in
+db_file in a single transaction.
+:return: The number of rows deleted.
+"""
+def bulk_delete(db_file, table, identifiers_list):
+    return bulk_apply(db_file, table, deletes=identifiers_list)["deleted"]
+
+
+"""
+Returns the names of the insert, update and delete triggers that record the
+changes to table in the change log.
+"""
+def _change_triggers(table):
+    return [f"{CHANGE_LOG_TABLE}_{table}_{event}" for event in ("insert", "update", "delete")]
+
+
+"""
+Creates the change log and the triggers recording changes to table, unless
+they already exist.
+"""
+def _track_changes(cursor, table):
+    quoted = table.replace("'", "''")
+    insert_trigger, update_trigger, delete_trigger = [name.replace('"', '""') for name in _change_triggers(table)]
+    log_change = f"INSERT INTO {CHANGE_LOG_TABLE} (tbl, row_id, deleted)"
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+                           version INTEGER PRIMARY KEY AUTOINCREMENT,
+                           tbl TEXT NOT NULL,
+                           row_id INTEGER NOT NULL,
+                           deleted INTEGER NOT NULL)""")
+    # Versions of a new log start at the time it is created, in microseconds,
+    # so a version handed out by an earlier (dropped) log is always older than
+    # those of the new one and makes the client reload rather than skip changes.
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                   "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                   (CHANGE_LOG_TABLE, time.time_ns() // 1000, CHANGE_LOG_TABLE))
+    # Keeps the log bounded; the delete is a range seek on the primary key.
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {CHANGE_LOG_TABLE}_prune AFTER INSERT ON {CHANGE_LOG_TABLE}
+                       BEGIN
+                           DELETE FROM {CHANGE_LOG_TABLE} WHERE version <= NEW.version - {CHANGE_LOG_SIZE};
+                       END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS "{insert_trigger}" AFTER INSERT ON {table}
+                       BEGIN
+                           {log_change} VALUES ('{quoted}', NEW.rowid, 0);
+                       END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS "{update_trigger}" AFTER UPDATE ON {table}
+                       BEGIN
+                           {log_change} SELECT '{quoted}', OLD.rowid, 1 WHERE OLD.rowid != NEW.rowid;
+                           {log_change} VALUES ('{quoted}', NEW.rowid, 0);
+                       END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS "{delete_trigger}" AFTER DELETE ON {table}
+                       BEGIN
+                           {log_change} VALUES ('{quoted}', OLD.rowid, 1);
+                       END""")
+
+
+"""
+Returns the rows of table in db_file changed since the change version since.
+Change tracking is enabled for table on first use; call with since=None to
+enable it and get the current version.
+:return: A dictionary with "version" (the version to pass as since next
+         time), "rows" (the rows inserted or updated since then, as returned
+         by get_all with include_rowid set), "deleted" (the rowids of the rows
+         deleted since then) and "reset" (True if the changes since then are
+         no longer known, and the client must reload the whole table).
+         WITHOUT ROWID tables cannot be tracked; for them version is None and
+         reset is always True.
+"""
+def get_changes(db_file, table, since=None):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    if is_internal_table(table):
+        raise InvalidTable(f"Table {table} is internal to {db_file}")
+    result = {"version": None, "reset": True, "rows": [], "deleted": []}
+    if not schema[table]["rowid"]:
+        return result
+
+    triggers = _change_triggers(table)
+    placeholders = ", ".join(["?"] * len(triggers))
+    with get_connection(db_file) as conn:
+        tracked = conn.execute(f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({placeholders})",
+                               triggers).fetchone()[0] == len(triggers)
+    if not tracked:
+        _write(db_file, lambda cursor: _track_changes(cursor, table))
+
+    with get_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            # The sequence is the latest version even once the log is empty.
+            # Separate subqueries, so each is a seek rather than a scan of the log.
+            cursor.execute(f"SELECT (SELECT seq FROM sqlite_sequence WHERE name = '{CHANGE_LOG_TABLE}'), "
+                           f"(SELECT min(version) FROM {CHANGE_LOG_TABLE})")
+            version, oldest = cursor.fetchone()
+            oldest = version + 1 if oldest is None else oldest
+            result["version"] = version
+            # Entries after since have been pruned, or the log was recreated.
+            if since is None or since < oldest - 1 or since > version:
+                return result
+            result["reset"] = False
+
+            cursor.execute(f"SELECT row_id, deleted FROM {CHANGE_LOG_TABLE} WHERE version > ? AND tbl = ? "
+                           "ORDER BY version", (since, table))
+            # Only the last change to each row matters.
+            last_changes = dict(cursor.fetchall())
+            changed = [row_id for row_id, deleted in last_changes.items() if not deleted]
+            columns = _result_columns(schema, table, include_rowid=True)
+            rows = []
+            for start in range(0, len(changed), FETCH_BATCH_SIZE):
+                batch = changed[start:start + FETCH_BATCH_SIZE]
+                placeholders = ", ".join(["?"] * len(batch))
+                cursor.execute(f"SELECT {_select_clause(columns)} FROM {table} WHERE rowid IN ({placeholders})",
+                               batch)
+                rows += cursor.fetchall()
+
+    found = {row[0] for row in rows}
+    result["rows"] = list(_rows_to_dicts(rows, columns))
+    # Rows deleted after the log was read are reported as deleted already.
+    result["deleted"] = [row_id for row_id, deleted in last_changes.items() if deleted or row_id not in found]
+    return result
+
+
+"""
+Stops tracking the changes to table in db_file (see get_changes), or to every
+table if table is None, by dropping the triggers recording them. The change
+log is dropped as well once no table is tracked anymore.
+:return: The number of triggers dropped.
+"""
+def drop_change_tracking(db_file, table=None):
+    if table is not None:
+        check_table(db_file, table)
+
+    def apply(cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name != ?", (CHANGE_LOG_TABLE,))
+        tracking = {name for name, in cursor.fetchall() if name.startswith(f"{CHANGE_LOG_TABLE}_")}
+        dropped = tracking if table is None else tracking.intersection(_change_triggers(table))
+        for trigger in dropped:
+            escaped = trigger.replace('"', '""')
+            cursor.execute(f'DROP TRIGGER IF EXISTS "{escaped}"')
+        if not tracking - dropped:
+            cursor.execute(f"DROP TABLE IF EXISTS {CHANGE_LOG_TABLE}")
+        return len(dropped)
+    return _write(db_file, apply)
+
+
+"""
+Returns the number of pages and bytes used by every table and index in the
+database of cursor, from the dbstat virtual table, or None if SQLite was
+built without it.
+"""
+def _btree_sizes(cursor):
+    try:
+        # With aggregate set, pageno is the number of pages of each b-tree.
+        cursor.execute("SELECT name, pageno, pgsize FROM dbstat WHERE aggregate = 1")
+    except sqlite3.OperationalError:
+        return None
+    return {name: (pages, size) for name, pages, size in cursor.fetchall()}
+
+
+"""
+Returns the row estimates recorded by ANALYZE in sqlite_stat1, as a dictionary
+mapping each table to its estimated row count and each index to its stat
+string, or an empty dictionary if the database has not been analyzed.
+"""
+def _analyze_stats(cursor, schema):
+    if "sqlite_stat1" not in schema:
+        return {}, {}
+    cursor.execute("SELECT tbl, idx, stat FROM sqlite_stat1")
+    tables = {}
+    indexes = {}
+    for table, index, stat in cursor.fetchall():
+        # The first number of every entry estimates the rows of the table.
+        tables[table] = int(stat.split()[0])
+        if index is not None:
+            indexes[index] = stat
+    return tables, indexes
+
+
+"""
+Returns statistics for every table of db_file, gathered cheaply: row counts
+come from the estimates of ANALYZE (see analyze) when there are any and exact
+is not set, and from COUNT(*) otherwise; sizes come from the dbstat virtual
+table. Everything is cached until the data version of db_file moves, so
+repeated calls on an unchanged database cost nothing.
+:return: A dictionary with the "page_size", "page_count" and "bytes" of the
+         database, and "tables": a list with the "name", "rows",
+         "rows_estimated" (whether rows is an estimate), "pages", "bytes",
+         "index_bytes" (None without dbstat) and "indexes" (a list of
+         {"name", "columns", "stat"}) of every table.
+"""
+def get_stats(db_file, exact=False):
+    version = data_version(db_file)
+    schema = get_schema(db_file)
+    with _stats_lock:
+        entry = _stats_cache.get(db_file)
+        if entry is None or entry["key"] != version:
+            entry = _stats_cache[db_file] = {"key": version, "database": None, "counts": {}}
+
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            if entry["database"] is None:
+                cursor.execute("PRAGMA page_size")
+                page_size = cursor.fetchone()[0]
+                cursor.execute("PRAGMA page_count")
+                page_count = cursor.fetchone()[0]
+                estimates, index_stats = _analyze_stats(cursor, schema)
+                entry["database"] = {"page_size": page_size, "page_count": page_count, "estimates": estimates,
+                                     "index_stats": index_stats, "sizes": _btree_sizes(cursor)}
+            gathered = entry["database"]
+
+            tables = []
+            for table in [table for table in schema if not is_internal_table(table)]:
+                rows = entry["counts"].get(table)
+                estimated = False
+                if rows is None and not exact and table in gathered["estimates"]:
+                    rows = gathered["estimates"][table]
+                    estimated = True
+                elif rows is None:
+                    cursor.execute(f"SELECT count(*) FROM {table}")
+                    rows = entry["counts"][table] = cursor.fetchone()[0]
+
+                sizes = gathered["sizes"]
+                indexes = schema[table]["indexes"]
+                tables.append({
+                    "name": table,
+                    "rows": rows,
+                    "rows_estimated": estimated,
+                    "pages": sizes.get(table, (0, 0))[0] if sizes is not None else None,
+                    "bytes": sizes.get(table, (0, 0))[1] if sizes is not None else None,
+                    "index_bytes": sum(sizes.get(index, (0, 0))[1] for index in indexes) if sizes is not None else None,
+                    "indexes": [{"name": index, "columns": columns, "stat": gathered["index_stats"].get(index)}
+                                for index, columns in indexes.items()]
+                })
+
+    return {
+        "page_size": gathered["page_size"],
+        "page_count": gathered["page_count"],
+        "bytes": gathered["page_size"] * gathered["page_count"],
+        "tables": tables
+    }
+
+
+"""
+Runs ANALYZE on db_file, recording the row estimates get_stats and the query
+planner use in sqlite_stat1.
+"""
+def analyze(db_file):
+    check_db(db_file)
+    _write(db_file, lambda cursor: cursor.execute("ANALYZE"))
+
+
+"""
+Runs PRAGMA optimize on conn with the given mask, logging rather than raising
+errors, since optimizing is never required and the database may be read-only
+or locked.
+"""
+def _optimize(conn, mask=None):
+    try:
+        conn.execute(f"PRAGMA analysis_limit = {OPTIMIZE_ANALYSIS_LIMIT}").fetchall()
+        conn.execute("PRAGMA optimize" if mask is None else f"PRAGMA optimize = {mask:#x}").fetchall()
+        if conn.in_transaction:
+            conn.commit()
+    except sqlite3.Error as ex:
+        logger.warning("PRAGMA optimize failed: %s", ex)
+
+
+"""
+Runs PRAGMA optimize on db_file from a connection of its own, as when the
+server starts. The mask makes SQLite consider every table rather than only
+those used by the connection (which has run no queries), on SQLite 3.46 and
+later; older versions ignore it.
+"""
+def optimize(db_file):
+    conn = _connect(db_file)
+    try:
+        _optimize(conn, OPTIMIZE_ON_OPEN)
+    finally:
+        conn.close()
+
+
+"""
+Prepares db_file for its first requests: loads the schema into the schema
+cache and reads the b-trees of its tables, smallest first, until WARM_UP_BYTES
+have been read, so their pages are in the operating system's page cache (and
+the memory map) rather than read from disk by the first requests. Tables are
+only warmed when their sizes are known from dbstat, or the whole file fits.
+In snapshot mode with snapshot set, the snapshot is loaded as well.
+:return: The names of the tables read.
+"""
+def warm_up(db_file, snapshot=True):
+    schema = get_schema(db_file)
+    tables = [table for table in schema if not is_internal_table(table)]
+    warmed = []
+    with get_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            sizes = _btree_sizes(cursor)
+            if sizes is None:
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+                if page_size * page_count > WARM_UP_BYTES:
+                    tables = []
+            else:
+                tables.sort(key=lambda table: sizes.get(table, (0, 0))[1])
+            budget = WARM_UP_BYTES
+            for table in tables:
+                size = 0 if sizes is None else sizes.get(table, (0, 0))[1]
+                if size > budget:
+                    break
+                budget -= size
+                escaped = table.replace('"', '""')
+                # Counting without an index walks every page of the table's b-tree.
+                cursor.execute(f'SELECT COUNT(*) FROM "{escaped}" NOT INDEXED').fetchone()
+                warmed.append(table)
+    if snapshot and SNAPSHOT_INTERVAL is not None:
+        _current_snapshot(db_file)
+    return warmed
+
+
+"""
+Reads a sample of at most sample_size rows of table using cursor, without
+scanning the table: for tables with a rowid, runs of PROFILE_BLOCK_ROWS rows
+are read from random rowids between the smallest and largest one, which are
+index seeks; for WITHOUT ROWID tables the first rows are taken.
+:return: A tuple (rows, total, complete) where total estimates the number of
+         rows in the table and complete tells whether rows is all of them.
+"""
+def _sample_rows(cursor, schema, table, sample_size):
+    if not schema[table]["rowid"]:
+        cursor.execute(f"SELECT * FROM {table} LIMIT ?", (sample_size + 1,))
+        rows = cursor.fetchall()
+        if len(rows) <= sample_size:
+            return rows, len(rows), True
+        estimates, _ = _analyze_stats(cursor, schema)
+        return rows[:sample_size], max(estimates.get(table, 0), sample_size + 1), False
+
+    # Separate subqueries, so each is a single seek rather than one scan.
+    cursor.execute(f"SELECT (SELECT min(rowid) FROM {table}), (SELECT max(rowid) FROM {table})")
+    low, high = cursor.fetchone()
+    if low is None:
+        return [], 0, True
+    if high - low < sample_size:
+        cursor.execute(f"SELECT * FROM {table}")
+        rows = cursor.fetchall()
+        return rows, len(rows), True
+
+    # Seeded by the rowid range, so an unchanged table gives the same sample.
+    rng = random.Random(f"{table}:{low}:{high}")
+    sampled = {}
+    spanned = 0
+    for _ in range(max(sample_size // PROFILE_BLOCK_ROWS, 1)):
+        cursor.execute(f"SELECT rowid, * FROM {table} WHERE rowid >= ? ORDER BY rowid LIMIT ?",
+                       (rng.randint(low, high), PROFILE_BLOCK_ROWS))
+        block = cursor.fetchall()
+        if block:
+            spanned += block[-1][0] - block[0][0] + 1
+            sampled.update((row[0], row[1:]) for row in block)
+    rows = list(sampled.values())
+    # Rows per rowid within the runs, to account for gaps left by deletes.
+    density = min(len(sampled) / max(spanned, 1), 1.0)
+    return rows, max(round((high - low + 1) * density), len(rows)), False
+
+
+"""
+Orders values of different types the way SQLite does: numbers, then text,
+then blobs.
+"""
+def _sort_key(value):
+    if isinstance(value, (int, float)):
+        return (0, value, b"")
+    if isinstance(value, str):
+        return (1, 0, value.encode())
+    return (2, 0, bytes(value))
+
+
+"""
+Estimates the number of distinct values in a column of total rows from a
+sample of sampled rows, with counts mapping each sampled value to the number
+of times it was seen. Uses the Duj1 estimator of Haas and Stokes, as
+PostgreSQL does: it stays close to the sampled count when values repeat, and
+scales up to total rows when nearly every sampled value is unique.
+"""
+def _estimate_distinct(counts, sampled, total):
+    if not counts:
+        return 0
+    singletons = sum(1 for count in counts.values() if count == 1)
+    estimate = sampled * len(counts) / (sampled - singletons + singletons * sampled / total)
+    return max(len(counts), min(round(estimate), total))
+
+
+"""
+Returns whether column of table can be looked up without a scan: it leads
+an index, or is the rowid itself.
+"""
+def _is_indexed(schema, table, column):
+    if schema[table]["rowid"] and schema[table]["pk"] == [column] and \
+            (schema[table]["types"][column] or "").upper() == "INTEGER":
+        return True
+    return any(index[0] == column for index in schema[table]["indexes"].values())
+
+
+"""
+Profiles table of db_file using cursor, or returns the cached profile if the
+data of db_file has not changed since. schema is the schema of db_file and
+version its data_version, read by the caller before taking the connection of
+cursor. See profile_table.
+:return: A tuple (profile, values) where values maps every column to the set
+         of distinct values sampled from it.
+"""
+def _profile(cursor, db_file, schema, version, table, sample_size=PROFILE_SAMPLE_ROWS):
+    _check_table(schema, db_file, table)
+    if is_internal_table(table):
+        raise InvalidTable(f"Table {table} is internal to {db_file}")
+    key = (version, sample_size)
+    with _profile_lock:
+        entry = _profile_cache.get((db_file, table))
+    if entry is not None and entry[0] == key:
+        return entry[1], entry[2]
+
+    columns = schema[table]["columns"]
+    rows, total, complete = _sample_rows(cursor, schema, table, sample_size)
+    profiles = []
+    values = {}
+    for i, column in enumerate(columns):
+        counts = collections.Counter(row[i] for row in rows if row[i] is not None)
+        nulls = len(rows) - sum(counts.values())
+        ordered = sorted(counts, key=_sort_key)
+        low, high = (ordered[0], ordered[-1]) if ordered else (None, None)
+        # An index on the column gives the exact bounds with one seek to each
+        # end, as long as min and max are separate subqueries.
+        if not complete and _is_indexed(schema, table, column):
+            cursor.execute(f"SELECT (SELECT min({column}) FROM {table}), (SELECT max({column}) FROM {table})")
+            low, high = cursor.fetchone()
+        profiles.append({
+            "column": column,
+            "type": schema[table]["types"][column],
+            "null_fraction": nulls / len(rows) if rows else 0.0,
+            "distinct": len(counts) if complete else _estimate_distinct(counts, len(rows), total),
+            "distinct_estimated": not complete,
+            "min": low,
+            "max": high,
+            "top": [{"value": value, "count": count, "fraction": count / len(rows)}
+                    for value, count in counts.most_common(PROFILE_TOP_VALUES)]
+        })
+        values[column] = set(counts)
+
+    profile = {"table": table, "rows": total, "rows_estimated": not complete, "sampled": len(rows),
+               "columns": profiles}
+    with _profile_lock:
+        _profile_cache[(db_file, table)] = (key, profile, values)
+    return profile, values
+
+
+"""
+Profiles the columns of table in db_file from a random sample of its rows
+(see _sample_rows), so the cost does not grow with the size of the table.
+Profiles are cached until the data of db_file changes.
+:return: A dictionary with "table", "rows" (an estimate unless
+         "rows_estimated" is false), "sampled" (the number of rows sampled)
+         and "columns": a list with the "column", "type", "null_fraction",
+         "distinct" (estimated unless "distinct_estimated" is false), "min",
+         "max" (exact if the column is indexed) and "top" (the most common
+         sampled values, as {"value", "count", "fraction"}) of every column.
+"""
+def profile_table(db_file, table, sample_size=PROFILE_SAMPLE_ROWS):
+    schema = get_schema(db_file)
+    version = data_version(db_file)
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            return _profile(cursor, db_file, schema, version, table, sample_size)[0]
+
+
+"""
+Returns the SQLite type affinity of a declared column type, following the
+rules of SQLite in their order (so "CHARINT" has INTEGER affinity).
+"""
+def _affinity(declared):
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return "INTEGER"
+    if any(name in declared for name in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not declared or "BLOB" in declared:
+        return "BLOB"
+    if any(name in declared for name in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+"""
+Estimates the fraction of the distinct values of column source of table
+source_table that also occur in column target of target_table. If target is
+indexed, sampled values are looked up in it; otherwise the sampled values
+of both columns are compared, allowing for the part of the target's values
+the sample covers.
+"""
+def _containment(cursor, db_file, schema, version, source_table, source, target_table, target):
+    source_profile, source_values = _profile(cursor, db_file, schema, version, source_table)
+    target_profile, target_values = _profile(cursor, db_file, schema, version, target_table)
+    values = sorted(source_values[source], key=_sort_key)
+    if not values:
+        return 0.0
+    if _is_indexed(schema, target_table, target):
+        probes = random.Random(f"{source_table}.{source}").sample(values, min(len(values), PROFILE_PROBE_VALUES))
+        found = 0
+        for value in probes:
+            cursor.execute(f"SELECT 1 FROM {target_table} WHERE {target} = ? LIMIT 1", (value,))
+            found += cursor.fetchone() is not None
+        return found / len(probes)
+    distinct = next(profile["distinct"] for profile in target_profile["columns"] if profile["column"] == target)
+    coverage = min(len(target_values[target]) / distinct, 1.0) if distinct else 1.0
+    overlap = len(target_values[target].intersection(values)) / len(values)
+    return min(overlap / coverage, 1.0) if coverage else 0.0
+
+
+"""
+Estimates the number of rows of a join of a table of left_rows rows with one
+of right_rows rows on columns with left_distinct and right_distinct values,
+assuming the values of the column with fewer distinct values all occur in
+the other.
+"""
+def _join_cardinality(left_rows, left_distinct, right_rows, right_distinct):
+    return left_rows * right_rows / max(left_distinct, right_distinct, 1)
+
+
+"""
+Suggests columns to join left and right tables of db_file on, from their
+profiles (see profile_table): pairs of columns with the same type affinity
+and more than one distinct value, ranked by their score: the fraction of the
+values of the column with fewer distinct values found in the other, scaled
+down when the two have very different numbers of distinct values (so that a
+column of a few small numbers is not mistaken for a key into an id column).
+:return: At most limit suggestions, as dictionaries with the "left" and
+         "right" column, the "containment" (the fraction of values found),
+         the "score" and "estimated_rows" (the estimated number of rows of the
+         join).
+"""
+def suggest_joins(db_file, left, right, limit=5):
+    schema = get_schema(db_file)
+    version = data_version(db_file)
+
+    suggestions = []
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            left_profile, _ = _profile(cursor, db_file, schema, version, left)
+            right_profile, _ = _profile(cursor, db_file, schema, version, right)
+            for left_column in left_profile["columns"]:
+                for right_column in right_profile["columns"]:
+                    if left_column["distinct"] < 2 or right_column["distinct"] < 2:
+                        continue
+                    if _affinity(left_column["type"]) != _affinity(right_column["type"]):
+                        continue
+                    # Keys are looked for in the column with more distinct values.
+                    if left_column["distinct"] <= right_column["distinct"]:
+                        containment = _containment(cursor, db_file, schema, version, left, left_column["column"],
+                                                   right, right_column["column"])
+                    else:
+                        containment = _containment(cursor, db_file, schema, version, right, right_column["column"],
+                                                   left, left_column["column"])
+                    if containment == 0:
+                        continue
+                    ratio = min(left_column["distinct"], right_column["distinct"]) / \
+                        max(left_column["distinct"], right_column["distinct"])
+                    estimate = _join_cardinality(left_profile["rows"], left_column["distinct"],
+                                                 right_profile["rows"], right_column["distinct"])
+                    suggestions.append({
+                        "left": left_column["column"],
+                        "right": right_column["column"],
+                        "containment": containment,
+                        "score": containment * math.sqrt(ratio),
+                        "estimated_rows": round(estimate * containment),
+                        "same_name": left_column["column"] == right_column["column"]
+                    })
+    suggestions.sort(key=lambda suggestion: (-suggestion["score"], not suggestion["same_name"],
+                                             suggestion["estimated_rows"]))
+    for suggestion in suggestions:
+        del suggestion["same_name"]
+    return suggestions[:limit]
+
+
+"""
+Estimates the number of rows a join (see join) returns, from the profiles of
+its tables, without running it. Every join condition is assumed to match each
+value of the column with fewer distinct values (see _join_cardinality), and
+conditions to be independent; filters are not taken into account.
+"""
+def estimate_join(db_file, prim_table, tables, identifiers):
+    prepare_join(db_file, prim_table, tables, identifiers)
+    schema = get_schema(db_file)
+    version = data_version(db_file)
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            profiles = {table: _profile(cursor, db_file, schema, version, table)[0]
+                        for table in [prim_table] + list(tables)}
+    distinct = {(table, column["column"]): column["distinct"]
+                for table, profile in profiles.items() for column in profile["columns"]}
+
+    rows = profiles[prim_table]["rows"]
+    for table, join_identifiers in zip(tables, identifiers):
+        rows *= profiles[table]["rows"]
+        for table1, col1, table2, col2 in join_identifiers:
+            rows /= max(distinct[(table1, col1)], distinct[(table2, col2)], 1)
+    return round(rows)
+
+
+"""
+Creates the external-content FTS5 index over columns of table, and the
+triggers keeping it current, replacing any index built over other columns.
+"""
+def _create_search_index(cursor, table, columns):
+    index = f"{SEARCH_INDEX_PREFIX}{table}".replace('"', '""')
+    content = table.replace("'", "''")
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    new_values = ", ".join(f'NEW."{column}"' for column in columns)
+    old_values = ", ".join(f'OLD."{column}"' for column in columns)
+    remove_old = f"""INSERT INTO "{index}" ("{index}", rowid, {column_list}) VALUES ('delete', OLD.rowid, {old_values})"""
+    add_new = f"""INSERT INTO "{index}" (rowid, {column_list}) VALUES (NEW.rowid, {new_values})"""
+
+    for event in ("insert", "update", "delete"):
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{index}_{event}"')
+    cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+    try:
+        cursor.execute(f"""CREATE VIRTUAL TABLE "{index}" USING fts5({column_list}, content='{content}',
+                           content_rowid='rowid')""")
+    except sqlite3.OperationalError as ex:
+        if "no such module" in str(ex):
+            raise DatabaseError("Full-text search needs SQLite built with FTS5")
+        raise
+    cursor.execute(f"""INSERT INTO "{index}" ("{index}") VALUES ('rebuild')""")
+    cursor.execute(f'CREATE TRIGGER "{index}_insert" AFTER INSERT ON {table} BEGIN {add_new}; END')
+    cursor.execute(f'CREATE TRIGGER "{index}_update" AFTER UPDATE ON {table} BEGIN {remove_old}; {add_new}; END')
+    cursor.execute(f'CREATE TRIGGER "{index}_delete" AFTER DELETE ON {table} BEGIN {remove_old}; END')
+
+
+"""
+Builds the search index of table in db_file unless it exists and covers the
+current text columns of table.
+:return: The name of the index.
+"""
+def _ensure_search_index(db_file, table):
+    schema = get_schema(db_file)
+    index = f"{SEARCH_INDEX_PREFIX}{table}"
+    if not schema[table]["rowid"]:
+        raise BadFields(f"Table {table} has no rowid and cannot be searched")
+    # Only columns with TEXT affinity are searched.
+    columns = [column for column in schema[table]["columns"] if _affinity(schema[table]["types"][column]) == "TEXT"]
+    if not columns:
+        raise BadFields(f"Table {table} has no text columns to search")
+    if index in schema and schema[index]["columns"] == columns:
+        return index
+
+    def apply(cursor):
+        # Another request may have built it while this one waited for the lock.
+        cursor.execute("SELECT name FROM pragma_table_info(?)", (index,))
+        indexed = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                       (f"{index}_delete",))
+        if indexed != columns or cursor.fetchone()[0] == 0:
+            logger.info("building search index for %s over %s", table, ", ".join(columns))
+            _create_search_index(cursor, table, columns)
+    _write(db_file, apply)
+    return index
+
+
+"""
+Turns the words of text into an FTS5 query matching rows that contain every
+word, the last one possibly as the start of a longer word (so that results
+can be shown while the user types).
+"""
+def _search_query(text):
+    words = text.split()
+    if not words:
+        raise BadFields("The search text is empty")
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+"""
+Searches the text columns of table in db_file for rows containing the words
+of text, best matches first (by FTS5's bm25 rank). The full-text index is
+built on the first search of a table and kept current with triggers from
+then on, so later writes by any connection keep it up to date.
+:param limit: The maximum number of rows returned.
+:param offset: The number of best matches to skip.
+:return: A tuple (rows, next) where rows are as returned by get_all with
+         include_rowid set, and next is the offset of the next page, or None
+         after the last one.
+"""
+def search(db_file, table, text, limit, offset=0):
+    schema = get_schema(db_file)
+    _check_table(schema, db_file, table)
+    if is_internal_table(table):
+        raise InvalidTable(f"Table {table} is internal to {db_file}")
+    if limit < 1 or offset < 0:
+        raise DatabaseError(f"Invalid search page limit={limit} offset={offset}")
+    query = _search_query(text)
+    index = _ensure_search_index(db_file, table).replace('"', '""')
+
+    columns = _result_columns(schema, table, True)
+    sql_query = f"""SELECT {table}.rowid, {table}.* FROM {table}
+                    JOIN (SELECT rowid AS match_rowid, rank AS match_rank FROM "{index}"
+                          WHERE "{index}" MATCH ? ORDER BY rank LIMIT ? OFFSET ?) AS matches
+                    ON {table}.rowid = matches.match_rowid
+                    ORDER BY matches.match_rank"""
+    rows = list(_rows_to_dicts(_iter_query(db_file, sql_query, (query, limit + 1, offset)), columns))
+    if len(rows) > limit:
+        return rows[:limit], offset + limit
+    return rows, None
+
+
+"""
+Removes the search index of table in db_file and its triggers, if any.
+:return: Whether there was an index.
+"""
+def drop_search_index(db_file, table):
+    check_table(db_file, table)
+    index = f"{SEARCH_INDEX_PREFIX}{table}"
+
+    def apply(cursor):
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = ?", (index,))
+        existed = cursor.fetchone()[0] > 0
+        quoted = index.replace('"', '""')
+        for event in ("insert", "update", "delete"):
+            cursor.execute(f'DROP TRIGGER IF EXISTS "{quoted}_{event}"')
+        cursor.execute(f'DROP TABLE IF EXISTS "{quoted}"')
+        return existed
+    return _write(db_file, apply)
+
+
+"""
+Validates a join and builds its SQL, filtered and sorted as given (see
+_compile_filters, _compile_sort and _join_resolver).
+:return: A tuple (sql_query, parameters, columns, lookupTable) where columns
+         lists the name of every result column and lookupTable the table it
+         belongs to.
+"""
+def _join_query(schema, db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    _check_table(schema, db_file, prim_table)
+    for table in tables:
+        _check_table(schema, db_file, table)
+    for join_identifiers in identifiers:
+        if len(join_identifiers) < 1:
+            raise DatabaseError("Must have atleast one column to join on.")
+        for identifier in join_identifiers:
+            table1, col1, table2, col2 = identifier
+            _check_table(schema, db_file, table1)
+            _check_table(schema, db_file, table2)
+            _check_columns(schema, table1, {col1: ""}, include_all=False)
+            _check_columns(schema, table2, {col2: ""}, include_all=False)
+    if len(tables) != len(identifiers):
+        raise DatabaseError("Number of tables to join must match number of identifiers.")
+    
+    columns = list(schema[prim_table]["columns"])
+    lookupTable = [prim_table] * len(columns)
+    for table in tables:
+        secColumns = schema[table]["columns"]
+        columns += secColumns
+        lookupTable += [table] * len(secColumns)
+
+    sql_query = f"SELECT * FROM {prim_table}"
+    for table, join_identifiers in zip(tables, identifiers):
+        join_query = f" JOIN {table} ON "
+        select_query = " AND ".join([f"{table1}.{col1} = {table2}.{col2}" for table1, col1, table2, col2 in join_identifiers])
+        sql_query += join_query + select_query
+
+    resolve = _join_resolver(schema, [prim_table] + list(tables))
+    condition, parameters = _compile_filters(filters, resolve)
+    order = _compile_sort(sort, resolve)
+    if condition:
+        sql_query += f" WHERE {condition}"
+    if order:
+        sql_query += f" ORDER BY {order}"
+    return sql_query, parameters, columns, lookupTable
+
+
+"""
+Returns a resolver (see _compile_filters) for the columns of a join, named
+"table.column", or just "column" if only one of the tables has it.
+"""
+def _join_resolver(schema, tables):
+    def resolve(name):
+        if not isinstance(name, str):
+            raise BadFields(f"Invalid column {name!r}")
+        table, _, column = name.rpartition(".")
+        if table:
+            if table not in tables or column not in schema[table]["types"]:
+                raise BadFields(f"Column {name} is not part of the join")
+            return f"{table}.{column}"
+        matches = [table for table in dict.fromkeys(tables) if name in schema[table]["types"]]
+        if len(matches) != 1:
+            raise BadFields(f"Column {name} is {'ambiguous' if matches else 'not part of the join'}")
+        return f"{matches[0]}.{name}"
+    return resolve
+
+
+"""
+Returns a generator over the rows of a join (see join) as dictionaries.
+The join is validated immediately; rows are fetched lazily in batches.
+"""
+def iter_join(db_file, prim_table, tables, identifiers, batch_size=FETCH_BATCH_SIZE, filters=None, sort=None):
+    schema = get_schema(db_file)
+    sql_query, parameters, columns, lookupTable = _join_query(schema, db_file, prim_table, tables, identifiers,
+                                                              filters, sort)
+    logger.debug("sql=%s", sql_query)
+    return _join_rows(_iter_query(db_file, sql_query, parameters, batch_size=batch_size), columns, lookupTable)
+
+
+"""
+Converts joined tuples to dictionaries. Columns whose name clashes with an
+earlier column holding a different value are qualified with their table.
+"""
+def _join_rows(rows, columns, lookupTable):
+    for row in rows:
+        entry = {}
+        for i, col in enumerate(row):
+            if columns[i] in entry and entry[columns[i]] != col:
+                entry[f"{lookupTable[i]}.{columns[i]}"] = col
+            else:
+                entry[columns[i]] = col
+        yield entry
+
+
+"""
+Returns the key under which a join is cached. Lists are converted to tuples so
+that equal specs sent as JSON or as Python tuples share an entry.
+"""
+def _join_key(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    try:
+        key = (db_file, prim_table, tuple(tables),
+               tuple(tuple(tuple(identifier) for identifier in join_identifiers)
+                     for join_identifiers in identifiers),
+               json.dumps([filters, sort], sort_keys=True))
+        hash(key)
+    except TypeError:
+        raise DatabaseError("Invalid join specification.")
+    return key
+
+
+"""
+Estimates the memory taken by a list of result rows (dictionaries or tuples)
+from a sample of them.
+"""
+def _estimate_size(rows, sample_size=100):
+    sample = rows[:sample_size]
+    if not sample:
+        return sys.getsizeof(rows)
+    sample_bytes = 0
+    for row in sample:
+        values = row.values() if isinstance(row, dict) else row
+        sample_bytes += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+    return sys.getsizeof(rows) + sample_bytes * len(rows) // len(sample)
+
+
+"""
+Returns the cached result for key if it was computed at the given data version.
+"""
+def _join_cache_get(key, version):
+    global _join_cache_bytes
+    with _join_cache_lock:
+        entry = _join_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            del _join_cache[key]
+            _join_cache_bytes -= entry[2]
+            return None
+        _join_cache.move_to_end(key)
+        return entry[1]
+
+
+"""
+Caches a join result, evicting the least recently used entries to stay
+within JOIN_CACHE_BYTES. Results larger than the whole budget are not cached.
+"""
+def _join_cache_put(key, version, result):
+    global _join_cache_bytes
+    rows = result["rows"] if isinstance(result, dict) else result
+    size = _estimate_size(rows)
+    if size > JOIN_CACHE_BYTES:
+        return
+    with _join_cache_lock:
+        old = _join_cache.pop(key, None)
+        if old is not None:
+            _join_cache_bytes -= old[2]
+        _join_cache[key] = (version, result, size)
+        _join_cache_bytes += size
+        while _join_cache_bytes > JOIN_CACHE_BYTES:
+            _, evicted = _join_cache.popitem(last=False)
+            _join_cache_bytes -= evicted[2]
+
+
+"""
+Empties the join result cache.
+"""
+def clear_join_cache():
+    global _join_cache_bytes
+    with _join_cache_lock:
+        _join_cache.clear()
+        _join_cache_bytes = 0
+
+
+"""
+Performs an inner join on two tables based on a common column.
+Results are cached until the database changes; the returned list may be
+shared with other callers and must not be modified.
+:param db_file: The database file.
+:param table1: The primary table.
+:param table2: A list of tables to join.
+:param join_column: A list of list of tuples. Each tuple is (table1, col1, table2, col2).
+:return: A list of dictionaries representing the joined table.
+"""
+def join(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    compute = lambda: _materialize(iter_join(db_file, prim_table, tables, identifiers, filters=filters, sort=sort))
+    return _cached_join(db_file, prim_table, tables, identifiers, filters, sort, "rows", compute)
+
+
+"""
+Returns the cached result of a join in the given format, computing and
+caching it with compute if it is missing or stale.
+"""
+def _cached_join(db_file, prim_table, tables, identifiers, filters, sort, format, compute):
+    key = _join_key(db_file, prim_table, tables, identifiers, filters, sort) + (format,)
+    # Read before running the query, so a concurrent commit can only make the
+    # entry look stale, never make stale rows look current.
+    version = data_version(db_file)
+    result = _join_cache_get(key, version)
+    if result is None:
+        result = compute()
+        _join_cache_put(key, version, result)
+    return result
+
+
+"""
+Performs a join (see join) and returns it in columnar form: a dictionary with
+"columns" (fully qualified "table.column" names), "types" (their declared
+types) and "rows" (a list of tuples straight from the cursor). Results are
+cached like those of join and must not be modified.
+"""
+def join_columnar(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    def compute():
+        sql_query, parameters, result = prepare_join(db_file, prim_table, tables, identifiers, filters, sort)
+        logger.debug("sql=%s", sql_query)
+        result["rows"] = _materialize(_iter_query(db_file, sql_query, parameters))
+        return result
+    return _cached_join(db_file, prim_table, tables, identifiers, filters, sort, "columnar", compute)
+
+
+"""
+Returns limit rows of a join (see join) starting at offset, in columnar form
+(see join_columnar) with "offset" and "next" (the offset of the following
+rows, or None after the last), so clients can read large results a range at
+a time. Ranges are sliced from the cached result when there is one, and read
+with LIMIT and OFFSET otherwise, so only the rows up to the end of the range
+are read; the join's rows come in the same order on every run while the data
+does not change.
+"""
+def join_page(db_file, prim_table, tables, identifiers, offset, limit, filters=None, sort=None):
+    if offset < 0 or limit < 1:
+        raise DatabaseError("Invalid range of join rows.")
+    sql_query, parameters, result = prepare_join(db_file, prim_table, tables, identifiers, filters, sort)
+    key = _join_key(db_file, prim_table, tables, identifiers, filters, sort) + ("columnar",)
+    cached = _join_cache_get(key, data_version(db_file))
+    if cached is not None:
+        rows = cached["rows"][offset:offset + limit + 1]
+    else:
+        rows = _materialize(_iter_query(db_file, f"SELECT * FROM ({sql_query}) LIMIT ? OFFSET ?",
+                                        list(parameters) + [limit + 1, offset]))
+    result["rows"] = rows[:limit]
+    result["offset"] = offset
+    result["next"] = offset + limit if len(rows) > limit else None
+    return result
+
+
+"""
+Validates a join (see join) for callers that run its query themselves.
+:return: A tuple (sql_query, parameters, header) where header is the
+         "columns" and "types" of the join's columnar result (see join_columnar).
+"""
+def prepare_join(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    schema = get_schema(db_file)
+    sql_query, parameters, columns, lookupTable = _join_query(schema, db_file, prim_table, tables, identifiers,
+                                                              filters, sort)
+    header = {
+        "columns": [f"{table}.{column}" for table, column in zip(lookupTable, columns)],
+        "types": [schema[table]["types"][column] for table, column in zip(lookupTable, columns)]
+    }
+    return sql_query, parameters, header
+
+
+"""
+Like iter_join, but for exporting: rows are left as tuples.
+:return: A tuple (columns, rows) where columns are named "table.column" and
+         rows is a generator over tuples holding their values.
+"""
+def iter_join_rows(db_file, prim_table, tables, identifiers, batch_size=FETCH_BATCH_SIZE, filters=None, sort=None):
+    sql_query, parameters, header = prepare_join(db_file, prim_table, tables, identifiers, filters, sort)
+    return header["columns"], _iter_query(db_file, sql_query, parameters, batch_size=batch_size)
         
 
+"""
+Parses the detail of an EXPLAIN QUERY PLAN entry into the table it reads and
+how: "scan", "index", "automatic" or "other" (see explain_join). SQLite
+before 3.36 writes "SCAN TABLE x" where later versions write "SCAN x".
+:return: A tuple (table, access); table is None for other entries.
+"""
+def _plan_access(detail):
+    match = re.match(r"(SCAN|SEARCH) (?:TABLE )?(\S+)", detail)
+    if match is None:
+        return None, "other"
+    if "AUTOMATIC" in detail:
+        return match.group(2), "automatic"
+    if match.group(1) == "SEARCH":
+        return match.group(2), "index"
+    return match.group(2), "scan"
+
+
+"""
+Runs EXPLAIN QUERY PLAN on a join (see join) and reports how each table is
+accessed. The first table read is the outer loop, which is read once however
+it is accessed; any other full scan, or an automatic index SQLite has to build for every
+query, marks a join column that would benefit from an index.
+:return: A dictionary with keys "sql" (the join query), "plan" (a list of
+         {"detail", "table", "access"} entries, access being one of "scan",
+         "index", "automatic" or "other") and "missing_indexes" (a list of
+         {"table", "columns"} suggestions).
+"""
+def explain_join(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    schema = get_schema(db_file)
+    sql_query, parameters, _, _ = _join_query(schema, db_file, prim_table, tables, identifiers, filters, sort)
+
+    with _read_connection(db_file) as conn:
+        with contextlib.closing(conn.cursor()) as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql_query}", parameters)
+            entries = [(row[1], row[3]) for row in cursor.fetchall()]
+
+    plan = []
+    slow_tables = []
+    outer_loop = True
+    for parent, detail in entries:
+        table, access = _plan_access(detail)
+        plan.append({"detail": detail, "table": table, "access": access})
+
+        if access == "automatic" or (access == "scan" and not outer_loop):
+            slow_tables.append(table)
+        # The first table read at the top level is the outer loop, scanned or searched.
+        if table is not None and parent == 0:
+            outer_loop = False
+
+    missing_indexes = []
+    for table in slow_tables:
+        columns = _join_columns(identifiers, table)
+        if table not in schema or not columns:
+            continue
+        indexed = any(index[:len(columns)] == columns for index in schema[table]["indexes"].values())
+        if not indexed:
+            missing_indexes.append({"table": table, "columns": columns})
+
+    return {"sql": sql_query, "plan": plan, "missing_indexes": missing_indexes}
+
+
+"""
+Returns the columns of table used to join it to other tables, in the order
+they appear in identifiers.
+"""
+def _join_columns(identifiers, table):
+    columns = []
+    for join_identifiers in identifiers:
+        for table1, col1, table2, col2 in join_identifiers:
+            if table1 == table2:
+                continue
+            for other_table, column in ((table1, col1), (table2, col2)):
+                if other_table == table and column not in columns:
+                    columns.append(column)
+    return columns
+
+
+"""
+Creates the indexes suggested by explain_join for a join.
+:return: A list of {"table", "columns", "name"} entries for the indexes created.
+"""
+def create_join_indexes(db_file, prim_table, tables, identifiers):
+    suggestions = explain_join(db_file, prim_table, tables, identifiers)["missing_indexes"]
+
+    def apply(cursor):
+        created = []
+        for suggestion in suggestions:
+            table = suggestion["table"]
+            columns = suggestion["columns"]
+            name = re.sub(r"\W", "_", f"browser_{table}_{'_'.join(columns)}_index")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            created.append(dict(suggestion, name=name))
+        return created
+    return _write(db_file, apply)
+
+
 """
 For local testing (see more in test_db.py).
 """
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import metrics
+
+
+"""
+Concurrency limits per route, as (concurrent requests, queued requests).
+Routes not listed share DEFAULT_LIMIT per route; routes in EXEMPT are never
+limited. Requests that cannot start within QUEUE_TIMEOUT seconds, or find the
+queue full, are rejected and told to retry after RETRY_AFTER seconds.
+"""
+DEFAULT_LIMIT = (8, 32)
+ROUTE_LIMITS = {
+    "/api/get_all/<table>": (2, 8),
+    "/api/join": (2, 8),
+    "/api/join/plan": (4, 16),
+    "/api/jobs/join": (4, 16),
+    "/api/export/<table>": (2, 8),
+    "/api/export/join": (2, 8),
+    "/api/import/<table>": (2, 8),
+}
+EXEMPT = {"/api/metrics", "/static/<path:filename>"}
+QUEUE_TIMEOUT = 10
+RETRY_AFTER = 1
+
+
+class Saturated(Exception):
+    def __init__(self, route):
+        self.route = route
+
+    def __str__(self):
+        return f"Saturated: too many requests to {self.route}"
+
+
+"""
+Admits at most concurrency holders at a time, with at most queue more waiting.
+"""
+class Limit:
+    def __init__(self, concurrency, queue):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+    """
+    Waits up to timeout seconds for a free slot.
+    :return: Whether a slot was taken; it must be given back with release.
+    """
+    def acquire(self, timeout):
+        with self.condition:
+            if self.active < self.concurrency:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + timeout
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        if self.active >= self.concurrency:
+                            return False
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+"""
+A slot taken by admit. Releasing it more than once has no effect, so it can be
+released both when a response finishes streaming and when the request ends.
+"""
+class Slot:
+    def __init__(self, limit):
+        self._limit = limit
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            limit, self._limit = self._limit, None
+        if limit is not None:
+            limit.release()
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+"""
+Returns the Limit shared by requests to route.
+"""
+def _limit(route):
+    with _limits_lock:
+        limit = _limits.get(route)
+        if limit is None:
+            limit = _limits[route] = Limit(*ROUTE_LIMITS.get(route, DEFAULT_LIMIT))
+        return limit
+
+
+"""
+Waits for a slot to handle a request to route.
+:return: A Slot to release when the request is done, or None for exempt routes.
+:raise Saturated: If the route's queue is full or no slot freed up in time.
+"""
+def admit(route):
+    if route in EXEMPT:
+        return None
+    limit = _limit(route)
+    if not limit.acquire(QUEUE_TIMEOUT):
+        metrics.increment("requests_rejected")
+        raise Saturated(route)
+    return Slot(limit)
+
+
+"""
+Forgets every limit, so changes to the settings above take effect.
+"""
+def reset():
+    with _limits_lock:
+        _limits.clear()
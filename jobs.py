@@ -0,0 +1,237 @@
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+import database
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Number of jobs run at the same time. Further jobs wait in a queue.
+"""
+JOB_WORKERS = 4
+
+"""
+Number of SQLite virtual machine instructions between progress callbacks.
+"""
+PROGRESS_INSTRUCTIONS = 10000
+
+"""
+Seconds a finished job, and its rows, are kept after it was last accessed.
+At most MAX_FINISHED_JOBS finished jobs are kept; older ones are removed first.
+"""
+JOB_TTL = 600
+MAX_FINISHED_JOBS = 16
+
+"""
+Maximum number of rows a job keeps when database.MAX_RESULT_ROWS is not set,
+since its rows stay in memory until the job expires.
+"""
+MAX_JOB_ROWS = 1000000
+
+
+"""
+A join run in the background. Rows become readable as they are fetched.
+Status is one of "queued", "running", "done", "failed" or "cancelled".
+"""
+class Job:
+    def __init__(self, db_file, sql_query, header, parameters=()):
+        self.id = uuid.uuid4().hex
+        self.db_file = db_file
+        self.sql_query = sql_query
+        self.parameters = parameters
+        self.header = header
+        self.status = "queued"
+        self.rows = []
+        self.progress = 0
+        self.error = None
+        self.created = time.monotonic()
+        self.finished = None
+        self.accessed = self.created
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self._conn = None
+
+    """
+    Returns the status of the job as a dictionary.
+    "progress" counts the progress callbacks made by SQLite so far, which grows
+    steadily while the query runs even before it returns its first row.
+    """
+    def describe(self):
+        with self.lock:
+            end = self.finished if self.finished is not None else time.monotonic()
+            return {
+                "id": self.id,
+                "status": self.status,
+                "rows": len(self.rows),
+                "progress": self.progress,
+                "error": self.error,
+                "elapsed": end - self.created
+            }
+
+    """
+    Returns up to limit rows fetched so far starting at offset, in columnar
+    form (see database.join_columnar), along with the status of the job.
+    """
+    def read(self, offset, limit):
+        with self.lock:
+            result = dict(self.header)
+            result["rows"] = self.rows[offset:offset + limit]
+            result["offset"] = offset
+            result["status"] = self.status
+            result["error"] = self.error
+            return result
+
+    def _on_progress(self):
+        self.progress += 1
+        # Non-zero aborts the statement, in case the interrupt came between two.
+        return 1 if self.cancelled else 0
+
+    def _finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.monotonic()
+
+    """
+    Finishes the job after its query raised error: as cancelled if it was
+    cancelled, whatever error the interruption surfaced as, as failed otherwise.
+    Must be called with the lock held.
+    """
+    def _fail(self, error):
+        if self.cancelled:
+            self._finish("cancelled")
+        else:
+            self._finish("failed", error)
+
+
+_executor = None
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+"""
+Removes finished jobs that have not been accessed for JOB_TTL seconds, and
+the least recently accessed finished jobs beyond MAX_FINISHED_JOBS.
+Must be called with _jobs_lock held.
+"""
+def _expire():
+    now = time.monotonic()
+    for job_id, job in list(_jobs.items()):
+        if job.finished is not None and now - job.accessed > JOB_TTL:
+            del _jobs[job_id]
+    finished = sorted((job for job in _jobs.values() if job.finished is not None), key=lambda job: job.accessed)
+    for job in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+        del _jobs[job.id]
+
+
+"""
+Runs job on a connection of its own, so it can be interrupted safely.
+The job's progress handler replaces the one enforcing
+database.QUERY_TIME_LIMIT, since jobs are meant for long queries and can be
+cancelled instead. Results are still capped at database.MAX_RESULT_ROWS, or
+MAX_JOB_ROWS if that is not set.
+"""
+def _run(job):
+    with job.lock:
+        if job.cancelled:
+            return
+        job.status = "running"
+    max_rows = database.MAX_RESULT_ROWS if database.MAX_RESULT_ROWS is not None else MAX_JOB_ROWS
+    with metrics.route("job"):
+        conn = None
+        try:
+            conn = database.connect(job.db_file)
+            with job.lock:
+                job._conn = conn
+            conn.set_progress_handler(job._on_progress, PROGRESS_INSTRUCTIONS)
+            cursor = conn.execute(job.sql_query, job.parameters)
+            while True:
+                rows = cursor.fetchmany(database.FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                with job.lock:
+                    job.rows.extend(rows)
+                    too_many = len(job.rows) > max_rows
+                if too_many:
+                    raise database.TooManyRows(f"The result has more than {max_rows} rows")
+            with job.lock:
+                job._finish("done")
+        except (sqlite3.OperationalError, database.DatabaseError) as ex:
+            with job.lock:
+                job._fail(str(ex))
+        except Exception as ex:
+            logger.exception("join job %s failed", job.id)
+            with job.lock:
+                job._fail(str(ex))
+        finally:
+            if conn is not None:
+                with job.lock:
+                    job._conn = None
+                conn.close()
+
+
+"""
+Validates a join (see database.join) and queues it to run in the background.
+Invalid joins raise immediately.
+:return: The new Job.
+"""
+def submit_join(db_file, prim_table, tables, identifiers, filters=None, sort=None):
+    global _executor
+    sql_query, parameters, header = database.prepare_join(db_file, prim_table, tables, identifiers, filters, sort)
+    job = Job(db_file, sql_query, header, parameters)
+    with _jobs_lock:
+        _expire()
+        if _executor is None:
+            # Created on first use, so that no threads exist before a fork.
+            _executor = concurrent.futures.ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix="join-job")
+        _jobs[job.id] = job
+        _executor.submit(_run, job)
+    return job
+
+
+"""
+Returns the job with id job_id, or None if there is none (or it expired).
+"""
+def get_job(job_id):
+    with _jobs_lock:
+        _expire()
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.accessed = time.monotonic()
+        return job
+
+
+"""
+Cancels a job: a queued job never starts, and the query of a running job is
+interrupted. Finished jobs are left as they are.
+:return: The job, or None if there is none.
+"""
+def cancel(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return None
+    with job.lock:
+        if job.finished is None:
+            job.cancelled = True
+            if job._conn is not None:
+                job._conn.interrupt()
+            elif job.status == "queued":
+                job._finish("cancelled")
+    return job
+
+
+"""
+Removes a job, cancelling it if it is still queued or running.
+:return: Whether the job existed.
+"""
+def discard(job_id):
+    if cancel(job_id) is None:
+        return False
+    with _jobs_lock:
+        return _jobs.pop(job_id, None) is not None
@@ -1,7 +1,16 @@
 from argparse import ArgumentParser
 
+import logging
+import os
+import signal
+import socket
 import sys
+import time
 
+from werkzeug.serving import make_server
+
+import database
+import metrics
 import server
 
 
@@ -10,7 +19,7 @@ DB_URL = ""
 
 def handle_args():
     """
-    Handle and return arguments using ArgumentParser.
+    Handle and return arguments using ArgumentParser, as an argparse.Namespace.
     """
     parser = ArgumentParser(prog=sys.argv[0],
                             description="SQLite3 Web Browser",
@@ -19,15 +28,196 @@ def handle_args():
                         help="the database file to connect to")
     parser.add_argument("port", type=int,
                         help="the port at which the server should listen")
-    return vars(parser.parse_args())['file'], vars(parser.parse_args())['port']
+    parser.add_argument("--pragmas", choices=database.PRAGMA_PROFILES.keys(),
+                        default="default",
+                        help="the pragma profile applied to database connections")
+    parser.add_argument("--join-cache-mb", type=int,
+                        default=database.JOIN_CACHE_BYTES // (1024 * 1024),
+                        help="the memory budget for cached join results, in megabytes")
+    parser.add_argument("--allow-index-creation", action="store_true",
+                        help="let users create the indexes suggested for slow joins")
+    parser.add_argument("--enable-search", action="store_true",
+                        help="let users search tables, adding a full-text index to each table searched")
+    parser.add_argument("--track-changes", action="store_true",
+                        help="let table pages follow changes, adding triggers and a change log to the database")
+    parser.add_argument("--drop-change-tracking", action="store_true",
+                        help="remove the change tracking triggers and log from the database, then exit")
+    parser.add_argument("--query-time-limit", type=float, default=None,
+                        help="the number of seconds a query may run before it is interrupted")
+    parser.add_argument("--max-result-rows", type=int, default=None,
+                        help="the maximum number of rows returned by a non-streamed response")
+    parser.add_argument("--busy-timeout", type=float, default=database.BUSY_TIMEOUT,
+                        help="the number of seconds to wait for another writer's lock")
+    parser.add_argument("--group-commit-ms", type=float, default=None,
+                        help="commit concurrent writes together, waiting up to this many milliseconds for more")
+    parser.add_argument("--snapshot", type=float, nargs="?", const=1.0, default=None, metavar="SECONDS",
+                        help="serve reads from an in-memory copy of the database, checking for changes "
+                             "made by other processes every SECONDS (default 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="serve with this many worker processes sharing the port")
+    parser.add_argument("--debug", action="store_true",
+                        help="run the Flask development server in debug mode, reloading on changes")
+    parser.add_argument("--quick-check", action="store_true",
+                        help="check the database for corruption before serving (reads the whole file)")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="do not read the tables into the page cache before serving")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        default="INFO",
+                        help="the minimum level of the messages logged")
+    parser.add_argument("--slow-query-ms", type=float, default=None,
+                        help="log SQL statements taking at least this many milliseconds")
+    return parser.parse_args()
+
+
+logger = logging.getLogger("main")
+
+
+def exit_on_sigterm(signum, frame):
+    """
+    Turns SIGTERM into SystemExit, so the server shuts down cleanly.
+    """
+    raise SystemExit(0)
+
+
+def startup(file, quick_check, warm, snapshot):
+    """
+    Validates the database and prepares it for the first requests, logging the
+    time each step took: checks the file (see database.check_db), runs PRAGMA
+    optimize, then loads the schema and warms the page cache (see
+    database.warm_up).
+    """
+    timings = []
+    start = step_start = time.perf_counter()
+
+    def step(name):
+        nonlocal step_start
+        now = time.perf_counter()
+        timings.append(f"{name}={(now - step_start) * 1000:.1f}ms")
+        step_start = now
+
+    database.check_db(file, quick_check)
+    step("check")
+    database.optimize(file)
+    step("optimize")
+    if warm:
+        tables = database.warm_up(file, snapshot)
+        step("warm_up")
+        logger.debug("warmed up tables %s", ", ".join(tables))
+    else:
+        database.get_schema(file)
+        step("schema")
+    logger.info("ready in %.1fms (%s)", (time.perf_counter() - start) * 1000, " ".join(timings))
+
+
+def run_worker(sock):
+    """
+    Serves requests accepted on the shared socket sock in a forked worker
+    process, with a thread per request. Its connections are optimized and
+    closed when it exits.
+    """
+    server.init_worker()
+    httpd = make_server('0.0.0.0', sock.getsockname()[1], server.app, threaded=True, fd=sock.fileno())
+    try:
+        httpd.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        database.close_connections(optimize=True)
+        os._exit(0)
+
+
+def serve_workers(port, workers):
+    """
+    Listens on port and forks workers processes accepting connections on the
+    socket. Workers that die are replaced until the server is told to stop.
+    """
+    if workers < 1:
+        raise ValueError("--workers must be at least 1")
+    if not hasattr(os, "fork"):
+        raise OSError("--workers requires a platform with fork()")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', port))
+    sock.listen(128)
+    # Background jobs live in the process that ran them, and the next poll
+    # may reach another worker.
+    server.JOBS_ENABLED = workers == 1
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, exit_on_sigterm)
+            run_worker(sock)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info("serving on port %d with %d workers", port, workers)
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except KeyboardInterrupt:
+                stop(signal.SIGINT, None)
+                continue
+            children.discard(pid)
+            if not stopping:
+                logger.warning("worker %d exited with status %d, restarting it", pid, os.waitstatus_to_exitcode(status))
+                spawn()
+    finally:
+        sock.close()
 
 
 def main():
-    file, port = handle_args()
-    server.DB_URL = file
+    args = handle_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    if args.slow_query_ms is not None:
+        metrics.SLOW_QUERY_SECONDS = args.slow_query_ms / 1000
+    server.DB_URL = args.file
+    server.ALLOW_INDEX_CREATION = args.allow_index_creation
+    server.SEARCH_ENABLED = args.enable_search
+    server.CHANGE_TRACKING_ENABLED = args.track_changes
+    database.QUERY_TIME_LIMIT = args.query_time_limit
+    database.MAX_RESULT_ROWS = args.max_result_rows
+    database.BUSY_TIMEOUT = args.busy_timeout
+    database.SNAPSHOT_INTERVAL = args.snapshot
+    if args.group_commit_ms is not None:
+        database.GROUP_COMMIT_WINDOW = args.group_commit_ms / 1000
+    database.set_pragma_profile(args.pragmas)
+    database.JOIN_CACHE_BYTES = args.join_cache_mb * 1024 * 1024
 
     try:
-        server.app.run(host='0.0.0.0', port=port, debug=True)
+        if args.drop_change_tracking:
+            dropped = database.drop_change_tracking(args.file)
+            logger.info("dropped %d change tracking triggers", dropped)
+            return
+        # With debug mode's reloader, the first process only watches for changes.
+        if not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            startup(args.file, args.quick_check, not args.no_warm_up, args.workers is None)
+        if args.workers is None:
+            signal.signal(signal.SIGTERM, exit_on_sigterm)
+            try:
+                server.app.run(host='0.0.0.0', port=args.port, debug=args.debug)
+            finally:
+                database.close_connections(optimize=True)
+        else:
+            # Workers must not inherit open connections.
+            database.close_connections()
+            serve_workers(args.port, args.workers)
     except Exception as ex:
         print(sys.argv[0] + ": " + str(ex), file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,175 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+
+"""
+Upper bounds, in seconds, of the latency histogram buckets.
+"""
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+"""
+Statements taking at least this many seconds (including fetching their rows)
+are logged to the "slow_query" logger. None disables the slow-query log.
+"""
+SLOW_QUERY_SECONDS = None
+
+PREFIX = "sqlite_browser"
+
+slow_log = logging.getLogger("slow_query")
+
+
+"""
+A cumulative histogram in the Prometheus style.
+"""
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_request = threading.local()
+_counters = {}
+_histograms = {}
+
+
+"""
+Returns the route of the request being handled by this thread, or "none"
+outside of a request.
+"""
+def current_route():
+    return getattr(_request, "route", None) or "none"
+
+
+"""
+Adds amount to the counter name, labeled with the current route.
+"""
+def increment(name, amount=1):
+    key = (name, (("route", current_route()),))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+"""
+Records value in the histogram name with the given labels (a tuple of
+(label, value) pairs).
+"""
+def observe(name, labels, value):
+    key = (name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+"""
+Marks the start of a request to route in this thread.
+"""
+def start_request(route):
+    _request.route = route
+    _request.start = time.perf_counter()
+
+
+"""
+Attributes the metrics recorded by this thread within the block to route,
+for work done on behalf of a request outside of it, such as streaming.
+"""
+@contextlib.contextmanager
+def route(name):
+    previous = getattr(_request, "route", None)
+    _request.route = name
+    try:
+        yield
+    finally:
+        _request.route = previous
+
+
+"""
+Records the latency of the request started by start_request in this thread.
+Streamed responses are timed until the response starts.
+"""
+def end_request(method, status):
+    start = getattr(_request, "start", None)
+    if start is None:
+        return
+    route = current_route()
+    observe("request_duration_seconds", (("route", route), ("method", method)), time.perf_counter() - start)
+    key = ("requests", (("route", route), ("method", method), ("status", str(status))))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+    _request.route = None
+    _request.start = None
+
+
+"""
+Records an executed SQL statement and the time spent running it and
+fetching its rows.
+"""
+def record_query(sql, seconds):
+    increment("sql_statements")
+    observe("sql_duration_seconds", (), seconds)
+    if SLOW_QUERY_SECONDS is not None and seconds >= SLOW_QUERY_SECONDS:
+        slow_log.warning("slow query route=%s seconds=%.3f sql=%s", current_route(), seconds, " ".join(sql.split()))
+
+
+"""
+Renders every metric in the Prometheus text exposition format.
+"""
+def render():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in _histograms.items())
+
+    declared = set()
+    for (name, labels), value in counters:
+        metric = f"{PREFIX}_{name}_total"
+        if metric not in declared:
+            lines.append(f"# TYPE {metric} counter")
+            declared.add(metric)
+        lines.append(f"{metric}{_labels(labels)} {value}")
+
+    for (name, labels), (counts, total, count, buckets) in histograms:
+        metric = f"{PREFIX}_{name}"
+        if metric not in declared:
+            lines.append(f"# TYPE {metric} histogram")
+            declared.add(metric)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{metric}_sum{_labels(labels)} {total}")
+        lines.append(f"{metric}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+"""
+Formats labels as a Prometheus label set.
+"""
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+"""
+Resets every metric.
+"""
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
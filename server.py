@@ -1,56 +1,493 @@
+import csv
 import flask
+import hashlib
+import io
+import itertools
+import json
+import logging
+import uuid
 import database
+import governor
+import jobs
+import metrics
 
 from sqlite3 import OperationalError as SQLiteError
 
 
 DB_URL = ""
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 5000
+NDJSON_MIMETYPE = "application/x-ndjson"
+COLUMNAR_MIMETYPE = "application/vnd.sqlite-browser.columnar+json"
+ALLOW_INDEX_CREATION = False
+"""
+Whether background join jobs are offered. They are kept in the memory of the
+process that runs them, so they are disabled when several processes serve.
+"""
+JOBS_ENABLED = True
+"""
+Whether tables can be searched. The first search of a table adds a full-text
+index, and triggers maintaining it, to the database.
+"""
+SEARCH_ENABLED = False
+"""
+Whether table pages follow changes made to their table. The first request for
+changes to a table adds triggers recording them, and a change log table, to
+the database.
+"""
+CHANGE_TRACKING_ENABLED = False
+"""
+Distinguishes ETags issued by this server process from those of other
+processes, earlier or concurrent, whose version counters differ.
+"""
+BOOT_ID = uuid.uuid4().hex
 app = flask.Flask(__name__)
 
 
+"""
+Prepares a freshly forked worker process. Connections opened by the parent
+must not be used in the child, and ETags must not be shared, since version
+counters are kept per process.
+"""
+def init_worker():
+    global BOOT_ID
+    BOOT_ID = uuid.uuid4().hex
+    database.close_connections()
+
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Logs an error caused by a bad request.
+"""
+def log_client_error(ex):
+    logger.info("client error method=%s path=%s error=%s", flask.request.method, flask.request.path, ex)
+
+
+"""
+Logs an error caused by a bad request or by the server being too busy to
+serve it, and aborts the request: with 503 and Retry-After if the database is
+busy or the query ran out of time, 413 if the result has too many rows, and
+400 otherwise.
+"""
+def abort_client_error(ex):
+    log_client_error(ex)
+    if isinstance(ex, (database.QueryTimeout, database.DatabaseBusy)):
+        flask.abort(retry_later())
+    if isinstance(ex, database.TooManyRows):
+        flask.abort(413, description="The result has too many rows, use get_page or format=ndjson instead.")
+    flask.abort(400)
+
+
+"""
+Returns a 503 response asking the client to retry after governor.RETRY_AFTER
+seconds.
+"""
+def retry_later():
+    response = flask.make_response("The server is busy, try again later.", 503)
+    response.headers["Retry-After"] = str(governor.RETRY_AFTER)
+    return response
+
+
+"""
+Logs an unexpected error, with its traceback.
+"""
+def log_server_error(ex):
+    logger.exception("server error method=%s path=%s error=%s", flask.request.method, flask.request.path, ex)
+
+
+@app.before_request
+def start_metrics():
+    rule = flask.request.url_rule
+    metrics.start_request(rule.rule if rule is not None else "unmatched")
+
+
+@app.before_request
+def admit_request():
+    rule = flask.request.url_rule
+    if rule is not None:
+        flask.g.slot = governor.admit(rule.rule)
+
+
+@app.errorhandler(governor.Saturated)
+def saturated(ex):
+    log_client_error(ex)
+    return retry_later()
+
+
+@app.after_request
+def record_response(response):
+    flask.g.status = response.status_code
+    if not response.is_streamed:
+        metrics.increment("response_bytes", response.content_length or 0)
+    return response
+
+
+@app.teardown_request
+def release_slot(ex):
+    slot = flask.g.pop("slot", None)
+    if slot is not None:
+        slot.release()
+
+
+@app.teardown_request
+def end_metrics(ex):
+    status = 500 if ex is not None else flask.g.get("status", 200)
+    metrics.end_request(flask.request.method, status)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+"""
+Returns a response built by build unless the client already holds it.
+The ETag is derived from version, which must change whenever the response
+would, and from BOOT_ID. If the request's If-None-Match matches it, build
+is never called and 304 Not Modified is returned. Either way clients are
+told to revalidate before reusing the response.
+:param vary: Request headers, besides the URL, the response depends on.
+"""
+def conditional_response(version, build, vary=None):
+    etag = hashlib.sha1(repr((BOOT_ID, version)).encode()).hexdigest()
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    if vary is not None:
+        response.headers["Vary"] = vary
+    return response
+
+
 @app.route('/', methods=['GET'])
 @app.route('/tables/<name>', methods=['GET'])
 @app.route('/join', methods=['GET'])
 def index(name=""):
-    return flask.render_template('index.html')
+    # The page is the same for every route and does not change while running.
+    return conditional_response("index", lambda: flask.make_response(flask.render_template('index.html')))
 
 
 @app.route('/api/get_tables', methods=['GET'])
 def get_tables():
-    tables = database.get_table_names(DB_URL)
-    return flask.jsonify(tables)
+    version = database.schema_version(DB_URL)
+    return conditional_response(version, lambda: flask.jsonify(database.get_table_names(DB_URL)))
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    exact = flask.request.args.get("exact", 0, type=int) == 1
+    try:
+        build = lambda: flask.jsonify(database.get_stats(DB_URL, exact))
+        return conditional_response((database.data_version(DB_URL), exact), build)
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/stats/analyze', methods=['POST'])
+def analyze():
+    if not ALLOW_INDEX_CREATION:
+        flask.abort(403)
+    try:
+        database.analyze(DB_URL)
+        return flask.jsonify("Success")
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/profile/<table>', methods=['GET'])
+def profile_table(table):
+    try:
+        build = lambda: flask.jsonify(database.profile_table(DB_URL, table))
+        return conditional_response(database.data_version(DB_URL), build)
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
 
 
 @app.route('/api/get_columns')
 def get_all_columns():
-    data = []
-    try:
-        tables = database.get_table_names(DB_URL)
+    def build():
+        schema = database.get_schema(DB_URL)
         columns = {}
-        for table in tables:
-            columns[table] = database.get_columns(DB_URL, table)
+        for table in database.get_table_names(DB_URL):
+            columns[table] = schema[table]["columns"]
         return flask.jsonify(columns)
-    except database.InvalidTable as ex:
-        print(ex)
-        return flask.abort(400)
+
+    try:
+        return conditional_response(database.schema_version(DB_URL), build)
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
         return flask.abort(500)
 
 
+"""
+Returns the response format the client asked for: "ndjson" for a stream of
+newline-delimited JSON, "columnar" for a header plus rows as plain arrays, or
+"json" for a list of row objects. It is taken from ?format= or, failing that,
+from an Accept header explicitly listing NDJSON_MIMETYPE or COLUMNAR_MIMETYPE.
+"""
+def response_format():
+    format = flask.request.args.get("format")
+    if format in ("ndjson", "columnar", "json"):
+        return format
+    # Only an explicit mention counts, browsers send */* by default.
+    for value, quality in flask.request.accept_mimetypes:
+        if quality > 0 and value == NDJSON_MIMETYPE:
+            return "ndjson"
+        if quality > 0 and value == COLUMNAR_MIMETYPE:
+            return "columnar"
+    return "json"
+
+
+"""
+Streams the chunks of text generated by chunks as a response of type mimetype.
+"""
+def stream_response(chunks, mimetype):
+    route = metrics.current_route()
+
+    # The request is torn down before the body is generated, so the stream
+    # keeps the request's slot until it is done.
+    slot = flask.g.pop("slot", None)
+
+    def generate():
+        try:
+            with metrics.route(route):
+                for chunk in chunks:
+                    metrics.increment("response_bytes", len(chunk))
+                    yield chunk
+        finally:
+            if slot is not None:
+                slot.release()
+
+    response = flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
+    if slot is not None:
+        response.call_on_close(slot.release)
+    return response
+
+
+"""
+Splits rows into lists of up to database.FETCH_BATCH_SIZE rows.
+"""
+def batches(rows):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, database.FETCH_BATCH_SIZE)):
+        yield batch
+
+
+"""
+Streams rows as newline-delimited JSON, optionally preceded by a header line.
+Rows are serialized and written in batches so memory use stays flat.
+"""
+def ndjson_response(rows, header=None):
+    def generate():
+        if header is not None:
+            yield flask.json.dumps(header) + "\n"
+        for batch in batches(rows):
+            yield "\n".join(flask.json.dumps(row) for row in batch) + "\n"
+    return stream_response(generate(), NDJSON_MIMETYPE)
+
+
+"""
+Streams rows (tuples) as CSV, preceded by a line with the column names, as a
+download named filename. Rows are written in batches so memory use stays flat.
+"""
+def csv_response(columns, rows, filename):
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for batch in batches(rows):
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    response = stream_response(generate(), "text/csv")
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+"""
+Returns the filter and sort specs (see database._compile_filters) given as
+JSON in ?filter= and ?sort=, or None for those not given.
+:raise ValueError: If either is not valid JSON.
+"""
+def query_spec():
+    args = flask.request.args
+    filters = args.get("filter")
+    sort = args.get("sort")
+    return (json.loads(filters) if filters is not None else None,
+            json.loads(sort) if sort is not None else None)
+
+
 @app.route('/api/get_all/<table>', methods=['GET'])
 def get_table(table):
-    data = []
-    try:
+    format = response_format()
+
+    def build():
+        if format == "columnar":
+            return flask.jsonify(database.get_all_columnar(DB_URL, table, include_rowid=True,
+                                                           filters=filters, sort=sort))
         columns = database.get_columns(DB_URL, table)
-        data = database.get_all(DB_URL, table)
         types = database.get_column_data_types(DB_URL, table)
+        if format == "ndjson":
+            rows = database.iter_all(DB_URL, table, include_rowid=True, filters=filters, sort=sort)
+            return ndjson_response(rows, {"columns": columns, "types": types})
+        data = database.get_all(DB_URL, table, include_rowid=True, filters=filters, sort=sort)
         return flask.jsonify({"columns": columns, "data": data, "types": types})
-    except database.InvalidTable as ex:
-        print(ex)
-        return flask.abort(400)
+
+    try:
+        filters, sort = query_spec()
+        database.check_table(DB_URL, table)
+        return conditional_response((database.data_version(DB_URL), format), build, vary="Accept")
+    except (database.DatabaseError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/get_page/<table>', methods=['GET'])
+def get_page(table):
+    try:
+        args = flask.request.args
+        limit = min(args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+        after = args.get("after")
+        if after is not None:
+            after = json.loads(after)
+            # One value per sort column; their number is checked by database.get_page.
+            if not isinstance(after, list) or \
+                    not all(value is None or isinstance(value, (str, int, float)) for value in after):
+                raise ValueError(f"Invalid page cursor {after}")
+        order_by = args.get("order_by")
+        descending = args.get("desc", 0, type=int) == 1
+        columnar = response_format() == "columnar"
+        filters, _ = query_spec()
+
+        def build():
+            data, next_cursor = database.get_page(DB_URL, table, limit, after, order_by, descending,
+                                                  include_rowid=True, columnar=columnar, filters=filters)
+            if columnar:
+                result = database.columnar_header(DB_URL, table, include_rowid=True)
+                result["rows"] = data
+                result["next"] = next_cursor
+                return flask.jsonify(result)
+            columns = database.get_columns(DB_URL, table)
+            types = database.get_column_data_types(DB_URL, table)
+            return flask.jsonify({"columns": columns, "data": data, "types": types, "next": next_cursor})
+
+        database.check_table(DB_URL, table)
+        return conditional_response((database.data_version(DB_URL), columnar), build, vary="Accept")
+    except (database.DatabaseError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/changes/<table>', methods=['GET'])
+def get_changes(table):
+    if not CHANGE_TRACKING_ENABLED:
+        flask.abort(403)
+    try:
+        since = flask.request.args.get("since", type=int)
+        return flask.jsonify(database.get_changes(DB_URL, table, since))
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/changes', methods=['DELETE'])
+@app.route('/api/changes/<table>', methods=['DELETE'])
+def drop_change_tracking(table=None):
+    if not CHANGE_TRACKING_ENABLED:
+        flask.abort(403)
+    try:
+        return flask.jsonify(database.drop_change_tracking(DB_URL, table))
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/search/<table>', methods=['GET'])
+def search(table):
+    if not SEARCH_ENABLED:
+        flask.abort(403)
+    try:
+        args = flask.request.args
+        limit = min(args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+        offset = args.get("offset", 0, type=int)
+        data, next_offset = database.search(DB_URL, table, args.get("q", ""), limit, offset)
+        columns = database.get_columns(DB_URL, table)
+        types = database.get_column_data_types(DB_URL, table)
+        return flask.jsonify({"columns": columns, "data": data, "types": types, "next": next_offset})
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/search/<table>', methods=['DELETE'])
+def drop_search_index(table):
+    if not SEARCH_ENABLED:
+        flask.abort(403)
+    try:
+        return flask.jsonify(database.drop_search_index(DB_URL, table))
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    try:
+        filters, sort = query_spec()
+        columns, rows = database.iter_rows(DB_URL, table, filters=filters, sort=sort)
+        return csv_response(columns, rows, f"{table}.csv".replace('"', ""))
+    except (database.DatabaseError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        return flask.abort(500)
+
+
+@app.route('/api/import/<table>', methods=['POST'])
+def import_table(table):
+    try:
+        # Either an uploaded form file or the request body itself, read as it arrives.
+        upload = flask.request.files.get("file")
+        stream = upload.stream if upload is not None else flask.request.stream
+        reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        columns = next(reader, None)
+        if columns is None:
+            raise database.BadFields("The CSV file is empty")
+        return flask.jsonify({"imported": database.import_rows(DB_URL, table, columns, reader)})
+    except (database.DatabaseError, csv.Error, UnicodeDecodeError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
         return flask.abort(500)
 
 
@@ -63,10 +500,9 @@ def update(table):
         database.update(DB_URL, table, values, identifiers)
         return flask.jsonify("Success")
     except database.DatabaseError as ex:
-        print(ex)
-        flask.abort(400)
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
         flask.abort(500)
 
 
@@ -77,10 +513,9 @@ def insert(table):
         database.insert(DB_URL, table, values)
         return flask.jsonify("Success")
     except database.DatabaseError as ex:
-        print(ex)
-        flask.abort(400)
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
         flask.abort(500)
 
 
@@ -91,10 +526,25 @@ def delete(table):
         database.delete(DB_URL, table, identifiers)
         return flask.jsonify("Success")
     except database.DatabaseError as ex:
-        print(ex)
-        flask.abort(400)
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/bulk/<table>', methods=['POST'])
+def bulk(table):
+    try:
+        data = flask.request.json
+        deletes = data.get("delete", [])
+        updates = [(update["values"], update["identifiers"]) for update in data.get("update", [])]
+        inserts = data.get("insert", [])
+        result = database.bulk_apply(DB_URL, table, deletes, updates, inserts)
+        return flask.jsonify(result)
+    except (database.DatabaseError, SQLiteError, KeyError, AttributeError, TypeError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
         flask.abort(500)
 
 
@@ -105,14 +555,161 @@ def join():
         prim_table = data["prim_table"]
         tables = data["tables"]
         identifiers = data["identifiers"]
-        result = database.join(DB_URL, prim_table, tables, identifiers)
+        filters = data.get("filters")
+        sort = data.get("sort")
+        format = response_format()
+        if format == "ndjson":
+            rows = database.iter_join(DB_URL, prim_table, tables, identifiers, filters=filters, sort=sort)
+            return ndjson_response(rows)
+        if format == "columnar":
+            args = flask.request.args
+            if "limit" in args:
+                limit = min(args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+                result = database.join_page(DB_URL, prim_table, tables, identifiers, args.get("offset", 0, type=int),
+                                            limit, filters, sort)
+            else:
+                result = database.join_columnar(DB_URL, prim_table, tables, identifiers, filters, sort)
+            if flask.request.args.get("explain", 0, type=int) == 1:
+                result = dict(result, plan=join_plan(prim_table, tables, identifiers, filters, sort))
+            return flask.jsonify(result)
+        result = database.join(DB_URL, prim_table, tables, identifiers, filters, sort)
         return flask.jsonify(result)
     except SQLiteError as ex:
-        print(ex)
-        flask.abort(400)
+        abort_client_error(ex)
     except database.DatabaseError as ex:
-        print(ex)
-        flask.abort(400)
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/export/join', methods=['POST'])
+def export_join():
+    try:
+        data = flask.request.json
+        columns, rows = database.iter_join_rows(DB_URL, data["prim_table"], data["tables"], data["identifiers"],
+                                                filters=data.get("filters"), sort=data.get("sort"))
+        return csv_response(columns, rows, "join.csv")
+    except (SQLiteError, database.DatabaseError, KeyError, TypeError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/jobs/join', methods=['POST'])
+def submit_join_job():
+    if not JOBS_ENABLED:
+        flask.abort(501)
+    try:
+        data = flask.request.json
+        job = jobs.submit_join(DB_URL, data["prim_table"], data["tables"], data["identifiers"],
+                               data.get("filters"), data.get("sort"))
+        response = flask.jsonify(job.describe())
+        response.status_code = 202
+        response.headers["Location"] = flask.url_for("get_job", job_id=job.id)
+        return response
+    except (SQLiteError, database.DatabaseError, KeyError, TypeError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        flask.abort(404)
+    return flask.jsonify(job.describe())
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def discard_job(job_id):
+    if not jobs.discard(job_id):
+        flask.abort(404)
+    return flask.jsonify("Success")
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        flask.abort(404)
+    return flask.jsonify(job.describe())
+
+
+@app.route('/api/jobs/<job_id>/rows', methods=['GET'])
+def get_job_rows(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        flask.abort(404)
+    offset = max(flask.request.args.get("offset", 0, type=int), 0)
+    limit = min(flask.request.args.get("limit", MAX_PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    return flask.jsonify(job.read(offset, limit))
+
+
+"""
+Returns the index advice for a join, along with whether the server allows
+the suggested indexes to be created.
+"""
+def join_plan(prim_table, tables, identifiers, filters=None, sort=None):
+    plan = database.explain_join(DB_URL, prim_table, tables, identifiers, filters, sort)
+    plan["can_create_indexes"] = ALLOW_INDEX_CREATION
+    return plan
+
+
+@app.route('/api/join/plan', methods=['POST'])
+def explain_join():
+    try:
+        data = flask.request.json
+        plan = join_plan(data["prim_table"], data["tables"], data["identifiers"], data.get("filters"),
+                         data.get("sort"))
+        return flask.jsonify(plan)
+    except (SQLiteError, database.DatabaseError, KeyError, TypeError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/join/suggest', methods=['GET'])
+def suggest_joins():
+    try:
+        args = flask.request.args
+        left = args.get("left", "")
+        right = args.get("right", "")
+        return flask.jsonify(database.suggest_joins(DB_URL, left, right))
+    except database.DatabaseError as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/join/estimate', methods=['POST'])
+def estimate_join():
+    try:
+        data = flask.request.json
+        rows = database.estimate_join(DB_URL, data["prim_table"], data["tables"], data["identifiers"])
+        return flask.jsonify({"estimated_rows": rows})
+    except (SQLiteError, database.DatabaseError, KeyError, TypeError, ValueError) as ex:
+        abort_client_error(ex)
+    except Exception as ex:
+        log_server_error(ex)
+        flask.abort(500)
+
+
+@app.route('/api/join/indexes', methods=['POST'])
+def create_join_indexes():
+    if not ALLOW_INDEX_CREATION:
+        flask.abort(403)
+    try:
+        data = flask.request.json
+        created = database.create_join_indexes(DB_URL, data["prim_table"], data["tables"], data["identifiers"])
+        return flask.jsonify(created)
+    except (SQLiteError, database.DatabaseError, KeyError, TypeError, ValueError) as ex:
+        abort_client_error(ex)
     except Exception as ex:
-        print(ex)
+        log_server_error(ex)
         flask.abort(500)
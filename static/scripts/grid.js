@@ -0,0 +1,353 @@
+// A virtualized grid. Only the rows in view, plus an overscan above and below,
+// are in the DOM, and their row elements are reused while scrolling. Rows are
+// fetched in blocks as they come into view, and blocks far out of view are
+// dropped again, so the page stays responsive and its memory bounded however
+// many rows there are.
+//
+// Rows are read with options.fetchRows(cursor, limit), which resolves to
+// {rows, next}: up to limit rows starting at cursor, and the cursor after
+// them (null after the last row). Cursors are either opaque, such as the
+// keyset cursors of /api/get_page, in which case blocks are discovered one
+// after the other as the user scrolls down, or row offsets (options.offsets),
+// in which case any block can be fetched directly and the number of rows is
+// set with setTotal.
+//
+// Other options:
+//   renderHeader(thead): fills the table header.
+//   renderRow(tableRow, row, index): fills an emptied row element.
+//   rowHeight: the height of a row in pixels until one has been measured.
+//   blockSize: the number of rows fetched at a time.
+//   overscan: the number of rows rendered above and below the visible ones.
+//   maxBlocks: the number of blocks kept in memory.
+function createGrid(container, options) {
+    const blockSize = options.blockSize || 200;
+    const overscan = options.overscan || 20;
+    const maxBlocks = options.maxBlocks || 20;
+    let rowHeight = options.rowHeight || 41;
+    let measured = false;
+
+    let table = $('<table/>', {class: "table grid-table"}).appendTo(container);
+    let head = $('<thead/>').appendTo(table);
+    let body = $('<tbody/>').appendTo(table);
+    let topSpacer = $('<tr/>', {class: "grid-spacer"}).append($('<td/>', {colspan: 1000})).appendTo(body);
+    let bottomSpacer = $('<tr/>', {class: "grid-spacer"}).append($('<td/>', {colspan: 1000})).appendTo(body);
+
+    // Each block has the cursor it starts at, its rows (null until fetched or
+    // once dropped), its number of rows and the cursor after it.
+    let blocks = [];
+    let starts = [];
+    let total = 0;
+    let generation = 0;
+    let rendered = new Map();
+    let frame = null;
+    // Shown in place of rows that are still being fetched.
+    const pending = {};
+
+    function blockCursor(index) {
+        if (options.offsets) {
+            return index * blockSize;
+        }
+        return blocks[index].cursor;
+    }
+
+    function rowCount() {
+        if (options.offsets) {
+            return total;
+        }
+        let count = 0;
+        for (const block of blocks) {
+            count += block.length === null ? 0 : block.length;
+        }
+        return count;
+    }
+
+    // Whether rows beyond those known so far may exist.
+    function hasMore() {
+        if (options.offsets) {
+            return false;
+        }
+        return blocks.length == 0 || blocks[blocks.length - 1].next !== null;
+    }
+
+    function computeStarts() {
+        starts = [];
+        let start = 0;
+        for (const block of blocks) {
+            starts.push(start);
+            start += block.length === null ? 0 : block.length;
+        }
+    }
+
+    // Returns [block index, position in block] of the row at index.
+    function locate(index) {
+        if (options.offsets) {
+            return [Math.floor(index / blockSize), index % blockSize];
+        }
+        let low = 0;
+        let high = starts.length - 1;
+        while (low < high) {
+            let middle = Math.ceil((low + high) / 2);
+            if (starts[middle] <= index) {
+                low = middle;
+            } else {
+                high = middle - 1;
+            }
+        }
+        return [low, index - starts[low]];
+    }
+
+    function expectedLength(index) {
+        if (options.offsets) {
+            return Math.min(blockSize, total - index * blockSize);
+        }
+        return blocks[index].length === null ? blockSize : blocks[index].length;
+    }
+
+    function fetchBlock(index) {
+        if (options.offsets && blocks[index] === undefined) {
+            blocks[index] = {cursor: index * blockSize, rows: null, length: null, next: null, loading: false};
+        }
+        let block = blocks[index];
+        if (block.rows !== null || block.loading) {
+            return;
+        }
+        block.loading = true;
+        let requested = generation;
+        options.fetchRows(blockCursor(index), expectedLength(index)).then((result) => {
+            if (requested != generation) {
+                return;
+            }
+            block.loading = false;
+            block.rows = result.rows;
+            block.length = result.rows.length;
+            block.next = result.next;
+            block.used = Date.now();
+            computeStarts();
+            dropBlocks(index);
+            scheduleRender();
+        }, (error) => {
+            // Left unfetched, so the block is requested again on the next render.
+            console.log(error);
+            block.loading = false;
+        });
+    }
+
+    // Finds the next block of rows once the end of those known comes into view.
+    function fetchMore() {
+        let last = blocks[blocks.length - 1];
+        if (last.rows === null || last.next === null) {
+            return;
+        }
+        blocks.push({cursor: last.next, rows: null, length: null, next: null, loading: false});
+        computeStarts();
+        fetchBlock(blocks.length - 1);
+    }
+
+    // Drops the rows of the blocks used longest ago, beyond maxBlocks.
+    function dropBlocks(keep) {
+        let loaded = blocks.filter((block) => block !== undefined && block.rows !== null);
+        loaded.sort((a, b) => a.used - b.used);
+        for (let i = 0; i < loaded.length - maxBlocks; i++) {
+            if (loaded[i] !== blocks[keep]) {
+                loaded[i].rows = null;
+            }
+        }
+    }
+
+    function rowAt(index) {
+        let [blockIndex, position] = locate(index);
+        let block = blocks[blockIndex];
+        if (block === undefined || block.rows === null || position >= block.rows.length) {
+            if (block === undefined || block.rows === null || options.offsets) {
+                fetchBlock(blockIndex);
+            }
+            return undefined;
+        }
+        block.used = Date.now();
+        return block.rows[position];
+    }
+
+    function scheduleRender() {
+        if (frame === null) {
+            frame = requestAnimationFrame(() => {
+                frame = null;
+                render();
+            });
+        }
+    }
+
+    function render() {
+        let count = rowCount();
+        let scrollTop = container.scrollTop();
+        let first = Math.max(0, Math.floor(scrollTop / rowHeight) - overscan);
+        let last = Math.min(count, Math.ceil((scrollTop + container.innerHeight()) / rowHeight) + overscan);
+        if (hasMore() && last >= count - overscan) {
+            fetchMore();
+        }
+
+        // Rows still in view keep their element; the others are reused.
+        let previous = rendered;
+        rendered = new Map();
+        let free = [];
+        for (const [index, tableRow] of previous) {
+            if (index < first || index >= last) {
+                free.push(tableRow);
+            } else {
+                rendered.set(index, tableRow);
+            }
+        }
+        for (let index = first; index < last; index++) {
+            let row = rowAt(index);
+            let tableRow = rendered.get(index);
+            if (tableRow === undefined) {
+                tableRow = free.length > 0 ? free.pop() : $('<tr/>');
+                rendered.set(index, tableRow);
+                tableRow.data("gridRow", null);
+            }
+            let shown = row === undefined ? pending : row;
+            if (tableRow.data("gridRow") !== shown || tableRow.data("gridIndex") !== index) {
+                tableRow.empty();
+                tableRow.data("gridRow", shown);
+                tableRow.data("gridIndex", index);
+                tableRow.toggleClass("grid-odd", index % 2 == 1);
+                if (row === undefined) {
+                    $('<td/>', {class: "text-muted"}).text("…").appendTo(tableRow);
+                } else {
+                    options.renderRow(tableRow, row, index);
+                }
+            }
+            tableRow.insertBefore(bottomSpacer);
+        }
+        for (const tableRow of free) {
+            tableRow.detach();
+        }
+
+        if (!measured && rendered.size > 0) {
+            let height = rendered.get(first)[0].offsetHeight;
+            if (height > 0 && rendered.get(first).data("gridRow") !== pending) {
+                measured = true;
+                if (height != rowHeight) {
+                    rowHeight = height;
+                    scheduleRender();
+                }
+            }
+        }
+        topSpacer.css("height", first * rowHeight);
+        bottomSpacer.css("height", (count - last) * rowHeight + (hasMore() ? rowHeight : 0));
+    }
+
+    container.scroll(scheduleRender);
+    $(window).resize(scheduleRender);
+
+    return {
+        // Forgets every row and starts over from the top, optionally with the
+        // first block already fetched as {rows, next}.
+        reset(firstCursor, firstBlock) {
+            generation++;
+            blocks = [];
+            total = 0;
+            for (const tableRow of rendered.values()) {
+                tableRow.remove();
+            }
+            rendered = new Map();
+            head.empty();
+            options.renderHeader(head);
+            container.scrollTop(0);
+            if (!options.offsets) {
+                blocks.push({cursor: firstCursor === undefined ? null : firstCursor, rows: null, length: null,
+                             next: null, loading: false});
+                if (firstBlock !== undefined) {
+                    Object.assign(blocks[0], {rows: firstBlock.rows, length: firstBlock.rows.length,
+                                              next: firstBlock.next, used: Date.now()});
+                } else {
+                    fetchBlock(0);
+                }
+            }
+            computeStarts();
+            scheduleRender();
+        },
+
+        // Sets the number of rows, for offset cursors. Blocks fetched while
+        // they were incomplete are fetched again.
+        setTotal(count) {
+            total = count;
+            for (let i = 0; i < blocks.length; i++) {
+                let block = blocks[i];
+                if (block !== undefined && block.rows !== null && block.rows.length < expectedLength(i)) {
+                    block.rows = null;
+                }
+            }
+            scheduleRender();
+        },
+
+        rowCount: rowCount,
+
+        // Whether every row has been found, for opaque cursors.
+        loadedAll() {
+            return !hasMore();
+        },
+
+        // Replaces the fetched rows whose key (as returned by keyOf) is in
+        // rows, a Map from keys to the new rows.
+        // Returns the Set of keys found.
+        updateRows(keyOf, rows) {
+            let found = new Set();
+            for (const block of blocks) {
+                if (block === undefined || block.rows === null) {
+                    continue;
+                }
+                block.rows = block.rows.map((row) => {
+                    const key = keyOf(row);
+                    if (!rows.has(key)) {
+                        return row;
+                    }
+                    found.add(key);
+                    return rows.get(key);
+                });
+            }
+            scheduleRender();
+            return found;
+        },
+
+        // Removes the rows whose key is in keys, a Set. Rows of dropped blocks
+        // cannot be found, so this returns false if there are any, and the
+        // grid should be reset instead.
+        removeRows(keyOf, keys) {
+            if (options.offsets || blocks.some((block) => block.rows === null && block.length !== null)) {
+                return false;
+            }
+            for (const block of blocks) {
+                if (block.rows !== null) {
+                    block.rows = block.rows.filter((row) => !keys.has(keyOf(row)));
+                    block.length = block.rows.length;
+                }
+            }
+            computeStarts();
+            scheduleRender();
+            return true;
+        },
+
+        // Adds rows after the last one, once every row has been found.
+        // Returns false if that is not the case yet; the rows will then be
+        // fetched with the block they belong to.
+        appendRows(rows) {
+            let last = blocks[blocks.length - 1];
+            if (options.offsets || hasMore() || last.rows === null) {
+                return false;
+            }
+            last.rows = last.rows.concat(rows);
+            last.length = last.rows.length;
+            computeStarts();
+            scheduleRender();
+            return true;
+        },
+
+        // Renders the rows in view again, for changes made outside the grid.
+        refresh() {
+            for (const tableRow of rendered.values()) {
+                tableRow.data("gridRow", null);
+            }
+            scheduleRender();
+        }
+    };
+}
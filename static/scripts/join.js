@@ -80,31 +80,157 @@ async function joinSetup() {
             identifiers.push([[table1, col1, table2, col2]]);
         }
 
-        let requestData = {
-            type: 'POST',
-            url: "/api/join",
-            data: JSON.stringify({"prim_table": prim_table, "tables": tables, "identifiers": identifiers}),
-            contentType: 'application/json',
-            success: function (data) {
-                console.log("Successfully received data");
-                makeTable(data);
-                return;
-            },
-            error: function (response) {
-                console.log("Request failed");
-                $("#rightCol").empty();
-                let text = "Server Error";
-                if (response.status == 400) {
-                    text = "Invalid Query";
-                }
-                $("<h2/>", {class: "text-danger"}).text(text).appendTo($("#rightCol"));
-                return;
+        let spec = JSON.stringify({"prim_table": prim_table, "tables": tables, "identifiers": identifiers});
+        confirmJoin(spec).then((confirmed) => {
+            if (confirmed) {
+                runJoin(spec, joinButton);
             }
-        };
-        $.ajax(requestData);
+        });
     })
 }
 
+// Joins estimated to return more rows than this are only run once confirmed.
+const largeJoinRows = 1000000;
+
+async function confirmJoin(spec) {
+    let response = await fetch("/api/join/estimate", {method: "POST", headers: {"Content-Type": "application/json"}, body: spec});
+    if (!response.ok) {
+        // The join itself reports what is wrong with it.
+        return true;
+    }
+    let estimate = (await response.json())["estimated_rows"];
+    if (estimate <= largeJoinRows) {
+        return true;
+    }
+    return confirm("This join is estimated to return about " + estimate.toLocaleString() + " rows. Run it anyway?");
+}
+
+// The join job currently shown, which is cancelled if another join starts.
+let currentJob = null;
+
+async function runJoin(spec, joinButton) {
+    if (currentJob !== null) {
+        cancelJob(currentJob);
+    }
+    let response = await fetch("/api/jobs/join", {method: "POST", headers: {"Content-Type": "application/json"}, body: spec});
+    if (response.status == 501) {
+        // Jobs are not available when the server runs several processes.
+        runJoinNow(spec, joinButton);
+        return;
+    }
+    if (!response.ok) {
+        showJoinError(response.status);
+        return;
+    }
+    let job = await response.json();
+    currentJob = job.id;
+
+    $('#rightCol').empty();
+    let title = $('<h2/>').text("Running...").appendTo($('#rightCol'));
+    let cancelButton = $('<button/>', {class: "btn btn-sm btn-secondary mb-2"}).text("Cancel").appendTo($('#rightCol'));
+    cancelButton.click(() => cancelJob(job.id));
+
+    $.ajax({
+        type: 'POST',
+        url: "/api/join/plan",
+        data: spec,
+        contentType: 'application/json',
+        success: function (plan) {
+            if (currentJob == job.id) {
+                showPlan(plan, spec, joinButton);
+            }
+        }
+    });
+
+    // The grid reads the rows the job has produced so far as they scroll into
+    // view, so results show up early and only those on screen are loaded.
+    response = await fetch("/api/jobs/" + job.id + "/rows?offset=0&limit=0");
+    if (!response.ok) {
+        showJoinError(response.status);
+        return;
+    }
+    let grid = makeGrid(await response.json(), async (offset, limit) => {
+        let rowsResponse = await fetch("/api/jobs/" + job.id + "/rows?offset=" + offset + "&limit=" + limit);
+        if (!rowsResponse.ok) {
+            throw new Error("Request failed");
+        }
+        return {rows: (await rowsResponse.json())["rows"], next: null};
+    });
+    while (currentJob == job.id) {
+        response = await fetch("/api/jobs/" + job.id);
+        if (!response.ok) {
+            showJoinError(response.status);
+            return;
+        }
+        let status = await response.json();
+        if (currentJob != job.id) {
+            return;
+        }
+        grid.setTotal(status["rows"]);
+        if (status["status"] != "queued" && status["status"] != "running") {
+            cancelButton.remove();
+            if (status["status"] == "done") {
+                title.text("Num Results: " + status["rows"]);
+            } else if (status["status"] == "cancelled") {
+                title.text("Cancelled after " + status["rows"] + " results");
+            } else {
+                title.text("Query failed: " + status["error"]).addClass("text-danger");
+            }
+            currentJob = null;
+            return;
+        }
+        title.text("Running... " + status["rows"] + " results so far");
+        await new Promise((resolve) => setTimeout(resolve, 250));
+    }
+}
+
+// Runs a join without a job, reading its rows a range at a time as they
+// scroll into view, so the whole result is never held by the page.
+function runJoinNow(spec, joinButton) {
+    const fetchRows = async (offset, limit) => {
+        let response = await fetch("/api/join?format=columnar&offset=" + offset + "&limit=" + limit,
+                                   {method: "POST", headers: {"Content-Type": "application/json"}, body: spec});
+        if (!response.ok) {
+            throw new Error("Request failed");
+        }
+        let data = await response.json();
+        return {rows: data["rows"], next: data["next"]};
+    };
+    $.ajax({
+        type: 'POST',
+        url: "/api/join?format=columnar&explain=1&offset=0&limit=" + joinBlockSize,
+        data: spec,
+        contentType: 'application/json',
+        success: function (data) {
+            $('#rightCol').empty();
+            // The number of results is only known once the last range is read.
+            let count = data["rows"].length + (data["next"] !== null ? "+" : "");
+            $('<h2/>').text("Num Results: " + count).appendTo($('#rightCol'));
+            if (data["rows"].length > 0) {
+                makeGrid(data, fetchRows, {rows: data["rows"], next: data["next"]});
+            }
+            showPlan(data["plan"], spec, joinButton);
+        },
+        error: function (response) {
+            showJoinError(response.status);
+        }
+    });
+}
+
+function cancelJob(jobId) {
+    currentJob = null;
+    $.ajax({type: 'DELETE', url: "/api/jobs/" + jobId});
+}
+
+function showJoinError(status) {
+    $("#rightCol").empty();
+    let text = "Server Error";
+    if (status == 400) {
+        text = "Invalid Query";
+    }
+    $("<h2/>", {class: "text-danger"}).text(text).appendTo($("#rightCol"));
+}
+
 function getJoinForm(index, columns) {
     let item = $("<div/>", {id: "secondaryDiv" + index});
     $("<h4/>").text("Join").appendTo(item);
@@ -122,6 +248,9 @@ function getJoinForm(index, columns) {
     let table2 = $('<select/>', {id: "table2" + index, class: "form-select", "aria-label": "Select a Table"}).appendTo(selectorsDiv2);
     selectorsDiv2.append($("<p/>").text("."));
     let col2 = $('<select/>', {id: "col2" + index, class: "form-select", "aria-label": "Select a Table"}).appendTo(selectorsDiv2);
+    let suggestButton = $('<button/>', {class: "btn btn-sm btn-outline-secondary"}).text("Suggest Columns").appendTo(item);
+    let suggestion = $('<div/>', {class: "small text-muted"}).appendTo(item);
+    suggestButton.click(() => suggestColumns(table1.val(), col1, table2.val(), col2, suggestion));
 
     for (let col of columns[tables[0]]) {
         $('<option/>', {value: col}).text(col).appendTo(col1);
@@ -155,32 +284,85 @@ function getJoinForm(index, columns) {
     return item;
 }
 
-function makeTable(data) {
-    $('#rightCol').empty();
-    $('<h2/>').text("Num Results: " + data.length).appendTo($('#rightCol'));
-    if (data.length == 0) {
+// Selects the columns of table1 and table2 that look most like a join key,
+// judging by the values they share.
+async function suggestColumns(table1, col1, table2, col2, suggestion) {
+    suggestion.text("Profiling...");
+    let params = new URLSearchParams({left: table1, right: table2});
+    let response = await fetch("/api/join/suggest?" + params);
+    if (!response.ok) {
+        suggestion.text("No suggestion");
         return;
     }
-
-    let tableContainer = $('<div/>', {class: "flex-grow-1 d-flex overflow-auto border border-primary rounded-3"}).appendTo($('#rightCol'))
-
-    let table = $('<table/>', {class: "table table-striped"}).appendTo(tableContainer);
-    let head = $('<thead/>').appendTo(table);
-    head = $('<tr/>').appendTo(head);
-
-    columns = Object.keys(data[0]);
-
-    for (const col of columns) {
-        $('<th/>').text(col).appendTo(head);
+    let suggestions = await response.json();
+    if (suggestions.length == 0) {
+        suggestion.text("No columns share values");
+        return;
     }
+    col1.val(suggestions[0]["left"]);
+    col2.val(suggestions[0]["right"]);
+    suggestion.text(Math.round(suggestions[0]["containment"] * 100) + "% of values match, about "
+                    + suggestions[0]["estimated_rows"].toLocaleString() + " rows");
+}
 
-    let body = $('<tbody/>').appendTo(table);
-
-    for (const row of data) {
-        let tableRow = $('<tr />').appendTo(body);
+function showPlan(plan, spec, joinButton) {
+    if (plan.missing_indexes.length == 0) {
+        return;
+    }
+    let advice = $('<div/>', {class: "alert alert-warning"}).insertAfter($('#rightCol h2').first());
+    advice.append($('<div/>').text("This join scans tables without a usable index:"));
+    let list = $('<ul/>', {class: "mb-1"}).appendTo(advice);
+    for (const index of plan.missing_indexes) {
+        $('<li/>').text(index.table + " (" + index.columns.join(", ") + ")").appendTo(list);
+    }
+    if (!plan.can_create_indexes) {
+        return;
+    }
+    let createButton = $('<button/>', {class: "btn btn-sm btn-warning"}).text("Create Indexes").appendTo(advice);
+    createButton.click(() => {
+        createButton.prop("disabled", true);
+        $.ajax({
+            type: 'POST',
+            url: "/api/join/indexes",
+            data: spec,
+            contentType: 'application/json',
+            success: function () {
+                joinButton.click();
+            },
+            error: function () {
+                alert("Failed to create indexes");
+                createButton.prop("disabled", false);
+            }
+        });
+    });
+}
 
-        for (const col of columns) {
-            $('<th/>').text(row[col]).appendTo(tableRow);
+// The number of join rows read at a time.
+const joinBlockSize = 500;
+
+// Shows join results in a grid reading rows by offset with fetchRows (see
+// createGrid). Without firstBlock, the number of rows is set with setTotal;
+// with it, the grid starts with those rows and finds the others through the
+// next offset returned with each range.
+function makeGrid(data, fetchRows, firstBlock) {
+    let tableContainer = $('<div/>', {class: "flex-grow-1 overflow-auto border border-primary rounded-3"}).appendTo($('#rightCol'))
+
+    let grid = createGrid(tableContainer, {
+        offsets: firstBlock === undefined,
+        blockSize: joinBlockSize,
+        fetchRows: fetchRows,
+        renderHeader: (thead) => {
+            let head = $('<tr/>').appendTo(thead);
+            for (const col of data["columns"]) {
+                $('<th/>').text(col).appendTo(head);
+            }
+        },
+        renderRow: (tableRow, row) => {
+            for (const value of row) {
+                $('<th/>').text(value).appendTo(tableRow);
+            }
         }
-    }
+    });
+    grid.reset(0, firstBlock);
+    return grid;
 }
@@ -4,8 +4,53 @@ function mainSetup() {
 
     $('#bodyDiv').empty();
     $('<h2/>').text("Tables:").appendTo('#bodyDiv');
-    var list = $('<ul/>').appendTo($('#bodyDiv'));
+    let statsTable = $('<table/>', {class: "table table-striped w-auto"}).appendTo($('#bodyDiv'));
+    let head = $('<tr/>').appendTo($('<thead/>').appendTo(statsTable));
+    for (const label of ["Table", "Rows", "Size", "Indexes"]) {
+        $('<th/>').text(label).appendTo(head);
+    }
+    let body = $('<tbody/>').appendTo(statsTable);
+    let cells = {};
     for (const table of tables) {
-        list.append($("<li/>").append($('<a/>', {href: "/tables/" + table}).text(table)));
+        let row = $('<tr/>').appendTo(body);
+        row.append($('<td/>').append($('<a/>', {href: "/tables/" + table}).text(table)));
+        cells[table] = [$('<td/>').appendTo(row), $('<td/>').appendTo(row), $('<td/>').appendTo(row)];
+    }
+    loadStats(cells);
+}
+
+// Fills in the row count, size and indexes of every table. Estimated counts
+// are shown first and replaced by exact ones once they are known.
+async function loadStats(cells) {
+    for (const exact of [0, 1]) {
+        var request = await fetch("/api/stats?exact=" + exact);
+        if (!request.ok) {
+            return;
+        }
+        const stats = await request.json();
+        let estimated = false;
+        for (const table of stats["tables"]) {
+            let tableCells = cells[table["name"]];
+            if (tableCells === undefined) {
+                continue;
+            }
+            estimated = estimated || table["rows_estimated"];
+            tableCells[0].text((table["rows_estimated"] ? "~" : "") + table["rows"].toLocaleString());
+            tableCells[1].text(table["bytes"] === null ? "" : formatBytes(table["bytes"] + table["index_bytes"]));
+            tableCells[2].text(table["indexes"].map((index) => index["name"] + " (" + index["columns"].join(", ") + ")").join(", "));
+        }
+        if (!estimated) {
+            return;
+        }
+    }
+}
+
+function formatBytes(bytes) {
+    const units = ["B", "KB", "MB", "GB", "TB"];
+    let unit = 0;
+    while (bytes >= 1024 && unit < units.length - 1) {
+        bytes /= 1024;
+        unit++;
     }
-}
\ No newline at end of file
+    return (unit == 0 ? bytes : bytes.toFixed(1)) + " " + units[unit];
+}
@@ -1,3 +1,6 @@
+pageSize = 200;
+pageState = null;
+
 async function tableSetup() {
     document.title = siteTitle + " - " + activeTable;
     history.pushState(null, null, "/tables/" + activeTable);
@@ -5,43 +8,270 @@ async function tableSetup() {
     $('#bodyDiv').empty();
     $('<h2/>').text("Table: " + activeTable).appendTo($('#bodyDiv'));
 
-    var request = await fetch("/api/get_all/" + activeTable);
-    const response = await request.json();
+    let searchInput = $('<input/>', {type: "search", class: "form-control mb-2", placeholder: "Search text columns"})
+        .appendTo($('#bodyDiv'));
+    searchInput.change(() => searchFor(searchInput.val().trim()));
 
-    let columns = response["columns"];
-    let data = response["data"];
-    let types = response["types"];
+    let tableContainer = $('<div/>', {class: "flex-grow-1 overflow-auto border border-primary rounded-3"}).appendTo($('#bodyDiv'))
 
-    let tableContainer = $('<div/>', {class: "flex-grow-1 d-flex overflow-auto border border-primary rounded-3"}).appendTo($('#bodyDiv'))
+    pageState = {columns: [], types: {}, orderBy: null, desc: false, version: null, filters: {}, search: "",
+                 editing: null, grid: null};
+    // Only the rows in view are rendered; pages are fetched as they scroll into view.
+    pageState.grid = createGrid(tableContainer, {
+        blockSize: pageSize,
+        fetchRows: async (cursor, limit) => {
+            const response = await fetchPage(cursor, limit);
+            return {rows: response["data"], next: response["next"]};
+        },
+        renderHeader: fillHeader,
+        renderRow: (tableRow, row) => {
+            if (pageState.editing !== null && pageState.editing == row["_rowid_"]) {
+                editRow(pageState.columns, pageState.types, tableRow, row);
+            } else {
+                makeRow(pageState.columns, pageState.types, tableRow, row);
+            }
+        }
+    });
+    $('<table/>', {class: "table mb-0"}).append($('<tbody/>', {id: "insertBody"})).appendTo($('#bodyDiv'));
+    await reloadTable();
 
-    $('<table/>', {id: "mainTable", class: "table table-striped"}).appendTo(tableContainer);
-    fillTable(columns, types, data);
+    let buttons = $('<div/>', {class: "d-flex gap-2"}).appendTo($('#bodyDiv'));
+    let addButton = $('<button/>', {id: "addButton", class: "btn btn-success"}).text("Insert Row").appendTo(buttons);
 
-    let addButton = $('<button/>', {id: "addButton", class: "btn btn-success"}).text("Insert Row").appendTo($('#bodyDiv'));
+    $('<button/>', {class: "btn btn-secondary"}).text("Export CSV").click(exportTable).appendTo(buttons);
+    let importInput = $('<input/>', {type: "file", accept: ".csv,text/csv", class: "d-none"}).appendTo(buttons);
+    importInput.change(async () => {
+        await importTable(importInput.prop("files")[0]);
+        importInput.val("");
+    });
+    $('<button/>', {class: "btn btn-secondary"}).text("Import CSV").click(() => importInput.click()).appendTo(buttons);
 
     addButton.click(() => {
-        insertRow(columns, types);
-        tableContainer.scrollTop(tableContainer.prop("scrollHeight"));
+        insertRow(pageState.columns, pageState.types);
         addButton.hide();
     })
 }
 
-function fillTable(columns, types, data) {
-    $('#mainTable').empty();
-    let head = $('<thead/>').appendTo($('#mainTable'));
-    head = $('<tr/>').appendTo(head);
+async function fetchPage(after, limit = pageSize) {
+    if (pageState.search != "") {
+        return fetchSearchPage(after, limit);
+    }
+    let params = new URLSearchParams({limit: limit, format: "columnar"});
+    if (after !== null) {
+        params.set("after", JSON.stringify(after));
+    }
+    if (pageState.orderBy !== null) {
+        params.set("order_by", pageState.orderBy);
+        params.set("desc", pageState.desc ? 1 : 0);
+    }
+    let filters = filterSpec();
+    if (filters.length > 0) {
+        params.set("filter", JSON.stringify(filters));
+    }
+    var request = await fetch("/api/get_page/" + activeTable + "?" + params);
+    if (!request.ok) {
+        throw new Error("Loading rows failed with status " + request.status);
+    }
+    return fromColumnar(await request.json());
+}
+
+// Fetches a page of the rows matching pageState.search, best matches first.
+// Its cursor is the offset of the page.
+async function fetchSearchPage(after, limit) {
+    let params = new URLSearchParams({q: pageState.search, limit: limit, offset: after === null ? 0 : after});
+    var request = await fetch("/api/search/" + activeTable + "?" + params);
+    if (request.status == 403) {
+        alert("Search is not enabled on this server.");
+        pageState.search = "";
+        return fetchPage(null, limit);
+    }
+    if (!request.ok) {
+        throw new Error("Searching failed with status " + request.status);
+    }
+    return await request.json();
+}
+
+async function searchFor(text) {
+    if (pageState.search != text) {
+        pageState.search = text;
+        await reloadTable();
+    }
+}
+
+// Converts a columnar response (qualified column names, rows as arrays) to
+// the plain column names, types and row objects used to render the table.
+function fromColumnar(response) {
+    let prefix = activeTable + ".";
+    let names = response["columns"].map((col) => col.substring(prefix.length));
+    let columns = [];
+    let types = {};
+    names.forEach((name, i) => {
+        if (name != "_rowid_") {
+            columns.push(name);
+            types[name] = response["types"][i];
+        }
+    });
+    let data = response["rows"].map((values) => {
+        let row = {};
+        names.forEach((name, i) => {
+            row[name] = values[i];
+        });
+        return row;
+    });
+    return {columns: columns, types: types, data: data, next: response["next"]};
+}
+
+// Whether the server tracks changes (see --track-changes). Without it, the
+// table is reloaded after every edit.
+let changeTracking = true;
+
+async function fetchChanges(since) {
+    if (!changeTracking) {
+        return {version: null, reset: true};
+    }
+    let params = new URLSearchParams();
+    if (since !== null) {
+        params.set("since", since);
+    }
+    var request = await fetch("/api/changes/" + activeTable + "?" + params);
+    if (request.status == 403) {
+        changeTracking = false;
+    }
+    if (!request.ok) {
+        return {version: null, reset: true};
+    }
+    return await request.json();
+}
+
+async function reloadTable() {
+    // Read the version first, so changes made while the page loads are synced too.
+    const changes = await fetchChanges(null);
+    pageState.version = changes["version"];
+    let response;
+    try {
+        response = await fetchPage(null);
+    } catch (error) {
+        console.log(error);
+        alert(error.message);
+        return;
+    }
+    pageState.columns = response["columns"];
+    pageState.types = response["types"];
+    pageState.editing = null;
+    pageState.grid.reset(null, {rows: response["data"], next: response["next"]});
+}
+
+// Applies the rows inserted, updated or deleted since the table was loaded
+// (or last synced) to the rows held by the grid, instead of reloading the
+// table. New rows are only appended once every page is loaded; until then
+// they arrive with the page they belong to. The table is reloaded if the
+// grid has dropped pages the changes may concern.
+async function syncChanges() {
+    // Changed rows may no longer match the filters or search, so the server decides.
+    if (pageState.version === null || filterSpec().length > 0 || pageState.search != "") {
+        await reloadTable();
+        return;
+    }
+    const changes = await fetchChanges(pageState.version);
+    if (changes["reset"]) {
+        await reloadTable();
+        return;
+    }
+    pageState.version = changes["version"];
+
+    const grid = pageState.grid;
+    const keyOf = (row) => row["_rowid_"];
+    if (changes["deleted"].length > 0 && !grid.removeRows(keyOf, new Set(changes["deleted"]))) {
+        await reloadTable();
+        return;
+    }
+    const found = grid.updateRows(keyOf, new Map(changes["rows"].map((row) => [keyOf(row), row])));
+    const added = changes["rows"].filter((row) => !found.has(keyOf(row)));
+    if (added.length > 0 && grid.loadedAll() && !grid.appendRows(added)) {
+        await reloadTable();
+    }
+}
+
+// Downloads the rows matching the current filters as CSV.
+function exportTable() {
+    let params = new URLSearchParams();
+    let filters = filterSpec();
+    if (filters.length > 0) {
+        params.set("filter", JSON.stringify(filters));
+    }
+    window.location = "/api/export/" + activeTable + "?" + params;
+}
+
+// Appends the rows of a CSV file, whose first line names the columns, to the table.
+async function importTable(file) {
+    let form = new FormData();
+    form.append("file", file);
+    var request = await fetch("/api/import/" + activeTable, {method: "POST", body: form});
+    if (!request.ok) {
+        alert("Import failed");
+        return;
+    }
+    const response = await request.json();
+    alert("Imported " + response["imported"] + " rows");
+    await reloadTable();
+}
+
+function sortBy(col) {
+    if (pageState.orderBy == col) {
+        pageState.desc = !pageState.desc;
+    } else {
+        pageState.orderBy = col;
+        pageState.desc = false;
+    }
+    reloadTable();
+}
+
+// Builds the filter spec sent to the server from the filter inputs: numeric
+// columns must equal the number typed in, other columns start with the text.
+function filterSpec() {
+    let filters = [];
+    for (const [col, text] of Object.entries(pageState.filters)) {
+        if (text == '') {
+            continue;
+        }
+        let type = pageState.types[col];
+        if (type == "INTEGER" || type == "REAL") {
+            let value = type == "INTEGER" ? parseInt(text) : parseFloat(text);
+            if (!isNaN(value)) {
+                filters.push({column: col, op: "=", value: value});
+            }
+        } else {
+            filters.push({column: col, op: "prefix", value: text});
+        }
+    }
+    return filters;
+}
+
+function filterBy(col, text) {
+    pageState.filters[col] = text;
+    reloadTable();
+}
+
+function fillHeader(thead) {
+    let columns = pageState.columns;
+    let head = $('<tr/>').appendTo(thead);
 
     $('<th/>').text("Modify").appendTo(head);
 
     for (const col of columns) {
-        $('<th/>').text(col).appendTo(head);
+        let label = col;
+        if (pageState.orderBy == col) {
+            label += pageState.desc ? " \u25BC" : " \u25B2";
+        }
+        $('<th/>', {role: "button"}).text(label).click(() => sortBy(col)).appendTo(head);
     }
 
-    let body = $('<tbody/>', {id: "tableBody"}).appendTo($('#mainTable'));
-
-    for (const row of data) {
-        let tableRow = $('<tr />').appendTo(body);
-        makeRow(columns, types, tableRow, row);        
+    let filterRow = $('<tr/>').appendTo(thead);
+    $('<th/>').text("Filter").appendTo(filterRow);
+    for (const col of columns) {
+        let cell = $('<th/>').appendTo(filterRow);
+        $('<input/>', {type: "text", class: "form-control form-control-sm", value: pageState.filters[col] || ""})
+            .change((event) => filterBy(col, event.target.value)).appendTo(cell);
     }
 }
 
@@ -56,6 +286,8 @@ function makeRow(columns, types, tableRow, row) {
     }
 
     editButton.click(() => {
+        pageState.editing = row["_rowid_"];
+        tableRow.empty();
         editRow(columns, types, tableRow, row);
     })
 
@@ -69,12 +301,7 @@ function makeRow(columns, types, tableRow, row) {
             contentType: 'application/json',
             success: async function () {
                 console.log("Successfully received data");
-                var request = await fetch("/api/get_all/" + activeTable);
-                const response = await request.json();
-
-                let newColumns = response["columns"];
-                let newData = response["data"];
-                fillTable(newColumns, types, newData);
+                await syncChanges();
                 $('#addButton').show();
                 return;
             },
@@ -89,7 +316,7 @@ function makeRow(columns, types, tableRow, row) {
 }
 
 function insertRow(columns, types) {
-    let tableRow = $('<tr/>').appendTo($('#tableBody'));
+    let tableRow = $('<tr/>', {id: "insertRow"}).appendTo($('#insertBody'));
     let buttonsCell = $('<th/>').appendTo(tableRow);
     let buttonsDiv = $('<div/>', {class: "d-flex"}).appendTo(buttonsCell);
     let submitButton = $('<button/>', {class: "btn btn-circle-sm btn-primary"}).text("Save").appendTo(buttonsDiv);
@@ -128,6 +355,7 @@ function editRow(columns, types, tableRow, row) {
     })
 
     cancelButton.click(() => {
+        pageState.editing = null;
         tableRow.empty();
         makeRow(columns, types, tableRow, row);
     });
@@ -173,13 +401,13 @@ function submitRow(columns, types, row, action) {
         contentType: 'application/json',
         success: async function () {
             console.log("Successfully received data");
-            var request = await fetch("/api/get_all/" + activeTable);
-            const response = await request.json();
-
-            let newColumns = response["columns"];
-            let newData = response["data"];
+            $('#insertRow').remove();
             $('#addButton').show();
-            fillTable(newColumns, types, newData);
+            if (action == "update") {
+                pageState.editing = null;
+                pageState.grid.refresh();
+            }
+            await syncChanges();
             return;
         },
         error: function () {
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+
+import bench
+
+import pytest
+
+
+BENCH_DB = "example_dbs/bench_test.sqlite"
+
+
+class TestBench:
+    @pytest.fixture
+    def setup(self):
+        yield
+        if os.path.exists(BENCH_DB):
+            os.remove(BENCH_DB)
+
+    def test_generate(self, setup):
+        bench.generate(BENCH_DB, 1494, seed=1)
+        with sqlite3.connect(BENCH_DB) as conn:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ['classes', 'courses', 'crosslistings', 'coursesprofs', 'profs']}
+            first = conn.execute("SELECT * FROM courses LIMIT 1").fetchone()
+        assert counts == {'classes': 1494, 'courses': 1158, 'crosslistings': 1491,
+                          'coursesprofs': 1241, 'profs': 863}
+
+        bench.generate(BENCH_DB, 1494, seed=1)
+        with sqlite3.connect(BENCH_DB) as conn:
+            assert conn.execute("SELECT * FROM courses LIMIT 1").fetchone() == first
+
+    def test_copy_database(self, setup):
+        bench.copy_database("example_dbs/reg.sqlite", BENCH_DB)
+        with sqlite3.connect(BENCH_DB) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM classes").fetchone()[0] == 1494
+
+    def test_compare(self):
+        baseline = {
+            'join': {'p50_ms': 100.0, 'rows_per_sec': 1000.0},
+            'get_page': {'p50_ms': 0.5, 'rows_per_sec': 400000.0}
+        }
+        results = {
+            'join': {'p50_ms': 150.0, 'rows_per_sec': 700.0},
+            'get_page': {'p50_ms': 0.9, 'rows_per_sec': 220000.0}
+        }
+        regressions = bench.compare(results, baseline, 0.2)
+        assert [(r['benchmark'], r['metric']) for r in regressions] == [('join', 'p50_ms'), ('join', 'rows_per_sec')]
+        assert bench.compare(results, baseline, 0.6) == []
@@ -1,5 +1,8 @@
 import os
 import shutil
+import sqlite3
+import threading
+import time
 
 import database
 
@@ -43,6 +46,25 @@ class TestDatabase:
         for key, val in ref.items():
             assert types[key] == val
 
+    def test_schema_cache(self, setup):
+        schema = database.get_schema(TEST_DB2)
+        assert database.get_schema(TEST_DB2) is schema
+        assert schema['classes']['columns'][0] == 'classid'
+
+        with sqlite3.connect(TEST_DB2) as conn:
+            conn.execute("CREATE TABLE extra (id INTEGER, name TEXT)")
+        assert 'extra' in database.get_table_names(TEST_DB2)
+        assert database.get_columns(TEST_DB2, 'extra') == ['id', 'name']
+
+    def test_connection_pool(self):
+        with database.get_connection(TEST_DB) as conn:
+            synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+            temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+        assert synchronous == 1
+        assert temp_store == 2
+        with database.get_connection(TEST_DB) as conn2:
+            assert conn2 is conn
+
     def test_get_all(self):
         rows = database.get_all(TEST_DB, "classes")
         ref_len = 1494
@@ -59,6 +81,222 @@ class TestDatabase:
         for key, val in rows[0].items():
             assert ref_row[key] == val
 
+    def test_get_page(self):
+        rows = database.get_all(TEST_DB, "classes")
+        pages = []
+        after = None
+        while True:
+            page, after = database.get_page(TEST_DB, "classes", 500, after)
+            pages += page
+            if after is None:
+                break
+        assert pages == rows
+
+        page, after = database.get_page(TEST_DB, "classes", 10, order_by="bldg", descending=True)
+        ref = sorted((row['bldg'] for row in rows), reverse=True)
+        assert [row['bldg'] for row in page] == ref[:10]
+        page, _ = database.get_page(TEST_DB, "classes", 10, after, order_by="bldg", descending=True)
+        assert [row['bldg'] for row in page] == ref[10:20]
+
+    def test_page_order(self, setup):
+        with sqlite3.connect(TEST_DB2) as conn:
+            conn.execute("UPDATE classes SET courseid = NULL WHERE rowid % 7 = 0")
+        rows = database.get_all(TEST_DB2, "classes", include_rowid=True)
+        for descending in (False, True):
+            # NULLs sort first, so they come last in descending order.
+            ref = sorted(rows, key=lambda row: (row['courseid'] is not None, row['courseid'] or 0, row['_rowid_']),
+                         reverse=descending)
+            pages = []
+            after = None
+            while True:
+                page, after = database.get_page(TEST_DB2, "classes", 97, after, order_by="courseid",
+                                                descending=descending, include_rowid=True)
+                pages += page
+                if after is None:
+                    break
+            assert pages == ref
+
+        schema = database.get_schema(TEST_DB2)
+        columns = database._result_columns(schema, "classes", False)
+        with database.get_connection(TEST_DB2) as conn:
+            for descending in (False, True):
+                sql_query, parameters = database._page_queries(schema, "classes", columns, ["courseid", "rowid"],
+                                                               [9000, 100], descending, True, None)[0]
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}", parameters + [10]).fetchall()
+                assert plan[0][3].startswith("SEARCH classes USING INDEX classes_courseid_index")
+
+    def test_columnar(self):
+        rows = database.get_all(TEST_DB, "classes", include_rowid=True)
+        result = database.get_all_columnar(TEST_DB, "classes", include_rowid=True)
+        assert result["columns"][:2] == ['classes._rowid_', 'classes.classid']
+        assert result["types"][:3] == ['INTEGER', 'INTEGER', 'INTEGER']
+        assert [list(row.values()) for row in rows] == [list(row) for row in result["rows"]]
+
+        page, _ = database.get_page(TEST_DB, "classes", 5, order_by="days", include_rowid=True, columnar=True)
+        ref, _ = database.get_page(TEST_DB, "classes", 5, order_by="days", include_rowid=True)
+        assert [list(row.values()) for row in ref] == [list(row) for row in page]
+
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')]]
+        joined = database.join_columnar(TEST_DB, 'courses', ['crosslistings'], identifiers)
+        assert 'crosslistings.courseid' in joined["columns"]
+        assert len(joined["rows"]) == len(database.join(TEST_DB, 'courses', ['crosslistings'], identifiers))
+
+    def test_filters(self):
+        filters = [{"column": "bldg", "op": "prefix", "value": "BEND"},
+                   {"column": "classid", "op": ">=", "value": 0}]
+        rows = database.get_all(TEST_DB, "classes", filters=filters,
+                                sort=[{"column": "bldg", "desc": True}, {"column": "classid"}])
+        assert len(rows) == 11
+        assert all(row["bldg"].startswith("BEND") for row in rows)
+        assert [row["bldg"] for row in rows] == sorted((row["bldg"] for row in rows), reverse=True)
+
+        rows = database.get_all(TEST_DB, "classes", filters=[{"column": "bldg", "op": "in", "value": ["AL099", "BENDH"]}])
+        assert len(rows) == 6
+        columnar = database.get_all_columnar(TEST_DB, "classes", filters=[{"column": "bldg", "op": "null"}])
+        assert columnar["rows"] == []
+
+        page, _ = database.get_page(TEST_DB, "classes", 5, filters=[{"column": "bldg", "op": "=", "value": "ARCHB"}])
+        assert len(page) == 5 and all(row["bldg"] == "ARCHB" for row in page)
+
+        for bad in ([{"column": "nope", "op": "=", "value": 1}],
+                    [{"column": "bldg", "op": "like", "value": "%"}],
+                    [{"column": "bldg", "op": "between", "value": [1]}],
+                    [{"column": "bldg", "op": "=", "value": {"x": 1}}],
+                    ["bldg"]):
+            with pytest.raises(database.BadFields):
+                database.get_all(TEST_DB, "classes", filters=bad)
+
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')]]
+        rows = database.join(TEST_DB, 'courses', ['crosslistings'], identifiers,
+                             filters=[{"column": "crosslistings.dept", "op": "=", "value": "AAS"}],
+                             sort=[{"column": "coursenum", "desc": True}])
+        assert rows and all(row["dept"] == "AAS" for row in rows)
+        assert [row["coursenum"] for row in rows] == sorted((row["coursenum"] for row in rows), reverse=True)
+        with pytest.raises(database.BadFields):
+            database.join(TEST_DB, 'courses', ['crosslistings'], identifiers,
+                          filters=[{"column": "courseid", "op": "=", "value": 1}])
+
+    def test_search(self, setup):
+        rows, next_offset = database.search(TEST_DB2, "profs", "alex", 2)
+        assert len(rows) == 2 and next_offset == 2
+        assert all("alex" in row["profname"].lower() for row in rows)
+        assert database.get_table_names(TEST_DB2) == ['classes', 'courses', 'coursesprofs', 'crosslistings', 'profs']
+
+        database.insert(TEST_DB2, "profs", {"profid": 9999, "profname": "Quokka Wallaby"})
+        rows, _ = database.search(TEST_DB2, "profs", "quokka", 10)
+        assert [row["profid"] for row in rows] == [9999]
+        database.update(TEST_DB2, "profs", {"profid": 9999, "profname": "Numbat"}, {"profid": 9999})
+        assert database.search(TEST_DB2, "profs", "quokka", 10) == ([], None)
+        database.delete(TEST_DB2, "profs", {"profid": 9999})
+        assert database.search(TEST_DB2, "profs", "numbat", 10) == ([], None)
+
+        with pytest.raises(database.BadFields):
+            database.search(TEST_DB2, "profs", "  ", 10)
+        with pytest.raises(database.BadFields):
+            database.search(TEST_DB2, "coursesprofs", "x", 10)
+        assert database.drop_search_index(TEST_DB2, "profs")
+        assert not database.drop_search_index(TEST_DB2, "profs")
+
+    def test_import_export(self, setup):
+        columns, rows = database.iter_rows(TEST_DB2, "profs")
+        rows = list(rows)
+        assert columns == ["profid", "profname"] and len(rows) == 863
+        with sqlite3.connect(TEST_DB2) as conn:
+            conn.execute("DELETE FROM profs")
+
+        text_rows = ([str(profid), name] for profid, name in rows)
+        assert database.import_rows(TEST_DB2, "profs", columns, text_rows, batch_size=100) == 863
+        assert sorted(database.iter_rows(TEST_DB2, "profs")[1]) == sorted(rows)
+
+        assert database.import_rows(TEST_DB2, "classes", ["classid", "bldg"], [["", "X"]]) == 1
+        assert database.get_all(TEST_DB2, "classes", filters=[{"column": "bldg", "op": "=", "value": "X"}])[0]["classid"] is None
+        # Empty strings are NULL outside of TEXT affinity columns, which INT in the type rules out.
+        with sqlite3.connect(TEST_DB2) as conn:
+            conn.execute("CREATE TABLE codes (code CHARINT, label VARCHAR(10))")
+        assert database.import_rows(TEST_DB2, "codes", ["code", "label"], [["", ""]]) == 1
+        assert database.get_all(TEST_DB2, "codes") == [{"code": None, "label": ""}]
+        with pytest.raises(database.BadFields):
+            database.import_rows(TEST_DB2, "profs", ["profid", "nope"], [])
+        with pytest.raises(database.BadFields):
+            database.import_rows(TEST_DB2, "profs", columns, [["1", "a"], ["2"]])
+
+        columns, rows = database.iter_join_rows(TEST_DB, 'courses', ['crosslistings'],
+                                                [[('courses', 'courseid', 'crosslistings', 'courseid')]])
+        assert columns[0] == "courses.courseid" and len(next(rows)) == len(columns)
+        rows.close()
+
+    def test_stats(self, setup):
+        stats = database.get_stats(TEST_DB2)
+        assert stats["bytes"] == os.path.getsize(TEST_DB2)
+        classes = stats["tables"][0]
+        assert classes["name"] == "classes" and classes["rows"] == 1494 and not classes["rows_estimated"]
+        assert classes["pages"] > 0 and classes["index_bytes"] > 0
+        assert classes["indexes"] == [{"name": "classes_courseid_index", "columns": ["courseid"], "stat": None}]
+
+        database.delete(TEST_DB2, "classes", {"classid": 8321})
+        database.analyze(TEST_DB2)
+        classes = database.get_stats(TEST_DB2)["tables"][0]
+        assert classes["rows"] == 1493 and classes["rows_estimated"]
+        assert classes["indexes"][0]["stat"].startswith("1493 ")
+        assert not database.get_stats(TEST_DB2, exact=True)["tables"][0]["rows_estimated"]
+        assert [table["name"] for table in stats["tables"]] == database.get_table_names(TEST_DB2)
+
+    def test_profile(self, setup):
+        profile = database.profile_table(TEST_DB, "classes")
+        assert profile["rows"] == 1494 and not profile["rows_estimated"]
+        classid, courseid = profile["columns"][:2]
+        assert classid["distinct"] == 1494 and classid["null_fraction"] == 0
+        assert courseid["min"] == min(row["courseid"] for row in database.get_all(TEST_DB, "classes"))
+        assert database.profile_table(TEST_DB, "classes") is profile
+
+        with sqlite3.connect(TEST_DB2) as conn:
+            conn.execute("CREATE TABLE big (id INTEGER PRIMARY KEY, grp INTEGER, ref INTEGER)")
+            conn.executemany("INSERT INTO big VALUES (?, ?, ?)", ((i, i % 10, 1 + i % 800) for i in range(100000)))
+        profile = database.profile_table(TEST_DB2, "big")
+        assert profile["rows_estimated"] and profile["sampled"] <= database.PROFILE_SAMPLE_ROWS
+        assert 90000 <= profile["rows"] <= 100000
+        distinct = {column["column"]: column["distinct"] for column in profile["columns"]}
+        assert distinct["grp"] == 10 and 50000 <= distinct["id"] <= 100000
+        assert profile["columns"][0]["min"] == 0 and profile["columns"][0]["max"] == 99999
+
+        suggestions = database.suggest_joins(TEST_DB, "coursesprofs", "profs")
+        assert (suggestions[0]["left"], suggestions[0]["right"]) == ("profid", "profid")
+        assert suggestions[0]["containment"] == 1.0
+        suggestions = database.suggest_joins(TEST_DB2, "big", "profs")
+        assert (suggestions[0]["left"], suggestions[0]["right"]) == ("ref", "profid")
+
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')],
+                       [('courses', 'courseid', 'coursesprofs', 'courseid')],
+                       [('coursesprofs', 'profid', 'profs', 'profid')]]
+        estimate = database.estimate_join(TEST_DB, 'courses', ['crosslistings', 'coursesprofs', 'profs'], identifiers)
+        assert 1648 / 2 <= estimate <= 1648 * 2
+
+    def test_startup(self, setup):
+        # Only connections to TEST_DB2 may be optimized, which can write to the database.
+        database.close_connections()
+        database.check_db(TEST_DB2, quick_check=True)
+        database.optimize(TEST_DB2)
+        warmed = database.warm_up(TEST_DB2)
+        assert sorted(warmed) == database.get_table_names(TEST_DB2)
+        database.close_connections(optimize=True)
+
+        budget = database.WARM_UP_BYTES
+        try:
+            database.WARM_UP_BYTES = 0
+            assert database.warm_up(TEST_DB2) == []
+        finally:
+            database.WARM_UP_BYTES = budget
+
+        with pytest.raises(database.InvalidDB):
+            database.check_db(TEST_DB2 + ".missing")
+        with open(TEST_DB2, "r+b") as file:
+            file.write(b"Not a database!!")
+        with pytest.raises(database.InvalidDB):
+            database.check_db(TEST_DB2)
+        with open(TEST_DB2, "wb"):
+            pass
+        database.check_db(TEST_DB2, quick_check=True)
+
     def test_update(self, setup):
         update_vals = {
             'days': 'TEST!!!',
@@ -128,6 +366,19 @@ class TestDatabase:
         for key, val in rows[0].items():
             assert ref_row[key] == val
     
+    def test_row_targeting(self, setup):
+        rows = database.get_all(TEST_DB2, "classes", include_rowid=True)
+        assert rows[0][database.ROWID_KEY] == 1
+
+        database.update(TEST_DB2, "classes", {'days': 'F'}, {database.ROWID_KEY: 1, 'days': 'ignored'})
+        assert database.get_all(TEST_DB2, "classes")[0]['days'] == 'F'
+
+        # Identifiers are compared exactly, wildcards are not expanded.
+        database.delete(TEST_DB2, "classes", {'bldg': '%'})
+        assert len(database.get_all(TEST_DB2, "classes")) == len(rows)
+        database.delete(TEST_DB2, "classes", {database.ROWID_KEY: 2})
+        assert len(database.get_all(TEST_DB2, "classes")) == len(rows) - 1
+
     def test_create(self, setup):
         ref_len = 1495
         new_row = {
@@ -156,6 +407,144 @@ class TestDatabase:
         for key, val in rows[-1].items():
             assert new_row[key] == val
     
+    def test_bulk(self, setup):
+        rows = database.get_all(TEST_DB2, "classes")
+        assert database.bulk_delete(TEST_DB2, "classes", rows[:10]) == 10
+        assert database.bulk_insert(TEST_DB2, "classes", rows[:10]) == 10
+        assert len(database.get_all(TEST_DB2, "classes")) == len(rows)
+
+        updates = [({'days': 'X'}, {'classid': row['classid']}) for row in rows[:5]]
+        bad_insert = dict(rows[0], nope=1)
+        with pytest.raises(database.BadFields):
+            database.bulk_apply(TEST_DB2, "classes", rows[5:10], updates, [bad_insert])
+        assert database.get_all(TEST_DB2, "classes")[-10:] == rows[:10]
+
+        result = database.bulk_apply(TEST_DB2, "classes", updates=updates)
+        assert result == {"deleted": 0, "updated": 5, "inserted": 0}
+
+    def test_changes(self, setup):
+        version = database.get_changes(TEST_DB2, "classes")["version"]
+        assert database.get_table_names(TEST_DB2) == ['classes', 'courses', 'coursesprofs', 'crosslistings', 'profs']
+
+        rows = database.get_all(TEST_DB2, "classes", include_rowid=True)
+        database.update(TEST_DB2, "classes", {'bldg': 'X'}, rows[0])
+        database.delete(TEST_DB2, "classes", rows[1])
+        database.update(TEST_DB2, "classes", {'bldg': 'Y'}, rows[2])
+        database.delete(TEST_DB2, "classes", rows[2])
+
+        changes = database.get_changes(TEST_DB2, "classes", version)
+        assert not changes["reset"]
+        assert changes["rows"] == [dict(rows[0], bldg='X')]
+        assert sorted(changes["deleted"]) == [rows[1]['_rowid_'], rows[2]['_rowid_']]
+        assert database.get_changes(TEST_DB2, "courses", version)["rows"] == []
+
+        latest = database.get_changes(TEST_DB2, "classes", changes["version"])
+        assert latest["rows"] == [] and latest["deleted"] == []
+        assert database.get_changes(TEST_DB2, "classes", changes["version"] + 1)["reset"]
+
+        database.get_changes(TEST_DB2, "courses")
+        assert database.drop_change_tracking(TEST_DB2, "classes") == 3
+        assert database.drop_change_tracking(TEST_DB2, "classes") == 0
+        assert database.CHANGE_LOG_TABLE in database.get_schema(TEST_DB2)
+        assert database.drop_change_tracking(TEST_DB2) == 3
+        assert database.CHANGE_LOG_TABLE not in database.get_schema(TEST_DB2)
+
+        # Versions of the dropped log are not valid for the new one.
+        version = database.get_changes(TEST_DB2, "classes")["version"]
+        assert version > latest["version"]
+        database.update(TEST_DB2, "classes", {'bldg': 'Z'}, rows[3])
+        assert database.get_changes(TEST_DB2, "classes", latest["version"])["reset"]
+        assert database.get_changes(TEST_DB2, "classes", version)["rows"] == [dict(rows[3], bldg='Z')]
+
+    def test_limits(self, setup):
+        endless = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+        database.QUERY_TIME_LIMIT = 0.05
+        database.MAX_RESULT_ROWS = 100
+        database.close_connections()
+        try:
+            with pytest.raises(database.QueryTimeout):
+                list(database._iter_query(TEST_DB, endless))
+            with pytest.raises(database.TooManyRows):
+                database.get_all(TEST_DB, "classes")
+        finally:
+            database.QUERY_TIME_LIMIT = None
+            database.MAX_RESULT_ROWS = None
+            database.close_connections()
+
+    def test_busy(self, setup):
+        database.BUSY_TIMEOUT = 0
+        database.WRITE_BACKOFF = 0.001
+        database.close_connections()
+        blocker = sqlite3.connect(TEST_DB2)
+        try:
+            blocker.execute("BEGIN IMMEDIATE")
+            with pytest.raises(database.DatabaseBusy):
+                database.update(TEST_DB2, "classes", {'bldg': 'X'}, {'classid': 8321})
+            blocker.rollback()
+            database.update(TEST_DB2, "classes", {'bldg': 'X'}, {'classid': 8321})
+        finally:
+            blocker.close()
+            database.BUSY_TIMEOUT = 5.0
+            database.WRITE_BACKOFF = 0.05
+            database.close_connections()
+
+    def test_group_commit(self, setup):
+        rows = database.get_all(TEST_DB2, "classes", include_rowid=True)[:20]
+        errors = []
+
+        def edit(row):
+            try:
+                database.update(TEST_DB2, "classes", {'bldg': 'G'}, row)
+            except database.DatabaseError as ex:
+                errors.append(ex)
+
+        database.GROUP_COMMIT_WINDOW = 0.05
+        try:
+            threads = [threading.Thread(target=edit, args=(row,)) for row in rows]
+            threads.append(threading.Thread(target=edit, args=({'nope': 1},)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            database.GROUP_COMMIT_WINDOW = None
+
+        assert len(errors) == 1 and isinstance(errors[0], database.BadFields)
+        updated = database.get_all(TEST_DB2, "classes", include_rowid=True)[:20]
+        assert updated == [dict(row, bldg='G') for row in rows]
+
+    def test_snapshot(self, setup):
+        database.SNAPSHOT_INTERVAL = 0.05
+        try:
+            rows = database.get_all(TEST_DB2, "classes", include_rowid=True)
+            version = database.data_version(TEST_DB2)
+            database.update(TEST_DB2, "classes", {'bldg': 'S'}, rows[0])
+            assert database.get_all(TEST_DB2, "classes")[0]['bldg'] == 'S'
+            assert database.data_version(TEST_DB2) != version
+
+            other = sqlite3.connect(TEST_DB2)
+            with other:
+                other.execute("UPDATE classes SET bldg = 'T' WHERE rowid = ?", (rows[0]['_rowid_'],))
+            other.close()
+            deadline = time.monotonic() + 5
+            while database.get_page(TEST_DB2, "classes", 1)[0][0]['bldg'] != 'T':
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+            with pytest.raises(sqlite3.OperationalError):
+                with database._read_connection(TEST_DB2) as conn:
+                    conn.execute("DELETE FROM classes")
+
+            # A snapshot retired between being looked up and checked out.
+            snapshot = database._current_snapshot(TEST_DB2)
+            database.update(TEST_DB2, "classes", {'bldg': 'U'}, rows[0])
+            assert snapshot.retired and snapshot.checkout() is None
+            with database._read_connection(TEST_DB2) as conn:
+                assert conn.execute("SELECT bldg FROM classes WHERE rowid = ?", (rows[0]['_rowid_'],)).fetchone() == ('U',)
+        finally:
+            database.SNAPSHOT_INTERVAL = None
+            database.close_connections()
+
     def test_join(self):
         ref_len = 1648
         ref_row = {
@@ -178,6 +567,72 @@ class TestDatabase:
         for key, val in ref_row.items():
             assert rows[0][key] == val
     
+    def test_join_page(self):
+        prim_table = 'courses'
+        tables = ['crosslistings']
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')]]
+        database.clear_join_cache()
+        pages = []
+        offset = 0
+        while offset is not None:
+            page = database.join_page(TEST_DB, prim_table, tables, identifiers, offset, 400)
+            pages += page["rows"]
+            offset = page["next"]
+        rows = database.join_columnar(TEST_DB, prim_table, tables, identifiers)["rows"]
+        assert pages == rows
+        # Now sliced from the cached result.
+        assert database.join_page(TEST_DB, prim_table, tables, identifiers, 1000, 10)["rows"] == rows[1000:1010]
+        with pytest.raises(database.DatabaseError):
+            database.join_page(TEST_DB, prim_table, tables, identifiers, -1, 10)
+
+    def test_iter_join(self):
+        prim_table = 'courses'
+        tables = ['crosslistings']
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')]]
+        rows = database.iter_join(TEST_DB, prim_table, tables, identifiers, batch_size=7)
+        assert list(rows) == database.join(TEST_DB, prim_table, tables, identifiers)
+        with pytest.raises(database.InvalidTable):
+            database.iter_join(TEST_DB, 'nope', tables, identifiers)
+
+    def test_join_cache(self, setup):
+        prim_table = 'courses'
+        tables = ['crosslistings']
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')]]
+        rows = database.join(TEST_DB2, prim_table, tables, identifiers)
+        assert database.join(TEST_DB2, prim_table, tables, [[list(identifiers[0][0])]]) is rows
+
+        database.delete(TEST_DB2, 'crosslistings', {'courseid': rows[0]['courseid']})
+        new_rows = database.join(TEST_DB2, prim_table, tables, identifiers)
+        assert new_rows is not rows
+        assert len(new_rows) < len(rows)
+
+    def test_join_indexes(self, setup):
+        prim_table = 'courses'
+        tables = ['crosslistings']
+        identifiers = [[('courses', 'title', 'crosslistings', 'dept')]]
+        plan = database.explain_join(TEST_DB2, prim_table, tables, identifiers)
+        assert plan["plan"][0]["access"] == "scan"
+        assert len(plan["missing_indexes"]) == 1
+
+        created = database.create_join_indexes(TEST_DB2, prim_table, tables, identifiers)
+        assert len(created) == 1
+        plan = database.explain_join(TEST_DB2, prim_table, tables, identifiers)
+        assert plan["missing_indexes"] == []
+        assert plan["plan"][1]["access"] == "index"
+
+        # A searched outer table does not hide a scan of the inner one.
+        filters = [{"column": "courses.courseid", "op": "=", "value": 5}]
+        identifiers = [[('courses', 'title', 'crosslistings', 'coursenum')]]
+        plan = database.explain_join(TEST_DB2, prim_table, tables, identifiers, filters)
+        assert [entry["access"] for entry in plan["plan"]] == ["index", "scan"]
+        assert plan["missing_indexes"] == [{"table": "crosslistings", "columns": ["coursenum"]}]
+
+        # Plan details as written by SQLite before 3.36.
+        assert database._plan_access("SCAN TABLE courses") == ("courses", "scan")
+        assert database._plan_access("SEARCH TABLE crosslistings USING AUTOMATIC COVERING INDEX (dept=?)") == \
+            ("crosslistings", "automatic")
+        assert database._plan_access("USE TEMP B-TREE FOR ORDER BY") == (None, "other")
+
     @pytest.mark.stress
     def test_stress1(self, setup):
         iters = 1
@@ -193,6 +648,19 @@ class TestDatabase:
             rows_restored = database.get_all(TEST_DB2, 'classes')
             assert len(rows_restored) == ref_len
     
+    @pytest.mark.stress
+    def test_stress_bulk(self, setup):
+        iters = 10
+        ref_len = 1494
+        for i in range(iters):
+            rows = database.get_all(TEST_DB2, 'classes')
+            database.bulk_delete(TEST_DB2, 'classes', rows)
+            rows_deleted = database.get_all(TEST_DB2, 'classes')
+            assert len(rows_deleted) == 0
+            database.bulk_insert(TEST_DB2, 'classes', rows)
+            rows_restored = database.get_all(TEST_DB2, 'classes')
+            assert len(rows_restored) == ref_len
+
     @pytest.mark.stress
     def test_stress2(self, setup):
         iters = 2
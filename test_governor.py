@@ -0,0 +1,37 @@
+import threading
+
+import governor
+
+import pytest
+
+
+class TestGovernor:
+    def test_limit(self):
+        limit = governor.Limit(1, 1)
+        assert limit.acquire(0)
+        assert not limit.acquire(0.01)
+
+        waiter = threading.Thread(target=lambda: limit.acquire(10))
+        waiter.start()
+        while limit.waiting == 0:
+            pass
+        # The only queue place is taken.
+        assert not limit.acquire(10)
+        limit.release()
+        waiter.join()
+        assert limit.active == 1
+
+    def test_admit(self):
+        governor.reset()
+        governor.ROUTE_LIMITS["/test"] = (1, 0)
+        try:
+            slot = governor.admit("/test")
+            with pytest.raises(governor.Saturated):
+                governor.admit("/test")
+            slot.release()
+            slot.release()
+            governor.admit("/test").release()
+            assert governor.admit("/api/metrics") is None
+        finally:
+            del governor.ROUTE_LIMITS["/test"]
+            governor.reset()
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import jobs
+
+
+TEST_DB = "example_dbs/reg.sqlite"
+
+
+def wait_for(job, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition(job.describe()):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestJobs:
+    def test_join_job(self):
+        prim_table = 'courses'
+        tables = ['crosslistings', 'coursesprofs', 'profs']
+        identifiers = [[('courses', 'courseid', 'crosslistings', 'courseid')],
+                       [('courses', 'courseid', 'coursesprofs', 'courseid')],
+                       [('coursesprofs', 'profid', 'profs', 'profid')]]
+        job = jobs.submit_join(TEST_DB, prim_table, tables, identifiers)
+        wait_for(job, lambda status: status["status"] == "done")
+        assert job.describe()["rows"] == 1648
+        result = job.read(1640, 100)
+        assert len(result["rows"]) == 8
+        assert result["columns"][0] == "courses.courseid"
+        assert jobs.get_job(job.id) is job
+        assert jobs.discard(job.id)
+        assert jobs.get_job(job.id) is None
+
+    def test_cancel(self):
+        endless = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+        job = jobs.Job(TEST_DB, endless, {"columns": ["count"], "types": ["INTEGER"]})
+        jobs._jobs[job.id] = job
+        thread = threading.Thread(target=jobs._run, args=(job,))
+        thread.start()
+        wait_for(job, lambda status: status["progress"] > 0)
+        jobs.cancel(job.id)
+        thread.join(10)
+        assert job.describe()["status"] == "cancelled"
+        assert jobs.discard(job.id)
+
+    def test_cancel_after_time_limit(self):
+        endless = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+        jobs.database.QUERY_TIME_LIMIT = 0.01
+        try:
+            job = jobs.Job(TEST_DB, endless, {"columns": ["count"], "types": ["INTEGER"]})
+            jobs._jobs[job.id] = job
+            thread = threading.Thread(target=jobs._run, args=(job,))
+            thread.start()
+            wait_for(job, lambda status: status["progress"] > 0)
+            time.sleep(0.05)
+            jobs.cancel(job.id)
+            thread.join(10)
+        finally:
+            jobs.database.QUERY_TIME_LIMIT = None
+        assert job.describe()["status"] == "cancelled"
+        assert jobs.discard(job.id)
+
+    def test_limits(self):
+        max_rows, max_finished = jobs.MAX_JOB_ROWS, jobs.MAX_FINISHED_JOBS
+        jobs.MAX_JOB_ROWS, jobs.MAX_FINISHED_JOBS = 100, 2
+        try:
+            submitted = [jobs.submit_join(TEST_DB, 'courses', ['crosslistings'],
+                                          [[('courses', 'courseid', 'crosslistings', 'courseid')]])
+                         for _ in range(3)]
+            for job in submitted:
+                wait_for(job, lambda status: status["status"] != "running" and status["status"] != "queued")
+                assert job.describe()["status"] == "failed"
+            jobs.get_job(submitted[2].id)
+            assert jobs.get_job(submitted[0].id) is None
+            assert jobs.get_job(submitted[2].id) is submitted[2]
+        finally:
+            jobs.MAX_JOB_ROWS, jobs.MAX_FINISHED_JOBS = max_rows, max_finished
+            for job in submitted:
+                jobs.discard(job.id)
@@ -0,0 +1,25 @@
+import database
+import metrics
+
+
+TEST_DB = "example_dbs/reg.sqlite"
+
+
+class TestMetrics:
+    def test_record_query(self):
+        metrics.reset()
+        database.get_all(TEST_DB, "classes")
+        text = metrics.render()
+        assert 'sqlite_browser_sql_statements_total{route="none"}' in text
+        assert "# TYPE sqlite_browser_sql_duration_seconds histogram" in text
+        assert 'sqlite_browser_sql_duration_seconds_bucket{le="+Inf"}' in text
+
+    def test_request_route(self):
+        metrics.reset()
+        metrics.start_request("/api/get_all/<table>")
+        metrics.increment("rows_fetched", 3)
+        metrics.end_request("GET", 200)
+        text = metrics.render()
+        assert 'sqlite_browser_rows_fetched_total{route="/api/get_all/<table>"} 3' in text
+        assert 'sqlite_browser_requests_total{route="/api/get_all/<table>",method="GET",status="200"} 1' in text
+        assert metrics.current_route() == "none"
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+
+import server
+
+import pytest
+
+
+TEST_DB = "example_dbs/reg.sqlite"
+TEST_DB2 = "example_dbs/reg_test.sqlite" # Use this for anything that modifies db
+
+
+class TestServer:
+    @pytest.fixture
+    def client(self):
+        shutil.copy(TEST_DB, TEST_DB2)
+        server.DB_URL = TEST_DB2
+        yield server.app.test_client()
+        os.remove(TEST_DB2)
+
+    def test_etags(self, client):
+        for url in ["/", "/api/get_tables", "/api/get_columns", "/api/get_all/classes"]:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.headers["Cache-Control"] == "no-cache"
+            cached = client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+            assert cached.status_code == 304
+            assert cached.data == b""
+
+        tables_etag = client.get("/api/get_tables").headers["ETag"]
+        rows_etag = client.get("/api/get_all/classes").headers["ETag"]
+        columnar_etag = client.get("/api/get_all/classes?format=columnar").headers["ETag"]
+        assert columnar_etag != rows_etag
+
+        client.post("/api/update/classes", json={"values": {"bldg": "X"}, "identifiers": {"classid": 8321}})
+        assert client.get("/api/get_all/classes", headers={"If-None-Match": rows_etag}).status_code == 200
+        assert client.get("/api/get_tables", headers={"If-None-Match": tables_etag}).status_code == 304
+
+    def test_governor(self, client):
+        server.database.MAX_RESULT_ROWS = 10
+        try:
+            assert client.get("/api/get_all/classes").status_code == 413
+            assert client.get("/api/get_page/classes?limit=5").status_code == 200
+        finally:
+            server.database.MAX_RESULT_ROWS = None
+
+        server.governor.reset()
+        server.governor.ROUTE_LIMITS["/api/get_tables"] = (0, 0)
+        try:
+            response = client.get("/api/get_tables")
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == str(server.governor.RETRY_AFTER)
+        finally:
+            del server.governor.ROUTE_LIMITS["/api/get_tables"]
+            server.governor.reset()
+
+    def test_page_cursor(self, client):
+        response = client.get("/api/get_page/classes?limit=5")
+        after = json.dumps(response.json["next"])
+        assert client.get("/api/get_page/classes", query_string={"limit": 5, "after": after}).status_code == 200
+        for after in ["5", "[1, 2]", '[{"a": 1}]', "[1"]:
+            assert client.get("/api/get_page/classes", query_string={"after": after}).status_code == 400
+
+    def test_filters(self, client):
+        spec = '[{"column": "bldg", "op": "prefix", "value": "BEND"}]'
+        response = client.get("/api/get_all/classes", query_string={"filter": spec, "sort": '[{"column": "classid"}]'})
+        assert response.status_code == 200
+        assert len(response.json["data"]) == 11
+
+        response = client.get("/api/get_page/classes", query_string={"filter": spec, "limit": 5})
+        assert len(response.json["data"]) == 5
+        assert client.get("/api/get_all/classes", query_string={"filter": "["}).status_code == 400
+        assert client.get("/api/get_all/classes", query_string={"filter": '[{"column": "x", "op": "="}]'}).status_code == 400
+
+        response = client.post("/api/join", json={
+            "prim_table": "courses", "tables": ["crosslistings"],
+            "identifiers": [[["courses", "courseid", "crosslistings", "courseid"]]],
+            "filters": [{"column": "dept", "op": "=", "value": "AAS"}]})
+        assert response.status_code == 200
+        assert response.json and all(row["dept"] == "AAS" for row in response.json)
+
+        response = client.post("/api/join?format=columnar&limit=3&offset=2", json={
+            "prim_table": "courses", "tables": ["crosslistings"],
+            "identifiers": [[["courses", "courseid", "crosslistings", "courseid"]]]})
+        assert len(response.json["rows"]) == 3 and response.json["next"] == 5
+
+    def test_search(self, client):
+        assert client.get("/api/search/profs?q=alex").status_code == 403
+        server.SEARCH_ENABLED = True
+        try:
+            response = client.get("/api/search/profs", query_string={"q": "alex", "limit": 2})
+            assert response.status_code == 200
+            assert len(response.json["data"]) == 2 and response.json["next"] == 2
+            assert client.get("/api/search/profs?q=").status_code == 400
+            assert client.delete("/api/search/profs").json is True
+        finally:
+            server.SEARCH_ENABLED = False
+
+    def test_changes(self, client):
+        assert client.get("/api/changes/classes").status_code == 403
+        server.CHANGE_TRACKING_ENABLED = True
+        try:
+            version = client.get("/api/changes/classes").json["version"]
+            assert client.get("/api/changes/classes", query_string={"since": version}).json["reset"] is False
+            assert client.delete("/api/changes/classes").json == 3
+            assert client.delete("/api/changes").json == 0
+        finally:
+            server.CHANGE_TRACKING_ENABLED = False
+        assert client.delete("/api/changes").status_code == 403
+
+    def test_csv(self, client):
+        response = client.get("/api/export/profs", query_string={"filter": '[{"column": "profid", "op": "<", "value": 10}]'})
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+        lines = response.data.decode().splitlines()
+        assert lines[0] == "profid,profname" and len(lines) == 11
+
+        response = client.post("/api/import/profs", data="\n".join(lines).encode(), content_type="text/csv")
+        assert response.json == {"imported": 10}
+        response = client.post("/api/import/profs", data=b"profid,nope\n1,x\n", content_type="text/csv")
+        assert response.status_code == 400
+
+        response = client.post("/api/export/join", json={
+            "prim_table": "courses", "tables": ["crosslistings"],
+            "identifiers": [[["courses", "courseid", "crosslistings", "courseid"]]]})
+        assert response.data.startswith(b"courses.courseid,")
+
+    def test_stats(self, client):
+        response = client.get("/api/stats")
+        assert response.status_code == 200
+        assert [table["rows"] for table in response.json["tables"]][:2] == [1494, 1158]
+        assert client.get("/api/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        assert client.post("/api/stats/analyze").status_code == 403
+
+    def test_profile(self, client):
+        response = client.get("/api/profile/profs")
+        assert response.status_code == 200
+        assert [column["column"] for column in response.json["columns"]] == ["profid", "profname"]
+        response = client.get("/api/join/suggest", query_string={"left": "coursesprofs", "right": "profs"})
+        assert response.json[0]["left"] == "profid"
+        response = client.post("/api/join/estimate", json={
+            "prim_table": "courses", "tables": ["crosslistings"],
+            "identifiers": [[["courses", "courseid", "crosslistings", "courseid"]]]})
+        assert response.json["estimated_rows"] > 0
+        assert client.get("/api/profile/nope").status_code == 400